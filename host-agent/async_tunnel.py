@@ -0,0 +1,546 @@
+"""
+Async Tunnel Engine
+Runs the Pato2 WebSocket, local TCP streams and UDP sessions on a single asyncio event loop
+"""
+
+import asyncio
+import base64
+import json
+import logging
+from typing import Dict, List, Optional
+
+try:
+    import websockets
+except ImportError:  # Optional dependency, only required for TUNNEL_ENGINE=asyncio
+    websockets = None
+
+from control_client import Backoff
+from frame_batcher import FrameBatcher
+from recv_buffers import AdaptiveReadSize
+from udp_sessions import UdpSessionTracker
+from tunnel_protocol import (
+    OP_BATCH, OP_DATA, OP_UDP_DATA, FrameError, TunnelOptions,
+    decode_frame, encode_frame, iter_batch
+)
+
+
+class UdpSessionProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint relaying one Bedrock client to the local server"""
+
+    def __init__(self, engine: 'AsyncTunnelEngine', client_id: str):
+        self.engine = engine
+        self.client_id = client_id
+
+    def datagram_received(self, data: bytes, addr):
+        self.engine.send_udp_data(self.client_id, data)
+
+    def error_received(self, exc: Exception):
+        self.engine.logger.debug(f"UDP error for client {self.client_id}: {exc}")
+
+
+class StreamState:
+    """Local TCP connection backing a tunnel stream"""
+
+    def __init__(self, target_port: int, send_window: int):
+        self.target_port = target_port
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        # Payloads received from Pato2 before the local connect completed
+        self.pending: List[bytes] = []
+
+        # Flow control (0 window = disabled)
+        self.send_window = send_window
+        self.in_flight = 0
+        self.credit = asyncio.Event()
+        self.credit.set()
+        self.written = 0
+        self.acked = 0
+        self.ack_task: Optional[asyncio.Task] = None
+
+    def buffered_bytes(self) -> int:
+        if self.writer is None:
+            return sum(len(p) for p in self.pending)
+        return self.writer.transport.get_write_buffer_size()
+
+    def get_status(self) -> dict:
+        return {
+            'target_port': self.target_port,
+            'buffered_bytes': self.buffered_bytes(),
+            'in_flight_bytes': self.in_flight,
+            'send_window': self.send_window
+        }
+
+
+class AsyncTunnelEngine:
+    """Event-loop based alternative to the thread-per-stream tunnel in HostAgent
+
+    Speaks exactly the same message protocol as HostAgent.on_websocket_message.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        # Striped lanes and stream resumption are threaded-engine features, never advertise them from here
+        self.config = dict(agent.config, tunnel_lanes=0, stream_resume=False)
+        self.logger = logging.getLogger('AsyncTunnelEngine')
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.ws = None
+        self.options = TunnelOptions()
+        self.streams: Dict[str, StreamState] = {}
+        self.udp_sessions: Dict[str, asyncio.DatagramTransport] = {}
+        self.udp_targets: Dict[str, int] = {}
+        self.udp_tracker = UdpSessionTracker(self.config['udp_max_sessions'], self.config['udp_idle_timeout'])
+        self.udp_pending = UdpSessionTracker(self.config['udp_max_sessions'], self.config['udp_idle_timeout'])
+        self.stop_event: Optional[asyncio.Event] = None
+        self.gave_up = False
+        self.backoff = Backoff(self.config['reconnect_delay'], self.config['reconnect_max_delay'])
+        self.batcher = FrameBatcher(
+            self.send_frame_threadsafe,
+            self.config['batch_flush_ms'] / 1000.0,
+            self.config['batch_max_bytes'],
+            self.config['batch_bypass_bytes']
+        )
+
+    @staticmethod
+    def is_available() -> bool:
+        """Check if the optional websockets dependency is installed"""
+        return websockets is not None
+
+    def run(self):
+        """Blocking entry point, meant to run in its own thread"""
+        asyncio.run(self.main())
+        if self.gave_up:
+            self.agent.shutdown()
+
+    def get_status(self) -> dict:
+        """Tunnel status including per-stream buffered bytes"""
+        return {
+            'engine': 'asyncio',
+            'connected': self.ws is not None,
+            'options': self.options.describe(),
+            'streams': {stream_id: state.get_status() for stream_id, state in list(self.streams.items())},
+            'udp_clients': len(self.udp_sessions),
+            'connection_pool': self.agent.connection_pool.get_metrics(),
+            'bedrock_pong': self.agent.get_pong_metrics(),
+            'heartbeat': self.agent.get_heartbeat_metrics(),
+            'udp_sessions': self.udp_tracker.get_metrics(),
+            'udp_pending': self.udp_pending.get_metrics(),
+            'batching': self.batcher.get_metrics()
+        }
+
+    def stop(self):
+        """Ask the event loop to close the tunnel (thread-safe)"""
+        if self.loop and self.stop_event and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def main(self):
+        """WebSocket connection loop with reconnection"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.batcher.start()
+        sweeper = asyncio.create_task(self.udp_sweep_loop())
+
+        while self.agent.running and self.agent.reconnect_attempts_left(self.backoff):
+            try:
+                await self.run_connection()
+            except Exception as e:
+                self.logger.error(f"WebSocket error: {e}")
+            finally:
+                await self.close_all_connections()
+
+            if not self.agent.running or self.stop_event.is_set():
+                break
+            if self.agent.control.dns:
+                self.agent.control.dns.invalidate()
+            delay = self.backoff.next_delay()
+            self.logger.warning(f"WebSocket disconnected, reconnecting in {delay:.1f}s... (attempt {self.backoff.attempts})")
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        sweeper.cancel()
+        self.batcher.stop()
+        if not self.stop_event.is_set() and not self.agent.reconnect_attempts_left(self.backoff):
+            self.logger.error("Max reconnection attempts reached, shutting down")
+            self.gave_up = True
+
+    async def run_connection(self):
+        """Run one WebSocket session until it closes or the engine is stopped"""
+        url = self.agent.build_websocket_url()
+        self.logger.info(f"Connecting to WebSocket: {url}")
+
+        async with websockets.connect(url, max_size=None, ping_interval=None) as ws:
+            self.ws = ws
+            self.backoff.reset()
+            self.options = TunnelOptions()
+            self.logger.info("WebSocket connected")
+            await self.send(TunnelOptions.build_hello(self.config))
+
+            receiver = asyncio.ensure_future(self.receive_loop(ws))
+            stopper = asyncio.ensure_future(self.stop_event.wait())
+            try:
+                await asyncio.wait([receiver, stopper], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stopper.cancel()
+                receiver.cancel()
+                self.ws = None
+        self.logger.warning("WebSocket closed")
+
+    async def receive_loop(self, ws):
+        async for message in ws:
+            try:
+                if isinstance(message, bytes):
+                    self.handle_binary_frame(message)
+                else:
+                    self.handle_message(json.loads(message))
+            except Exception as e:
+                self.logger.error(f"Error handling WebSocket message: {e}")
+
+    # ---- Outbound ----
+
+    async def send(self, message):
+        """Send a JSON-serialisable dict or an encoded binary frame"""
+        ws = self.ws
+        if ws is None:
+            return
+        try:
+            await ws.send(message if isinstance(message, bytes) else json.dumps(message))
+        except Exception as e:
+            self.logger.error(f"Error sending WebSocket message: {e}")
+
+    def schedule_send(self, message):
+        """Queue a send from synchronous callbacks running on the loop"""
+        if self.options.batch_frames and not isinstance(message, bytes):
+            # Keep control messages (close, ack, ...) behind data already batched
+            self.batcher.flush('control')
+            self.loop.call_soon(self.schedule_send_now, message)
+        else:
+            self.schedule_send_now(message)
+
+    def send_threadsafe(self, message) -> bool:
+        """Queue a send from another thread, False when not connected"""
+        if self.ws is None or not self.loop or self.loop.is_closed():
+            return False
+        self.loop.call_soon_threadsafe(self.schedule_send, message)
+        return True
+
+    def schedule_send_now(self, message):
+        self.loop.create_task(self.send(message))
+
+    def send_frame_threadsafe(self, frame: bytes):
+        """FrameBatcher callback, may run on the batcher's flush thread"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.schedule_send_now, frame)
+
+    def send_stream_data(self, stream_id: str, data: bytes):
+        if self.options.batch_frames:
+            self.batcher.submit(OP_DATA, stream_id, data)
+        else:
+            self.schedule_send(self.stream_data_message(stream_id, data))
+
+    def send_udp_data(self, client_id: str, data: bytes):
+        self.udp_tracker.touch(client_id)
+        if self.options.batch_frames:
+            self.batcher.submit(OP_UDP_DATA, client_id, data)
+        else:
+            self.schedule_send(self.udp_data_message(client_id, data))
+
+    def stream_data_message(self, stream_id: str, data: bytes):
+        if self.options.binary_frames:
+            return encode_frame(OP_DATA, stream_id, data)
+        return {
+            'type': 'data',
+            'streamId': stream_id,
+            'data': base64.b64encode(data).decode('ascii')
+        }
+
+    def udp_data_message(self, client_id: str, data: bytes):
+        if self.options.binary_frames:
+            return encode_frame(OP_UDP_DATA, client_id, data)
+        return {
+            'type': 'udp_data',
+            'clientId': client_id,
+            'data': base64.b64encode(data).decode('ascii')
+        }
+
+    # ---- Inbound ----
+
+    def handle_message(self, data: dict):
+        message_type = data.get('type')
+
+        if message_type == 'open':
+            self.loop.create_task(self.open_stream(data))
+        elif message_type == 'data':
+            self.write_stream(data.get('streamId'), base64.b64decode(data.get('data') or ''))
+        elif message_type == 'close':
+            self.loop.create_task(self.close_stream(data.get('streamId')))
+        elif message_type == 'udp_open':
+            # Socket opened by the first datagram that is not a ping (see HostAgent.handle_udp_open)
+            if data.get('clientId'):
+                self.announce_udp(data['clientId'], self.agent.udp_target_port(data))
+        elif message_type == 'udp_data':
+            self.write_udp(data.get('clientId'), base64.b64decode(data.get('data') or ''))
+        elif message_type == 'udp_close':
+            self.close_udp(data.get('clientId'))
+        elif message_type == 'backup_command':
+            self.agent.handle_backup_command(data)
+        elif message_type == 'ping':
+            self.schedule_send({'type': 'pong'})
+        elif message_type == 'ack':
+            self.release_credit(data.get('streamId'), data.get('bytes'))
+        elif message_type == 'heartbeat_ack':
+            self.agent.handle_heartbeat_ack(data)
+        elif message_type == 'hello_ack':
+            self.options = TunnelOptions.from_hello_ack(self.config, data)
+            self.logger.info(f"Tunnel protocol negotiated: {self.options.describe()}")
+        else:
+            self.logger.warning(f"Unknown message type: {message_type}")
+
+    def handle_binary_frame(self, frame: bytes):
+        try:
+            opcode, channel_id, payload = decode_frame(frame)
+            if opcode == OP_BATCH:
+                for record in iter_batch(payload):
+                    self.dispatch_binary_record(*record)
+            else:
+                self.dispatch_binary_record(opcode, channel_id, payload)
+        except FrameError as e:
+            self.logger.error(f"Invalid binary frame: {e}")
+
+    def dispatch_binary_record(self, opcode: int, channel_id: str, payload: memoryview):
+        if opcode == OP_DATA:
+            self.write_stream(channel_id, bytes(payload))
+        elif opcode == OP_UDP_DATA:
+            self.write_udp(channel_id, bytes(payload))
+        else:
+            self.logger.warning(f"Unknown binary frame opcode: {opcode}")
+
+    # ---- TCP streams ----
+
+    async def open_stream(self, data: dict):
+        stream_id = data.get('streamId')
+        client_address = data.get('clientAddress', 'unknown')
+        try:
+            target_port = int(data.get('targetPort') or self.config['minecraft_port'])
+        except Exception:
+            target_port = self.config['minecraft_port']
+
+        if target_port == self.config['minecraft_port']:
+            self.logger.info(f"Jugador Java conectando: {client_address} (stream {stream_id})")
+        else:
+            self.logger.debug(f"Opening stream {stream_id} for client {client_address} -> 127.0.0.1:{target_port}")
+
+        send_window = self.options.send_window if self.options.flow_control else 0
+        state = StreamState(target_port, send_window)
+        self.streams[stream_id] = state
+        pool = self.agent.connection_pool
+        started = self.loop.time()
+        try:
+            sock = pool.take(target_port)
+            if sock is not None:
+                sock.setblocking(False)
+                reader, writer = await asyncio.open_connection(sock=sock)
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', target_port), timeout=10
+                )
+            pool.open_latency.observe((self.loop.time() - started) * 1000)
+        except Exception as e:
+            self.streams.pop(stream_id, None)
+            self.logger.error(f"Failed to open stream {stream_id}: {e}")
+            await self.send({'type': 'error', 'streamId': stream_id, 'data': str(e)})
+            return
+
+        if self.streams.get(stream_id) is not state:
+            # Closed by Pato2 while connecting
+            writer.close()
+            return
+
+        state.writer = writer
+        if self.options.flow_control:
+            # Make drain() wait for a fully flushed buffer so acks mean "delivered"
+            writer.transport.set_write_buffer_limits(high=0)
+        pending, state.pending = state.pending, []
+        for payload in pending:
+            self.write_stream(stream_id, payload)
+        state.reader_task = self.loop.create_task(self.pump_stream(stream_id, state, reader))
+
+    async def pump_stream(self, stream_id: str, state: StreamState, reader: asyncio.StreamReader):
+        """Forward data from the local server to Pato2"""
+        read_size = AdaptiveReadSize(self.config['stream_read_min'], self.config['stream_read_max'])
+        try:
+            while True:
+                # Stop reading while the player's side has too much unacknowledged data
+                await state.credit.wait()
+                data = await reader.read(read_size.size)
+                if not data:
+                    break
+                read_size.update(len(data))
+                if state.send_window:
+                    state.in_flight += len(data)
+                    if state.in_flight >= state.send_window:
+                        state.credit.clear()
+                if self.options.batch_frames:
+                    self.batcher.submit(OP_DATA, stream_id, data)
+                else:
+                    await self.send(self.stream_data_message(stream_id, data))
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            self.logger.error(f"Error reading from Minecraft server for {stream_id}: {e}")
+        await self.close_stream(stream_id)
+
+    def write_stream(self, stream_id: str, payload: bytes):
+        state = self.streams.get(stream_id)
+        if not state:
+            self.logger.warning(f"Received data for unknown stream: {stream_id}")
+            return
+        try:
+            if state.writer is None:
+                state.pending.append(payload)
+                buffered = sum(len(p) for p in state.pending)
+            else:
+                state.writer.write(payload)
+                state.written += len(payload)
+                buffered = state.writer.transport.get_write_buffer_size()
+                if self.options.flow_control and state.ack_task is None:
+                    state.ack_task = self.loop.create_task(self.ack_delivered(stream_id, state))
+        except Exception as e:
+            self.logger.error(f"Error handling stream data for {stream_id}: {e}")
+            self.loop.create_task(self.close_stream(stream_id))
+            return
+
+        if buffered > self.config['stream_write_buffer']:
+            self.logger.error(f"Write buffer full for stream {stream_id} ({buffered} bytes pending), closing")
+            self.loop.create_task(self.close_stream(stream_id))
+
+    async def ack_delivered(self, stream_id: str, state: StreamState):
+        """Acknowledge bytes flushed to the local server once over the ack threshold"""
+        try:
+            await state.writer.drain()
+        except Exception:
+            return
+        finally:
+            state.ack_task = None
+        delivered = state.written - state.writer.transport.get_write_buffer_size()
+        if delivered - state.acked >= self.options.ack_threshold:
+            acked, state.acked = delivered - state.acked, delivered
+            self.schedule_send({'type': 'ack', 'streamId': stream_id, 'bytes': acked})
+
+    def release_credit(self, stream_id: str, nbytes):
+        state = self.streams.get(stream_id)
+        if not state:
+            return
+        try:
+            state.in_flight = max(0, state.in_flight - int(nbytes or 0))
+        except (TypeError, ValueError):
+            self.logger.warning(f"Invalid ack for stream {stream_id}: {nbytes}")
+            return
+        if state.in_flight < state.send_window:
+            state.credit.set()
+
+    async def close_stream(self, stream_id: str, notify: bool = True):
+        state = self.streams.pop(stream_id, None)
+        if not state:
+            return
+        if state.reader_task and state.reader_task is not asyncio.current_task():
+            state.reader_task.cancel()
+        if state.writer:
+            try:
+                state.writer.close()
+            except Exception:
+                pass
+        if notify:
+            self.schedule_send({'type': 'close', 'streamId': stream_id})
+
+    # ---- UDP sessions ----
+
+    async def udp_sweep_loop(self):
+        """Periodically close UDP sessions (and ping-only clients) idle for too long"""
+        while True:
+            await asyncio.sleep(self.udp_tracker.sweep_interval())
+            for client_id in self.udp_tracker.expired() + self.udp_pending.expired():
+                self.logger.debug(f"UDP client {client_id} idle, closing")
+                self.drop_udp(client_id)
+
+    def drop_udp(self, client_id: str):
+        """Close a UDP client on our own initiative and tell Pato2 to forget it"""
+        self.close_udp(client_id)
+        if self.ws is not None:
+            self.schedule_send({'type': 'udp_close', 'clientId': client_id})
+
+    def announce_udp(self, client_id: str, target_port: int):
+        """Remember a client's target port until its first datagram that is not a ping"""
+        self.udp_targets[client_id] = target_port
+        if client_id not in self.udp_sessions:
+            victim = self.udp_pending.add(client_id)
+            if victim:
+                self.drop_udp(victim)
+
+    async def open_udp(self, client_id: str, target_port: int, implicit: bool = False):
+        if client_id in self.udp_sessions:
+            return
+        try:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: UdpSessionProtocol(self, client_id),
+                remote_addr=('127.0.0.1', target_port)
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to open UDP client {client_id}: {e}")
+            return
+        if client_id in self.udp_sessions:
+            transport.close()
+            return
+        self.udp_sessions[client_id] = transport
+        self.udp_pending.remove(client_id)
+        victim = self.udp_tracker.add(client_id, implicit)
+        if victim:
+            self.logger.warning(f"UDP session limit ({self.config['udp_max_sessions']}) reached, evicting {victim}")
+            self.drop_udp(victim)
+        self.logger.info(f"Jugador Bedrock conectando: {client_id} -> 127.0.0.1:{target_port}")
+
+    def write_udp(self, client_id: str, payload: bytes):
+        if not client_id:
+            return
+        pong = self.agent.answer_ping(self.udp_targets.get(client_id, self.config['minecraft_port']), payload)
+        if pong is not None:
+            # Server-list ping: reply without opening a session
+            self.udp_pending.touch(client_id)
+            self.send_udp_data(client_id, pong)
+            return
+        transport = self.udp_sessions.get(client_id)
+        if transport is None:
+            # First datagram of the client: open (on the default port if never announced), then deliver it
+            self.loop.create_task(self.open_udp_and_write(client_id, payload))
+            return
+        self.udp_tracker.touch(client_id)
+        try:
+            transport.sendto(payload)
+        except Exception as e:
+            self.logger.error(f"UDP send error for client {client_id}: {e}")
+
+    async def open_udp_and_write(self, client_id: str, payload: bytes):
+        target_port = self.udp_targets.get(client_id)
+        if target_port is None:
+            await self.open_udp(client_id, self.config['minecraft_port'], implicit=True)
+        else:
+            await self.open_udp(client_id, target_port)
+        transport = self.udp_sessions.get(client_id)
+        if transport is not None:
+            transport.sendto(payload)
+
+    def close_udp(self, client_id: str):
+        self.udp_targets.pop(client_id, None)
+        transport = self.udp_sessions.pop(client_id, None)
+        self.udp_tracker.remove(client_id)
+        self.udp_pending.remove(client_id)
+        if transport is not None:
+            transport.close()
+            self.logger.debug(f"Closed UDP client {client_id}")
+
+    async def close_all_connections(self):
+        for stream_id in list(self.streams.keys()):
+            await self.close_stream(stream_id, notify=self.ws is not None)
+        for client_id in set(self.udp_sessions) | set(self.udp_targets):
+            self.close_udp(client_id)
@@ -8,6 +8,7 @@ import zipfile
 import logging
 import json
 import time
+import threading
 from datetime import datetime, timedelta
 from typing import List, Optional
 import tempfile
@@ -19,10 +20,20 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 
+from backup_snapshot import BackupFile, SnapshotStore
+from backup_store import ChunkStore
+from parallel_zip import ParallelZipWriter
+
+# Drive name prefixes: full archives and manifests are backups, chunks belong to the incremental store
+BACKUP_PREFIX = 'minecraft_backup_'
+CHUNK_PREFIX = 'minecraft_chunk_'
+
 class BackupManager:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, server=None):
         self.config = config
         self.logger = logging.getLogger('BackupManager')
+        # MinecraftManager of the live server, used to pause saving during online backups
+        self.server = server
         
         # Google Drive configuration
         self.folder_id = config.get('google_drive_folder_id')
@@ -35,6 +46,24 @@ class BackupManager:
         self.backups_path = config.get('backups_path', './backups')
         self.backup_interval_hours = int(config.get('backup_interval_hours', '24'))
         self.backup_retention_days = int(config.get('backup_retention_days', '7'))
+        self.online_backups = config.get('backup_online', True)
+        # Worker processes compressing zip backups (1 = in this process with zipfile)
+        self.compress_workers = max(1, int(config.get('backup_compress_workers', 1)))
+        # Last online snapshot is kept so the next one can hardlink unchanged files
+        self.snapshots = SnapshotStore(
+            config.get('backup_snapshot_dir') or os.path.join(self.backups_path, 'snapshot'),
+            int(config.get('backup_snapshot_workers', 4))
+        )
+        # 'zip' uploads a full archive each time, 'incremental' only the chunks that changed
+        self.backup_format = config.get('backup_format', 'zip')
+        self.chunk_bytes = int(config.get('backup_chunk_bytes', 1024 * 1024))
+        self.store: Optional[ChunkStore] = None
+        if self.backup_format == 'incremental':
+            self.store = self._get_store()
+        
+        # Only one backup at a time; timings of the last one for get_backup_status
+        self._backup_lock = threading.Lock()
+        self.last_run: Optional[dict] = None
         
         # Ensure backups directory exists
         os.makedirs(self.backups_path, exist_ok=True)
@@ -70,15 +99,53 @@ class BackupManager:
             self.logger.error(f"Failed to initialize Google Drive service: {e}")
             self.drive_service = None
     
-    def create_backup(self) -> bool:
-        """Create a backup of the Minecraft world and upload to Google Drive"""
+    def create_backup(self, wait: bool = False) -> bool:
+        """Create a backup of the Minecraft world and upload to Google Drive
+
+        While the server is running (and BACKUP_ONLINE is on) saving is only
+        paused for the snapshot of the files (see SnapshotStore); the archive
+        is then built and uploaded from the snapshot while the server keeps
+        writing.
+
+        A backup already in progress makes this one skip, or with wait (the
+        exit backup) run once that one has finished.
+        """
         if not self.drive_service:
             self.logger.error("Google Drive service not available")
             return False
+        if not self._backup_lock.acquire(blocking=False):
+            if not wait:
+                self.logger.warning("A backup is already in progress, skipping")
+                return False
+            self.logger.info("Waiting for the backup in progress to finish...")
+            self._backup_lock.acquire()
         
         try:
+            started = time.monotonic()
+            run = {'started_at': datetime.now().isoformat(), 'mode': 'offline', 'pause_seconds': None}
+            self.last_run = run
+            files = None
+            if self.online_backups and self.server and self.server.is_server_running():
+                files = self._take_online_snapshot(run)
+                if files is not None:
+                    run['mode'] = 'online'
+            if files is None:
+                files = self._collect_backup_files()
+            if not files:
+                return False
+
+            if self.backup_format == 'incremental':
+                success = self._create_incremental_backup(files, run)
+                if success:
+                    self._cleanup_old_backups()
+                run['total_seconds'] = time.monotonic() - started
+                run['success'] = success
+                return success
+
             # Create local backup first
-            backup_file = self._create_local_backup()
+            archive_started = time.monotonic()
+            backup_file = self._create_local_backup(files)
+            run['archive_seconds'] = time.monotonic() - archive_started
             if not backup_file:
                 return False
             
@@ -95,15 +162,203 @@ class BackupManager:
             if success:
                 # Clean up old backups
                 self._cleanup_old_backups()
+            run['total_seconds'] = time.monotonic() - started
+            run['success'] = success
             
             return success
             
         except Exception as e:
             self.logger.error(f"Error creating backup: {e}")
             return False
-    
-    def _create_local_backup(self) -> Optional[str]:
-        """Create a local ZIP backup with progress"""
+        finally:
+            self._backup_lock.release()
+
+    def _take_online_snapshot(self, run: dict) -> Optional[List[BackupFile]]:
+        """Pause saving, flush the world, snapshot the files and resume saving
+
+        Returns the files in the snapshot, or None when saving could not be
+        paused (the backup then reads the live files).
+        """
+        paused_at = time.monotonic()
+        if self.server.send_command("save-off") is None:
+            self.logger.warning("Could not pause world saving, backing up the live files")
+            return None
+        try:
+            if not self.server.save_all(flush=True):
+                self.logger.warning("Save not confirmed by the server, the snapshot may miss recent changes")
+            flushed_at = time.monotonic()
+            # Listed after the flush so region files it created are included
+            files = self._collect_backup_files()
+            if not files:
+                return None
+            snapshot_files, stats = self.snapshots.take(files)
+        except Exception as e:
+            self.logger.error(f"Error taking backup snapshot: {e}")
+            return None
+        finally:
+            self.server.send_command("save-on")
+            pause = time.monotonic() - paused_at
+            run['pause_seconds'] = pause
+            self.logger.info(f"World saving paused for {pause:.2f}s during the backup snapshot")
+        run['flush_seconds'] = flushed_at - paused_at
+        run['snapshot_seconds'] = time.monotonic() - flushed_at
+        run['snapshot'] = stats
+        self.logger.info(
+            f"Snapshot of {len(snapshot_files)} files: {stats['linked']} unchanged (hardlinked), "
+            f"{stats['reflinked']} reflinked, {stats['copied']} copied ({stats['copied_bytes'] / (1024 * 1024):.1f} MB)"
+        )
+        return snapshot_files
+
+    def _get_store(self) -> ChunkStore:
+        if self.store is None:
+            self.store = ChunkStore(os.path.join(self.backups_path, 'store'), self.chunk_bytes,
+                                    self.config.get('backup_region_chunks', True))
+        return self.store
+
+    def _create_incremental_backup(self, files: List[BackupFile], run: dict) -> bool:
+        """Chunk files into the store and upload the new chunks, then the manifest"""
+        store = self._get_store()
+        name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        chunked_at = time.monotonic()
+        manifest, stats = store.build_manifest(name, files, store.latest_manifest())
+        run['chunk_seconds'] = time.monotonic() - chunked_at
+        run['store'] = stats
+        if not manifest['files']:
+            self.logger.error("Nothing to back up")
+            return False
+
+        if not store.remote:
+            self._sync_remote_index()
+        pending = sorted(store.manifest_chunks(manifest) - set(store.remote))
+        uploaded_bytes = 0
+        try:
+            for i, digest in enumerate(pending, 1):
+                path = store.chunk_path(digest)
+                store.remote[digest] = self._upload_object(path, f"{CHUNK_PREFIX}{digest}")
+                uploaded_bytes += os.path.getsize(path)
+                if i % 100 == 0 or i == len(pending):
+                    self.logger.info(f"Progreso subida: {i} / {len(pending)} chunks ({uploaded_bytes} bytes)")
+        except Exception as e:
+            self.logger.error(f"Error subiendo chunks a Google Drive: {e}")
+            return False
+        finally:
+            store.save_remote()
+        run['uploaded_bytes'] = uploaded_bytes
+
+        # The manifest goes last: a backup exists on Drive only once all its chunks do
+        manifest_path = store.save_manifest(manifest)
+        try:
+            file_id = self._upload_object(manifest_path, f"{name}.json")
+        except Exception as e:
+            self.logger.error(f"Error subiendo manifiesto a Google Drive: {e}")
+            store.remove_manifest(name)
+            return False
+        self.logger.info(
+            f"Incremental backup {name} subido ({file_id}): {stats['files']} files, {stats['chunks']} chunks "
+            f"({stats['region_chunks_unchanged']} unchanged region chunks), {len(pending)} new ({uploaded_bytes / (1024 * 1024):.1f} MB uploaded of "
+            f"{stats['bytes'] / (1024 * 1024):.1f} MB)"
+        )
+        return True
+
+    def _upload_object(self, path: str, name: str) -> str:
+        """Upload a store object (chunk or manifest), returns its Drive file id"""
+        file_metadata = {
+            'name': name,
+            'parents': [self.folder_id] if self.folder_id else []
+        }
+        media = MediaFileUpload(path, mimetype='application/octet-stream', resumable=False)
+        response = self.drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        return response['id']
+
+    def _download_object(self, file_id: str, path: str):
+        """Download a store object to path (written atomically)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        request = self.drive_service.files().get_media(fileId=file_id)
+        with open(tmp, 'wb') as f:
+            downloader = MediaIoBaseDownload(f, request)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
+        os.replace(tmp, path)
+
+    def _list_drive_files(self, query: str) -> List[dict]:
+        """All files matching query (follows pagination)"""
+        files = []
+        page_token = None
+        while True:
+            results = self.drive_service.files().list(
+                q=query,
+                fields='nextPageToken, files(id, name, createdTime)',
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def _sync_remote_index(self):
+        """Rebuild the chunk -> Drive id index from Drive (first run or lost remote.json)"""
+        if not self.folder_id:
+            return
+        store = self._get_store()
+        try:
+            for f in self._list_drive_files(f"parents in '{self.folder_id}' and name contains '{CHUNK_PREFIX}'"):
+                if f['name'].startswith(CHUNK_PREFIX):
+                    store.remote[f['name'][len(CHUNK_PREFIX):]] = f['id']
+            store.save_remote()
+            if store.remote:
+                self.logger.info(f"Found {len(store.remote)} backup chunks already on Google Drive")
+        except Exception as e:
+            self.logger.warning(f"Could not list backup chunks on Google Drive: {e}")
+
+    def _collect_garbage(self):
+        """Delete chunks no remaining manifest references, locally and on Drive"""
+        store = self._get_store()
+        # Listed without list_backups(), which hides errors behind an empty list
+        manifests = [
+            f for f in self._list_drive_files(f"parents in '{self.folder_id}' and name contains '{BACKUP_PREFIX}'")
+            if f['name'].endswith('.json')
+        ]
+        if not manifests:
+            return
+        # The newest backup is kept even if the listing does not show it yet
+        local_names = store.manifest_names()
+        names = set(local_names[-1:])
+        for f in manifests:
+            name = f['name'][:-len('.json')]
+            names.add(name)
+            if not os.path.exists(store.manifest_path(name)):
+                self._download_object(f['id'], store.manifest_path(name))
+        # Raises if a manifest cannot be read: better keep garbage than delete live chunks
+        referenced = store.referenced_chunks(names)
+        for name in local_names:
+            if name not in names:
+                store.remove_manifest(name)
+
+        deleted = 0
+        try:
+            for digest, file_id in list(store.remote.items()):
+                if digest in referenced:
+                    continue
+                try:
+                    self.drive_service.files().delete(fileId=file_id).execute()
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                del store.remote[digest]
+                deleted += 1
+        finally:
+            store.save_remote()
+        for digest in list(store.local_chunks()):
+            if digest not in referenced:
+                store.remove_chunk(digest)
+        if deleted:
+            self.logger.info(f"Deleted {deleted} unreferenced backup chunk(s)")
+
+    def _collect_backup_files(self) -> Optional[List[BackupFile]]:
+        """Worlds, plugins and server config files to back up"""
         try:
             # Detectar mundos (principal y dimensiones)
             world_name = os.getenv('WORLD_NAME', 'world')
@@ -121,14 +376,6 @@ class BackupManager:
                 self.logger.error("No se encontraron directorios de mundo para respaldar")
                 return None
             
-            # Generate backup filename with timestamp
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_filename = f"minecraft_backup_{timestamp}.zip"
-            backup_path = os.path.join(self.backups_path, backup_filename)
-            
-            self.logger.info(f"Creating local backup: {backup_path}")
-            
-            # Pre-calcular tamaño total para barra de progreso
             total_bytes = 0
             files_to_zip = []
             for dir_path, arc_name in world_dirs:
@@ -168,28 +415,55 @@ class BackupManager:
                         size = 0
                     files_to_zip.append((file_path, filename, size))
                     total_bytes += size
+            return files_to_zip
 
-            # Crear ZIP con barra de progreso
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                written_bytes = 0
-                steps = 6
-                thresholds = [int(i * (100 / steps)) for i in range(1, steps)] + [100]
-                next_idx = 0
-                for fp, arc, size in files_to_zip:
-                    try:
-                        zipf.write(fp, arc)
-                        written_bytes += size
-                        percent = int((written_bytes / total_bytes) * 100) if total_bytes > 0 else 100
-                        while next_idx < len(thresholds) and percent >= thresholds[next_idx]:
-                            bar_len = 30
-                            filled_len = int(bar_len * thresholds[next_idx] / 100)
-                            bar = '#' * filled_len + '-' * (bar_len - filled_len)
-                            self.logger.info(f"Progreso compresión: |{bar}| {thresholds[next_idx]}% ({written_bytes} / {total_bytes} bytes)")
-                            next_idx += 1
-                    except PermissionError as e:
-                        self.logger.warning(f"Skipping locked file during backup: {fp} ({e})")
-                    except Exception as e:
-                        self.logger.warning(f"Failed to add file to backup: {fp} ({e})")
+        except Exception as e:
+            self.logger.error(f"Error collecting files to back up: {e}")
+            return None
+    
+    def _create_local_backup(self, files_to_zip: List[BackupFile]) -> Optional[str]:
+        """Create a local ZIP backup with progress"""
+        try:
+            # Generate backup filename with timestamp
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            backup_filename = f"minecraft_backup_{timestamp}.zip"
+            backup_path = os.path.join(self.backups_path, backup_filename)
+            
+            self.logger.info(f"Creating local backup: {backup_path}")
+            
+            # Tamaño total para barra de progreso
+            total_bytes = sum(size for _, _, size in files_to_zip)
+
+            steps = 6
+            thresholds = [int(i * (100 / steps)) for i in range(1, steps)] + [100]
+            next_idx = 0
+
+            def report(written_bytes: int):
+                nonlocal next_idx
+                percent = int((written_bytes / total_bytes) * 100) if total_bytes > 0 else 100
+                while next_idx < len(thresholds) and percent >= thresholds[next_idx]:
+                    bar_len = 30
+                    filled_len = int(bar_len * thresholds[next_idx] / 100)
+                    bar = '#' * filled_len + '-' * (bar_len - filled_len)
+                    self.logger.info(f"Progreso compresión: |{bar}| {thresholds[next_idx]}% ({written_bytes} / {total_bytes} bytes)")
+                    next_idx += 1
+
+            if self.compress_workers > 1:
+                # Blocks deflated on a process pool, assembled into the same kind of archive
+                ParallelZipWriter(self.compress_workers).write(backup_path, files_to_zip, report)
+            else:
+                # Crear ZIP con barra de progreso
+                with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    written_bytes = 0
+                    for fp, arc, size in files_to_zip:
+                        try:
+                            zipf.write(fp, arc)
+                            written_bytes += size
+                            report(written_bytes)
+                        except PermissionError as e:
+                            self.logger.warning(f"Skipping locked file during backup: {fp} ({e})")
+                        except Exception as e:
+                            self.logger.warning(f"Failed to add file to backup: {fp} ({e})")
             
             # Verify backup was created
             if os.path.exists(backup_path):
@@ -292,7 +566,6 @@ class BackupManager:
             
             if not files:
                 self.logger.debug("No old backups to clean up")
-                return
             
             # Delete old files
             deleted_count = 0
@@ -309,6 +582,12 @@ class BackupManager:
                 
         except Exception as e:
             self.logger.error(f"Error during backup cleanup: {e}")
+            return
+        if self.store is not None:
+            try:
+                self._collect_garbage()
+            except Exception as e:
+                self.logger.error(f"Error collecting unreferenced backup chunks: {e}")
     
     def list_backups(self) -> List[dict]:
         """List all backups in Google Drive"""
@@ -420,6 +699,36 @@ class BackupManager:
             self.logger.error(f"Error al descargar el último backup: {e}")
             return None
     
+    def _rebuild_from_manifest(self, manifest_file: str, target_dir: str):
+        """Write the files of an incremental backup to target_dir, downloading missing chunks"""
+        store = self._get_store()
+        manifest = store.load_manifest(manifest_file)
+        missing = store.manifest_chunks(manifest) - set(store.local_chunks())
+        if missing and not store.remote:
+            self._sync_remote_index()
+
+        def fetch(digest: str):
+            file_id = store.remote.get(digest)
+            if not file_id or not self.drive_service:
+                raise FileNotFoundError(f"Backup chunk {digest} is not available locally or on Google Drive")
+            self._download_object(file_id, store.chunk_path(digest))
+
+        last_percent = -1
+
+        def progress(done: int, total: int):
+            nonlocal last_percent
+            percent = int((done / total) * 100) if total > 0 else 100
+            if percent != last_percent:
+                bar_len = 30
+                filled_len = int(bar_len * percent / 100)
+                bar = '#' * filled_len + '-' * (bar_len - filled_len)
+                self.logger.info(f"Progreso reconstrucción: |{bar}| {percent}% ({done} / {total} bytes)")
+                last_percent = percent
+
+        if missing:
+            self.logger.info(f"Downloading {len(missing)} backup chunk(s) from Google Drive")
+        store.restore(manifest, target_dir, fetch, progress)
+
     def restore_backup(self, backup_file: str) -> bool:
         """Restore a backup to the Minecraft directory with progress"""
         try:
@@ -431,22 +740,25 @@ class BackupManager:
             
             # Create temporary extraction directory
             with tempfile.TemporaryDirectory() as temp_dir:
-                # Extract backup
-                with zipfile.ZipFile(backup_file, 'r') as zipf:
-                    infos = zipf.infolist()
-                    total_bytes = sum(info.file_size for info in infos)
-                    extracted_bytes = 0
-                    last_percent = -1
-                    for info in infos:
-                        zipf.extract(info, temp_dir)
-                        extracted_bytes += info.file_size
-                        percent = int((extracted_bytes / total_bytes) * 100) if total_bytes > 0 else 100
-                        if percent != last_percent:
-                            bar_len = 30
-                            filled_len = int(bar_len * percent / 100)
-                            bar = '#' * filled_len + '-' * (bar_len - filled_len)
-                            self.logger.info(f"Progreso descompresión: |{bar}| {percent}% ({extracted_bytes} / {total_bytes} bytes)")
-                            last_percent = percent
+                if backup_file.endswith('.json'):
+                    # Incremental backup: rebuild its files from the chunk store
+                    self._rebuild_from_manifest(backup_file, temp_dir)
+                else:
+                    with zipfile.ZipFile(backup_file, 'r') as zipf:
+                        infos = zipf.infolist()
+                        total_bytes = sum(info.file_size for info in infos)
+                        extracted_bytes = 0
+                        last_percent = -1
+                        for info in infos:
+                            zipf.extract(info, temp_dir)
+                            extracted_bytes += info.file_size
+                            percent = int((extracted_bytes / total_bytes) * 100) if total_bytes > 0 else 100
+                            if percent != last_percent:
+                                bar_len = 30
+                                filled_len = int(bar_len * percent / 100)
+                                bar = '#' * filled_len + '-' * (bar_len - filled_len)
+                                self.logger.info(f"Progreso descompresión: |{bar}| {percent}% ({extracted_bytes} / {total_bytes} bytes)")
+                                last_percent = percent
                 
                 # Stop Minecraft server if running
                 # (This should be handled by the calling code)
@@ -496,6 +808,10 @@ class BackupManager:
             'backups_path': self.backups_path,
             'backup_interval_hours': self.backup_interval_hours,
             'backup_retention_days': self.backup_retention_days,
+            'online_backups': self.online_backups,
+            'backup_format': self.backup_format,
+            'snapshots': self.snapshots.get_metrics(),
+            'last_run': self.last_run,
             'last_backup': self._get_last_backup_info()
         }
     
@@ -0,0 +1,141 @@
+"""
+Backup Snapshot
+Point-in-time copy of the files to back up, built with reflinks, hardlinks or a parallel copy
+"""
+
+import errno
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from metrics import Counters
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks, snapshots use hardlinks and copies
+    fcntl = None
+
+# ioctl cloning a whole file (Linux: btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+# errno values meaning the filesystem (or the pair of filesystems) cannot clone
+_NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+
+# (source path, archive name, size in bytes)
+BackupFile = Tuple[str, str, int]
+
+
+class SnapshotStore:
+    """Keeps the last snapshot under root/current and builds the next one next to it
+
+    Each file of a new snapshot is, in order of preference: a hardlink to
+    the previous snapshot when the live file is unchanged since then (same
+    size and mtime; snapshots are never written to, so sharing inodes is
+    safe), a reflink of the live file where the filesystem supports it, or
+    a copy. Files are processed by a thread pool. Reflinks need no special
+    privileges, only the snapshot directory (root) on the same filesystem
+    as the server directory.
+    """
+
+    def __init__(self, root: str, workers: int = 4):
+        self.root = root
+        self.workers = max(1, workers)
+        self.current = os.path.join(root, 'current')
+        self._building = os.path.join(root, 'building')
+        self.logger = logging.getLogger('SnapshotStore')
+        # None until the first reflink attempt tells us whether the filesystem clones
+        self.reflink_supported: Optional[bool] = None if fcntl else False
+        self.counters = Counters(['linked', 'reflinked', 'copied', 'failed', 'copied_bytes'])
+
+    def take(self, files: List[BackupFile]) -> Tuple[List[BackupFile], dict]:
+        """Snapshot files, returns the files inside the new snapshot and what it took"""
+        started = time.monotonic()
+        before = self.counters.snapshot()
+        shutil.rmtree(self._building, ignore_errors=True)
+        os.makedirs(self._building, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._snapshot_file, files))
+
+        # The new snapshot replaces the previous one; shared inodes survive the delete
+        retired = os.path.join(self.root, 'retired')
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.exists(self.current):
+            os.rename(self.current, retired)
+        os.rename(self._building, self.current)
+        shutil.rmtree(retired, ignore_errors=True)
+
+        after = self.counters.snapshot()
+        stats = {name: after[name] - before.get(name, 0) for name in after}
+        stats['seconds'] = time.monotonic() - started
+        snapshot_files = [
+            (os.path.join(self.current, arc), arc, size) for arc, size in (r for r in results if r)
+        ]
+        return snapshot_files, stats
+
+    def _snapshot_file(self, item: BackupFile) -> Optional[Tuple[str, int]]:
+        source, arc, _ = item
+        target = os.path.join(self._building, arc)
+        try:
+            st = os.stat(source)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if self._link_unchanged(st, arc, target):
+                self.counters.inc('linked')
+            elif self._reflink(source, target):
+                self.counters.inc('reflinked')
+            else:
+                shutil.copy2(source, target)
+                self.counters.inc('copied')
+                self.counters.inc('copied_bytes', st.st_size)
+            return arc, st.st_size
+        except OSError as e:
+            self.counters.inc('failed')
+            self.logger.warning(f"Skipping file during backup snapshot: {source} ({e})")
+            return None
+
+    def _link_unchanged(self, st: os.stat_result, arc: str, target: str) -> bool:
+        """Hardlink the previous snapshot's copy if the live file has not changed since"""
+        previous = os.path.join(self.current, arc)
+        try:
+            prev = os.stat(previous)
+        except OSError:
+            return False
+        if prev.st_size != st.st_size or prev.st_mtime_ns != st.st_mtime_ns:
+            return False
+        try:
+            os.link(previous, target)
+            return True
+        except OSError:
+            return False
+
+    def _reflink(self, source: str, target: str) -> bool:
+        """Clone source into target (copy-on-write), False if the filesystem cannot"""
+        if self.reflink_supported is False:
+            return False
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as e:
+            if e.errno not in _NO_REFLINK:
+                raise
+            if self.reflink_supported is None:
+                self.logger.info("Filesystem does not support reflinks, snapshots will copy changed files")
+            self.reflink_supported = False
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            return False
+        self.reflink_supported = True
+        shutil.copystat(source, target)
+        return True
+
+    def get_metrics(self) -> dict:
+        return {
+            'root': self.root,
+            'reflink_supported': self.reflink_supported,
+            'counters': self.counters.snapshot()
+        }
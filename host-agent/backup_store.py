@@ -0,0 +1,320 @@
+"""
+Backup Store
+Content-addressed chunk store and per-backup manifests for incremental backups
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from backup_snapshot import BackupFile
+from region_file import RegionFormatError, read_chunk, read_header, write_region
+
+# 2: entries of region files list one chunk per Minecraft chunk (see _add_region)
+MANIFEST_VERSION = 2
+# Region chunk timestamps have a resolution of one second: a chunk saved this
+# close to (or after) the previous backup may have changed after it was read
+REGION_REUSE_MARGIN_SECONDS = 2
+
+
+class ChunkStore:
+    """Backups as manifests of content-addressed chunks
+
+    Files are split into fixed-size chunks; each distinct chunk is stored once,
+    zlib-compressed, under its sha256. Region files are instead split along
+    their Minecraft chunks when region_aware is set. A manifest lists the
+    files of one backup and their chunks, so a new backup only adds the
+    chunks that changed. Layout under root:
+
+        chunks/ab/<sha256>        compressed chunk
+        manifests/<name>.json     one per backup
+        remote.json               Drive file ids of uploaded chunks
+    """
+
+    def __init__(self, root: str, chunk_bytes: int = 1024 * 1024, region_aware: bool = True):
+        self.root = root
+        self.chunk_bytes = max(64 * 1024, chunk_bytes)
+        self.region_aware = region_aware
+        self.logger = logging.getLogger('ChunkStore')
+        self._chunks_dir = os.path.join(root, 'chunks')
+        self._manifests_dir = os.path.join(root, 'manifests')
+        self._remote_path = os.path.join(root, 'remote.json')
+        os.makedirs(self._chunks_dir, exist_ok=True)
+        os.makedirs(self._manifests_dir, exist_ok=True)
+        # sha256 -> Drive file id
+        self.remote: Dict[str, str] = self._load_remote()
+
+    # Chunks
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self._chunks_dir, digest[:2], digest)
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self.chunk_path(digest))
+
+    def put_chunk(self, data: bytes) -> Tuple[str, int]:
+        """Store data, returns (digest, compressed bytes written; 0 if already stored)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        packed = zlib.compress(data, 6)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        return digest, len(packed)
+
+    def read_chunk(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupt backup chunk {digest}")
+        return data
+
+    def remove_chunk(self, digest: str):
+        try:
+            os.remove(self.chunk_path(digest))
+        except OSError:
+            pass
+
+    def local_chunks(self) -> Iterable[str]:
+        for _, _, files in os.walk(self._chunks_dir):
+            for name in files:
+                if not name.endswith('.tmp'):
+                    yield name
+
+    # Manifests
+
+    def build_manifest(self, name: str, files: List[BackupFile],
+                       previous: Optional[dict] = None) -> Tuple[dict, dict]:
+        """Chunk files into the store, returns (manifest, stats)
+
+        Region chunks whose header entries are unchanged since the previous
+        manifest are taken from it without being read again (see _add_region).
+        """
+        stats = {'files': 0, 'chunks': 0, 'new_chunks': 0, 'bytes': 0, 'new_bytes': 0,
+                 'regions': 0, 'region_chunks_unchanged': 0}
+        previous_entries = {entry['path']: entry for entry in previous['files']} if previous else {}
+        reuse_before = previous['created_at'] - REGION_REUSE_MARGIN_SECONDS if previous else 0
+        entries = []
+        for fp, arc, _ in files:
+            try:
+                entry = None
+                if self.region_aware and fp.endswith('.mca'):
+                    entry = self._add_region(fp, arc, stats, previous_entries.get(arc.replace(os.sep, '/')),
+                                             reuse_before)
+                if entry is None:
+                    entry = self._add_file(fp, arc, stats)
+            except OSError as e:
+                self.logger.warning(f"Skipping file during backup: {fp} ({e})")
+                continue
+            entries.append(entry)
+            stats['files'] += 1
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'name': name,
+            'created_at': time.time(),
+            'chunk_bytes': self.chunk_bytes,
+            'files': entries
+        }
+        return manifest, stats
+
+    def _store_data(self, data: bytes, stats: dict) -> str:
+        digest, written = self.put_chunk(data)
+        stats['chunks'] += 1
+        if written:
+            stats['new_chunks'] += 1
+            stats['new_bytes'] += written
+        return digest
+
+    def _add_region(self, path: str, arc: str, stats: dict, previous: Optional[dict],
+                    reuse_before: float) -> Optional[dict]:
+        """Store a region file one Minecraft chunk at a time, None if it is not a valid region file
+
+        A chunk is taken from the previous entry without being read when both
+        its location and its timestamp are unchanged, and that timestamp is
+        older than reuse_before (the previous backup, less a margin).
+        """
+        unchanged: Dict[int, Tuple[int, int, str]] = {}
+        if previous and 'locations' in previous.get('region', {}):
+            # Entries written before locations were recorded are read again once
+            region = previous['region']
+            unchanged = {slot: (location, ts, digest) for slot, location, ts, digest
+                         in zip(region['slots'], region['locations'], region['timestamps'], previous['chunks'])}
+        st = os.stat(path)
+        if st.st_size == 0:
+            # The server leaves empty region files around, nothing to parse
+            return None
+        slots, region_locations, timestamps, chunks = [], [], [], []
+        reused = 0
+        try:
+            with open(path, 'rb') as f:
+                locations, header_timestamps = read_header(f, st.st_size)
+                for slot, (offset, sectors) in enumerate(locations):
+                    if not offset:
+                        continue
+                    location = (offset << 8) | sectors
+                    timestamp = header_timestamps[slot]
+                    prev = unchanged.get(slot)
+                    if (prev and timestamp and prev[:2] == (location, timestamp) and timestamp < reuse_before
+                            and self.has_chunk(prev[2])):
+                        digest = prev[2]
+                        reused += 1
+                        stats['chunks'] += 1
+                    else:
+                        payload = read_chunk(f, offset, sectors)
+                        digest = self._store_data(payload, stats)
+                    slots.append(slot)
+                    region_locations.append(location)
+                    timestamps.append(timestamp)
+                    chunks.append(digest)
+        except RegionFormatError as e:
+            self.logger.warning(f"Backing up {arc} as a plain file: {e}")
+            return None
+        stats['regions'] += 1
+        stats['region_chunks_unchanged'] += reused
+        stats['bytes'] += st.st_size
+        return {
+            'path': arc.replace(os.sep, '/'),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'chunks': chunks,
+            'region': {'slots': slots, 'locations': region_locations, 'timestamps': timestamps}
+        }
+
+    def _add_file(self, path: str, arc: str, stats: dict) -> dict:
+        st = os.stat(path)
+        chunks = []
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_bytes)
+                if not data:
+                    break
+                chunks.append(self._store_data(data, stats))
+                size += len(data)
+        stats['bytes'] += size
+        return {'path': arc.replace(os.sep, '/'), 'size': size, 'mtime': st.st_mtime, 'chunks': chunks}
+
+    def manifest_path(self, name: str) -> str:
+        return os.path.join(self._manifests_dir, f"{name}.json")
+
+    def save_manifest(self, manifest: dict) -> str:
+        path = self.manifest_path(manifest['name'])
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmp, path)
+        return path
+
+    @staticmethod
+    def load_manifest(path: str) -> dict:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version', 0) > MANIFEST_VERSION:
+            raise ValueError(f"Unsupported backup manifest version: {manifest.get('version')}")
+        return manifest
+
+    def manifest_names(self) -> List[str]:
+        return sorted(name[:-5] for name in os.listdir(self._manifests_dir) if name.endswith('.json'))
+
+    def latest_manifest(self) -> Optional[dict]:
+        """Newest local manifest, None if there is none or it cannot be read"""
+        names = self.manifest_names()
+        if not names:
+            return None
+        try:
+            return self.load_manifest(self.manifest_path(names[-1]))
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not read previous backup manifest: {e}")
+            return None
+
+    def remove_manifest(self, name: str):
+        try:
+            os.remove(self.manifest_path(name))
+        except OSError:
+            pass
+
+    @staticmethod
+    def manifest_chunks(manifest: dict) -> Set[str]:
+        return {digest for entry in manifest['files'] for digest in entry['chunks']}
+
+    def referenced_chunks(self, names: Iterable[str]) -> Set[str]:
+        """Chunks used by the named manifests (raises if one cannot be read)"""
+        referenced: Set[str] = set()
+        for name in names:
+            referenced |= self.manifest_chunks(self.load_manifest(self.manifest_path(name)))
+        return referenced
+
+    # Restore
+
+    def restore(self, manifest: dict, target_dir: str,
+                fetch: Optional[Callable[[str], None]] = None,
+                progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Rebuild the files of manifest under target_dir, returns bytes written
+
+        fetch(digest) is called for chunks missing locally and must place
+        them at chunk_path(digest). Region files are rebuilt with their
+        chunks laid out contiguously in slot order. Raises ValueError,
+        before writing anything, if a path would land outside target_dir.
+        """
+        targets = [self._restore_target(target_dir, entry['path']) for entry in manifest['files']]
+        total = sum(entry['size'] for entry in manifest['files'])
+        written = 0
+
+        def load(digest: str) -> bytes:
+            if not self.has_chunk(digest):
+                if fetch is None:
+                    raise FileNotFoundError(f"Backup chunk {digest} is missing")
+                fetch(digest)
+            return self.read_chunk(digest)
+
+        for entry, target in zip(manifest['files'], targets):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                if 'region' in entry:
+                    region = entry['region']
+                    write_region(f, [
+                        (slot, timestamp, load(digest)) for slot, timestamp, digest
+                        in zip(region['slots'], region['timestamps'], entry['chunks'])
+                    ])
+                    written += entry['size']
+                else:
+                    for digest in entry['chunks']:
+                        data = load(digest)
+                        f.write(data)
+                        written += len(data)
+            os.utime(target, (entry['mtime'], entry['mtime']))
+            if progress:
+                progress(written, total)
+        return written
+
+    @staticmethod
+    def _restore_target(target_dir: str, path: str) -> str:
+        """Where a manifest path is restored, ValueError unless it is a plain relative path"""
+        parts = path.split('/')
+        if (not path or os.path.isabs(path) or os.path.splitdrive(path)[0]
+                or any(part in ('', '.', '..') or '\\' in part for part in parts)):
+            raise ValueError(f"Unsafe path in backup manifest: {path!r}")
+        return os.path.join(target_dir, *parts)
+
+    # Remote index
+
+    def _load_remote(self) -> Dict[str, str]:
+        try:
+            with open(self._remote_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_remote(self):
+        tmp = f"{self._remote_path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.remote, f)
+        os.replace(tmp, self._remote_path)
@@ -0,0 +1,173 @@
+"""
+Connection Pool
+Pre-connected local sockets to the Minecraft server for faster stream opens
+"""
+
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from metrics import Counters, Histogram
+
+
+class LocalConnectionPool:
+    """Keeps up to `size` idle connections per target port, refilled after each take
+
+    Idle connections are not used after max_age seconds (the server times out
+    connections that never send a handshake after 30s) or once the server
+    closes them. They are discarded and replaced only when a stream asks for
+    one, so an idle server does not see a reconnect every max_age seconds.
+    With size 0 the pool only connects on demand and records latency.
+    """
+
+    def __init__(self, size: int, max_age: float = 25.0, connect_timeout: float = 10.0):
+        self.size = max(0, size)
+        self.max_age = max_age
+        self.connect_timeout = connect_timeout
+        self.logger = logging.getLogger('LocalConnectionPool')
+
+        self._lock = threading.Lock()
+        self._idle: Dict[int, Deque[Tuple[socket.socket, float]]] = {}
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+        self.counters = Counters(['hits', 'misses', 'discarded', 'refill_errors'])
+        # Milliseconds from open request to a usable local connection
+        self.open_latency = Histogram([1, 5, 10, 25, 50, 100, 250, 500, 1000])
+
+    def start(self, ports):
+        """Begin keeping connections ready for the given ports"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            for port in ports:
+                self._idle.setdefault(port, deque())
+        self._running = True
+        self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self._thread.start()
+        self._wakeup.set()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        with self._lock:
+            idle = [sock for pool in self._idle.values() for sock, _ in pool]
+            self._idle.clear()
+        for sock in idle:
+            self._close(sock)
+
+    def acquire(self, port: int) -> socket.socket:
+        """Connected socket to 127.0.0.1:port, pooled if available (blocking)"""
+        started = time.monotonic()
+        sock = self.take(port)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            try:
+                sock.connect(('127.0.0.1', port))
+            except Exception:
+                sock.close()
+                raise
+        self.open_latency.observe((time.monotonic() - started) * 1000)
+        return sock
+
+    def take(self, port: int) -> Optional[socket.socket]:
+        """Pooled live socket for a port or None (never blocks)"""
+        with self._lock:
+            pool = self._idle.get(port)
+            if pool is None and self.size > 0 and self._running:
+                # First open to this port, keep connections ready from now on
+                self._idle[port] = deque()
+        sock = None
+        while pool:
+            with self._lock:
+                if not pool:
+                    break
+                candidate, created = pool.popleft()
+            if time.monotonic() - created <= self.max_age and self._is_alive(candidate):
+                sock = candidate
+                break
+            self.counters.inc('discarded')
+            self._close(candidate)
+        if self.size > 0:
+            self.counters.inc('hits' if sock else 'misses')
+            self._wakeup.set()
+        if sock:
+            sock.settimeout(self.connect_timeout)
+        return sock
+
+    def _refill_loop(self):
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                ports = list(self._idle.keys())
+            for port in ports:
+                self._refill(port)
+
+    def _refill(self, port: int):
+        now = time.monotonic()
+        with self._lock:
+            pool = self._idle.get(port)
+            if pool is None:
+                return
+            stale = [sock for sock, created in pool if now - created > self.max_age]
+            fresh = [(sock, created) for sock, created in pool if now - created <= self.max_age]
+            pool.clear()
+            pool.extend(fresh)
+            missing = self.size - len(pool)
+        for sock in stale:
+            self.counters.inc('discarded')
+            self._close(sock)
+
+        for _ in range(missing):
+            if not self._running:
+                return
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            try:
+                sock.connect(('127.0.0.1', port))
+            except Exception as e:
+                # Server not up yet, try again after the next take
+                self.counters.inc('refill_errors')
+                self.logger.debug(f"Could not pre-connect to port {port}: {e}")
+                sock.close()
+                return
+            with self._lock:
+                if port in self._idle and self._running:
+                    self._idle[port].append((sock, time.monotonic()))
+                    continue
+            sock.close()
+
+    @staticmethod
+    def _is_alive(sock: socket.socket) -> bool:
+        """An idle connection is usable only if the server has neither closed it nor written to it"""
+        try:
+            sock.setblocking(False)
+            sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(sock: socket.socket):
+        try:
+            sock.close()
+        except Exception:
+            pass
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            idle = {str(port): len(pool) for port, pool in self._idle.items()}
+        return {
+            'size': self.size,
+            'idle': idle,
+            'counters': self.counters.snapshot(),
+            'open_latency_ms': self.open_latency.snapshot()
+        }
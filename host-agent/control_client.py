@@ -0,0 +1,129 @@
+"""
+Control Client
+Pooled HTTP client for Pato2 control-plane calls, with a re-resolving DNS cache and reconnect backoff
+"""
+
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class DnsCache:
+    """Caches the address of one hostname, re-resolving after ttl seconds or when invalidated
+
+    A failed lookup keeps serving the last known address, so a DNS outage does
+    not take down a tunnel that could still connect.
+    """
+
+    def __init__(self, hostname: str, ttl: float):
+        self.hostname = hostname
+        self.ttl = ttl
+        self.logger = logging.getLogger('DnsCache')
+        self._lock = threading.Lock()
+        self._address: Optional[str] = None
+        self._resolved_at = 0.0
+
+    def resolve(self) -> Optional[str]:
+        with self._lock:
+            if self._address and time.monotonic() - self._resolved_at < self.ttl:
+                return self._address
+            try:
+                address = socket.gethostbyname(self.hostname)
+            except socket.gaierror as e:
+                self.logger.error(f"Could not resolve Pato2 endpoint {self.hostname}: {e}")
+                return self._address
+            if address != self._address:
+                self.logger.info(f"Resolved Pato2 endpoint {self.hostname} to IP {address}")
+            self._address = address
+            self._resolved_at = time.monotonic()
+            return address
+
+    def invalidate(self):
+        """Force a lookup on the next resolve (after a connection failure)"""
+        with self._lock:
+            self._resolved_at = 0.0
+
+
+class Backoff:
+    """Exponential reconnect delay with jitter
+
+    Each delay is drawn between half and all of base * factor**attempts (capped
+    at maximum), so many agents restarting together do not reconnect in step.
+    """
+
+    def __init__(self, base: float, maximum: float, factor: float = 2.0):
+        self.base = max(0.1, base)
+        self.maximum = max(self.base, maximum)
+        self.factor = factor
+        self.attempts = 0
+        self._at_maximum = False
+
+    def next_delay(self) -> float:
+        cap = self.maximum
+        if not self._at_maximum:
+            # Not computed once capped: the power overflows after enough attempts
+            cap = min(cap, self.base * self.factor ** self.attempts)
+            self._at_maximum = cap >= self.maximum
+        self.attempts += 1
+        return random.uniform(cap / 2, cap)
+
+    def reset(self):
+        self.attempts = 0
+        self._at_maximum = False
+
+
+class ControlClient:
+    """Keep-alive HTTP session to Pato2 that targets the current address of its hostname"""
+
+    def __init__(self, endpoint: str, dns_ttl: float, timeout: float = 10.0):
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+        parsed = urlparse(self.endpoint)
+        self.scheme = parsed.scheme or 'http'
+        self.hostname = parsed.hostname
+        self.port = parsed.port or DEFAULT_PORTS.get(self.scheme, 80)
+        self.dns = DnsCache(self.hostname, dns_ttl) if self.hostname else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def base_url(self, scheme: Optional[str] = None) -> str:
+        """Endpoint URL using the resolved address (plain http/ws only, TLS needs the hostname)"""
+        scheme = scheme or self.scheme
+        address = self.dns.resolve() if self.dns and self.scheme == 'http' else None
+        if address:
+            return f"{scheme}://{address}:{self.port}"
+        if scheme != self.scheme:
+            return self.endpoint.replace(self.scheme, scheme, 1)
+        return self.endpoint
+
+    def websocket_base_url(self) -> str:
+        return self.base_url('wss' if self.scheme == 'https' else 'ws')
+
+    def post(self, path: str, payload: dict) -> requests.Response:
+        """POST JSON to Pato2, re-resolving the hostname and retrying once if the connection fails"""
+        headers = {}
+        if self.hostname:
+            default = self.port == DEFAULT_PORTS.get(self.scheme)
+            headers['Host'] = self.hostname if default else f"{self.hostname}:{self.port}"
+        try:
+            return self.session.post(f"{self.base_url()}{path}", json=payload, headers=headers, timeout=self.timeout)
+        except requests.ConnectionError:
+            if not self.dns:
+                raise
+            self.dns.invalidate()
+            return self.session.post(f"{self.base_url()}{path}", json=payload, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
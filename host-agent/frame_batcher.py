@@ -0,0 +1,155 @@
+"""
+Frame Batcher
+Coalesces small tunnel payloads from many streams into OP_BATCH frames
+"""
+
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from metrics import Counters, Histogram
+from tunnel_protocol import BATCH_FRAME_HEADER, batch_record_size, encode_frame, write_batch_record
+
+FLUSH_REASONS = ['timer', 'size', 'bypass', 'control', 'stop', 'udp']
+
+
+class FrameBatcher:
+    """Packs payloads into one frame until the flush window expires or the batch is full
+
+    A small payload arriving while the tunnel is idle bypasses batching and is
+    sent immediately, so isolated keep-alives and inputs do not pay the flush
+    window as extra latency.
+
+    Records are encoded straight into the frame being built, a bytearray
+    sized for max_bytes up front, which is handed to send_frame as it is.
+    """
+
+    def __init__(self, send_frame: Callable[[bytes], None], flush_window: float,
+                 max_bytes: int, bypass_bytes: int):
+        self.send_frame = send_frame
+        self.flush_window = flush_window
+        self.max_bytes = max_bytes
+        self.bypass_bytes = bypass_bytes
+
+        self._cond = threading.Condition()
+        # Frame being built: header and records in _frame[:_used]
+        self._frame: Optional[bytearray] = None
+        self._used = 0
+        self._record_count = 0
+        self._deadline = 0.0
+        self._last_flush = 0.0
+        self._running = False
+        self._thread = None
+        # Serialises frame sends so batches leave in submission order
+        self._send_lock = threading.Lock()
+
+        self.flush_reasons = Counters(FLUSH_REASONS)
+        self.batch_records = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.batch_bytes = Histogram([256, 1024, 4096, 16384, 65536])
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self.flush('stop')
+
+    def submit(self, opcode: int, channel_id: str, payload: bytes):
+        """Queue a payload for the next batch (or send it right away when idle)
+
+        The payload is copied into the batch before returning.
+        """
+        now = time.monotonic()
+        with self._cond:
+            idle = not self._record_count and now - self._last_flush >= self.flush_window
+            if idle and len(payload) <= self.bypass_bytes:
+                self._last_flush = now
+                bypass = encode_frame(opcode, channel_id, payload)
+            else:
+                bypass = None
+                if not self._record_count:
+                    self._deadline = now + self.flush_window
+                    self._cond.notify()
+                full = self._append(opcode, channel_id, payload)
+
+        if bypass is not None:
+            self.flush_reasons.inc('bypass')
+            with self._send_lock:
+                self.send_frame(bypass)
+        elif full:
+            self.flush('size')
+
+    def submit_many(self, records: List[Tuple[int, str, bytes]], reason: str):
+        """Add payloads that were read together and send them right away (split at max_bytes)"""
+        for opcode, channel_id, payload in records:
+            with self._cond:
+                full = self._append(opcode, channel_id, payload)
+            if full:
+                self.flush('size')
+        self.flush(reason)
+
+    def _append(self, opcode: int, channel_id: str, payload: bytes) -> bool:
+        """Encode a record into the frame (call with _cond held), True once the batch is full"""
+        size = batch_record_size(channel_id, payload)
+        if self._frame is None:
+            self._frame = bytearray(max(len(BATCH_FRAME_HEADER) + self.max_bytes, len(BATCH_FRAME_HEADER) + size))
+            self._frame[:len(BATCH_FRAME_HEADER)] = BATCH_FRAME_HEADER
+            self._used = len(BATCH_FRAME_HEADER)
+        room = len(self._frame) - self._used
+        if room < size:
+            # Only the record that completes the batch can overshoot max_bytes
+            self._frame.extend(bytes(size - room))
+        self._used = write_batch_record(self._frame, self._used, opcode, channel_id, payload)
+        self._record_count += 1
+        return self._used - len(BATCH_FRAME_HEADER) >= self.max_bytes
+
+    def clear(self):
+        """Drop records queued for a previous connection"""
+        with self._send_lock:
+            with self._cond:
+                self._frame = None
+                self._record_count = 0
+
+    def flush(self, reason: str):
+        """Send whatever is pending as one frame"""
+        with self._send_lock:
+            with self._cond:
+                frame, used, record_count = self._frame, self._used, self._record_count
+                self._frame = None
+                self._record_count = 0
+                self._last_flush = time.monotonic()
+            if not record_count:
+                return
+            # Trimming the unused tail does not move the bytes
+            del frame[used:]
+            self.flush_reasons.inc(reason)
+            self.batch_records.observe(record_count)
+            self.batch_bytes.observe(used - len(BATCH_FRAME_HEADER))
+            self.send_frame(frame)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._record_count:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                delay = self._deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            self.flush('timer')
+
+    def get_metrics(self) -> dict:
+        return {
+            'flush_reasons': self.flush_reasons.snapshot(),
+            'batch_records': self.batch_records.snapshot(),
+            'batch_bytes': self.batch_bytes.snapshot()
+        }
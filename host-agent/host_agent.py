@@ -13,22 +13,45 @@ import socket
 import sys
 import time
 import threading
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import base64
 import subprocess
 import psutil
 
-import requests
 import websocket
-from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+from async_tunnel import AsyncTunnelEngine
 from backup_manager import BackupManager
+from connection_pool import LocalConnectionPool
+from control_client import Backoff, ControlClient
+from frame_batcher import FrameBatcher
+from java_status import CLIENT_TIMEOUT, JavaStatusCache, answer_status_ping
+from metrics import Counters, Histogram
 from minecraft_manager import MinecraftManager
+from raknet_status import RakNetPongCache, is_unconnected_ping
+from recv_buffers import BufferPool, ReceiveBuffer
+from stream_scheduler import FairScheduler
+from tunnel_lanes import TunnelLane
+from tunnel_streams import TunnelStream
+from udp_relay import UdpRelay
+from udp_sessions import UdpSessionTracker
+from ws_sender import PRIORITY_DATA, WebSocketSender, message_priority
+from tunnel_protocol import (
+    OP_BATCH, OP_DATA, OP_UDP_DATA, FrameError, TunnelOptions,
+    decode_frame, encode_frame, iter_batch, payload_message
+)
 
 # Load environment variables
 load_dotenv(dotenv_path='.env')
 
+def env_flag(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 class HostAgent:
     def __init__(self):
         self.setup_logging()
@@ -38,21 +61,79 @@ class HostAgent:
         self.lease_id: Optional[str] = None
         self.websocket: Optional[websocket.WebSocketApp] = None
         self.running = False
-        self.connections: Dict[str, socket.socket] = {}
+        self.connections: Dict[str, TunnelStream] = {}
         self.udp_connections: Dict[str, socket.socket] = {}
         self.udp_recv_threads: Dict[str, threading.Thread] = {}
+        # Target port of each UDP client announced by Pato2; its socket opens on its first non-ping datagram
+        self.udp_targets: Dict[str, int] = {}
+        self.udp_sessions = UdpSessionTracker(self.config['udp_max_sessions'], self.config['udp_idle_timeout'])
+        # Announced clients without a socket yet (pings only), under the same cap and idle expiry
+        self.udp_pending = UdpSessionTracker(self.config['udp_max_sessions'], self.config['udp_idle_timeout'])
         self.exit_backup_done: bool = False
+        # Negotiated per WebSocket connection (see handle_hello_ack)
+        self.tunnel_options = TunnelOptions()
+        # Only this sender's thread writes to the primary WebSocket
+        self.sender = WebSocketSender('WebSocketSender', lambda: self.websocket, self.config['ws_send_queue_bytes'])
+        self.batcher = FrameBatcher(
+            self.send_binary_frame,
+            self.config['batch_flush_ms'] / 1000.0,
+            self.config['batch_max_bytes'],
+            self.config['batch_bypass_bytes']
+        )
+        # Deficit round robin across streams in front of the batcher (None when TUNNEL_FAIR_SCHEDULING=false)
+        self.scheduler: Optional[FairScheduler] = None
+        if self.config['fair_scheduling']:
+            self.scheduler = FairScheduler(
+                'StreamScheduler',
+                lambda: self.sender.wait_writable(self.config['batch_max_bytes']),
+                self.config['fair_quantum'],
+                self.config['stream_send_queue_bytes'],
+                self.config['stream_rate_limit']
+            )
+        # Data lanes of a striped tunnel (empty when TUNNEL_LANES=0)
+        self.lanes: List[TunnelLane] = []
+        # Lane each stream/UDP client was opened on (None = primary WebSocket); all its traffic stays there
+        self.channel_lanes: Dict[str, Optional[TunnelLane]] = {}
+        # Pre-connected sockets to the local server (CONNECTION_POOL_SIZE=0 connects on demand)
+        self.connection_pool = LocalConnectionPool(
+            self.config['connection_pool_size'],
+            self.config['connection_pool_max_age']
+        )
+        # Server-list pings on the Java port are answered from here (None when JAVA_STATUS_CACHE=false)
+        self.status_cache: Optional[JavaStatusCache] = None
+        if self.config['java_status_cache']:
+            self.status_cache = JavaStatusCache(self.config['minecraft_port'], self.config['java_status_ttl'])
+        # Bedrock unconnected pings are answered from here, one cache per target port (see answer_ping)
+        self.pong_caches: Dict[int, RakNetPongCache] = {}
+        self.pong_caches_lock = threading.Lock()
+        # Receive buffers recycled across streams (see handle_minecraft_data)
+        self.recv_buffers = BufferPool()
+        # Single-loop UDP relay (None when UDP_RELAY_MODE=threads)
+        self.udp_relay: Optional[UdpRelay] = None
+        if self.config['udp_relay_mode'] == 'selector':
+            self.udp_relay = UdpRelay(self, self.config['udp_batch_max'])
         
         # Managers
         self.minecraft_manager = MinecraftManager(
             self.config['minecraft_dir'],
             self.config['minecraft_port']
         )
-        self.backup_manager = BackupManager(self.config)
+        self.backup_manager = BackupManager(self.config, self.minecraft_manager)
         
+        # Lease heartbeats over the tunnel WebSocket (see heartbeat_loop)
+        self.heartbeat_ack = threading.Event()
+        self.heartbeat_ok = True
+        self.heartbeat_srtt: Optional[float] = None
+        self.heartbeat_rtt = Histogram([5, 10, 25, 50, 100, 250, 500, 1000])
+        self.heartbeat_counters = Counters(['ws', 'http', 'ws_timeouts'])
+
         # Threading
         self.heartbeat_thread: Optional[threading.Thread] = None
         self.websocket_thread: Optional[threading.Thread] = None
+        self.tunnel_engine: Optional[AsyncTunnelEngine] = None
+        self.reconnect_backoff = Backoff(self.config['reconnect_delay'], self.config['reconnect_max_delay'])
+        # Closes streams still detached RESUME_GRACE_SECONDS after the tunnel dropped
+        self.resume_timer: Optional[threading.Timer] = None
         
         # Setup signal handlers
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -111,8 +192,43 @@ class HostAgent:
             'minecraft_dir': os.getenv('MINECRAFT_DIR', './minecraft'),
             'minecraft_port': int(os.getenv('MINECRAFT_PORT', '25565')),
             'heartbeat_interval': int(os.getenv('HEARTBEAT_INTERVAL_SECONDS', '15')),
+            'ws_heartbeat': env_flag('TUNNEL_WS_HEARTBEAT', True),
             'reconnect_delay': int(os.getenv('RECONNECT_DELAY_SECONDS', '5')),
+            'reconnect_max_delay': float(os.getenv('RECONNECT_MAX_DELAY_SECONDS', '60')),
+            'dns_cache_ttl': float(os.getenv('DNS_CACHE_TTL_SECONDS', '60')),
+            'stream_resume': env_flag('TUNNEL_STREAM_RESUME', True),
+            'resume_grace': float(os.getenv('RESUME_GRACE_SECONDS', '30')),
+            'resume_buffer': int(os.getenv('RESUME_BUFFER_BYTES', str(1024 * 1024))),
             'max_reconnect_attempts': int(os.getenv('MAX_RECONNECT_ATTEMPTS', '10')),
+            # Tunnel settings
+            'binary_frames': env_flag('TUNNEL_BINARY_FRAMES', True),
+            'tunnel_engine': os.getenv('TUNNEL_ENGINE', 'threads').strip().lower(),
+            'stream_write_buffer': int(os.getenv('STREAM_WRITE_BUFFER_BYTES', str(1024 * 1024))),
+            'flow_control': env_flag('TUNNEL_FLOW_CONTROL', True),
+            'flow_window': int(os.getenv('FLOW_WINDOW_BYTES', str(256 * 1024))),
+            'batching': env_flag('TUNNEL_BATCHING', True),
+            'batch_flush_ms': float(os.getenv('BATCH_FLUSH_MS', '2')),
+            'batch_max_bytes': int(os.getenv('BATCH_MAX_BYTES', '16384')),
+            'batch_bypass_bytes': int(os.getenv('BATCH_BYPASS_BYTES', '256')),
+            'tunnel_lanes': max(0, int(os.getenv('TUNNEL_LANES', '0'))),
+            'ws_send_queue_bytes': int(os.getenv('WS_SEND_QUEUE_BYTES', str(4 * 1024 * 1024))),
+            'fair_scheduling': env_flag('TUNNEL_FAIR_SCHEDULING', True),
+            'fair_quantum': int(os.getenv('FAIR_QUANTUM_BYTES', '8192')),
+            'stream_send_queue_bytes': int(os.getenv('STREAM_SEND_QUEUE_BYTES', str(256 * 1024))),
+            'stream_rate_limit': int(os.getenv('STREAM_RATE_LIMIT_BYTES', '0')),
+            'stream_read_min': int(os.getenv('STREAM_READ_MIN_BYTES', '4096')),
+            'stream_read_max': int(os.getenv('STREAM_READ_MAX_BYTES', str(64 * 1024))),
+            'connection_pool_size': int(os.getenv('CONNECTION_POOL_SIZE', '0')),
+            'connection_pool_max_age': float(os.getenv('CONNECTION_POOL_MAX_AGE_SECONDS', '25')),
+            'java_status_cache': env_flag('JAVA_STATUS_CACHE', True),
+            'java_status_ttl': float(os.getenv('JAVA_STATUS_TTL_SECONDS', '5')),
+            'bedrock_pong_cache': env_flag('BEDROCK_PONG_CACHE', True),
+            'bedrock_pong_ttl': float(os.getenv('BEDROCK_PONG_TTL_SECONDS', '5')),
+            'udp_relay_mode': os.getenv('UDP_RELAY_MODE', 'selector').strip().lower(),
+            'udp_batch_max': int(os.getenv('UDP_BATCH_MAX_DATAGRAMS', '64')),
+            'udp_max_sessions': int(os.getenv('UDP_MAX_SESSIONS', '256')),
+            'udp_idle_timeout': float(os.getenv('UDP_IDLE_TIMEOUT_SECONDS', '60')),
+            'status_interval': int(os.getenv('STATUS_LOG_INTERVAL_SECONDS', '0')),
             # Google Drive credentials (support both naming styles)
             'google_drive_client_id': google_client_id,
             'google_drive_client_secret': google_client_secret,
@@ -122,20 +238,19 @@ class HostAgent:
             'backups_path': backups_path,
             'backup_interval_hours': backup_interval_hours,
             'backup_retention_days': backup_retention_days,
+            'backup_online': env_flag('BACKUP_ONLINE', True),
+            'backup_compress_workers': int(os.getenv('BACKUP_COMPRESS_WORKERS') or max(1, (os.cpu_count() or 1) // 2)),
+            'backup_snapshot_dir': os.getenv('BACKUP_SNAPSHOT_DIR'),
+            'backup_snapshot_workers': int(os.getenv('BACKUP_SNAPSHOT_WORKERS', '4')),
+            'backup_format': os.getenv('BACKUP_FORMAT', 'zip').strip().lower(),
+            'backup_chunk_bytes': int(os.getenv('BACKUP_CHUNK_BYTES', str(1024 * 1024))),
+            'backup_region_chunks': env_flag('BACKUP_REGION_CHUNKS', True),
         }
 
-        # Resolve Pato2 endpoint to IP address once
-        parsed_url = urlparse(self.config['pato2_endpoint'])
-        hostname = parsed_url.hostname
-        if hostname:
-            try:
-                self.pato2_ip = socket.gethostbyname(hostname)
-                self.logger.info(f"Resolved Pato2 endpoint {hostname} to IP {self.pato2_ip}")
-            except socket.gaierror as e:
-                self.logger.error(f"Could not resolve Pato2 endpoint {hostname}: {e}")
-                self.pato2_ip = None
-        else:
-            self.pato2_ip = None
+        # Pato2 hostname is re-resolved every DNS_CACHE_TTL_SECONDS and after connection failures
+        self.control = ControlClient(self.config['pato2_endpoint'], self.config['dns_cache_ttl'])
+        if self.control.dns:
+            self.control.dns.resolve()
 
         # Validate required config
         if not self.config['host_token']:
@@ -152,23 +267,11 @@ class HostAgent:
         """Offer this host to become the active server"""
         try:
             endpoint_info = f"{socket.gethostname()}:{self.config['minecraft_port']}"
-            
-            
-            # Use the resolved IP address for requests
-            if self.pato2_ip:
-                parsed_url = urlparse(self.config['pato2_endpoint'])
-                base_url = f"http://{self.pato2_ip}:{parsed_url.port}"
-            else:
-                base_url = self.config['pato2_endpoint']
-
-            response = requests.post(
-                f"{base_url}/api/host/offer",
-                json={
-                    'token': self.config['host_token'],
-                    'endpoint': endpoint_info
-                },
-                timeout=10
-            )
+
+            response = self.control.post('/api/host/offer', {
+                'token': self.config['host_token'],
+                'endpoint': endpoint_info
+            })
             
             if response.status_code == 200:
                 data = response.json()
@@ -198,25 +301,13 @@ class HostAgent:
         try:
             minecraft_running = self.minecraft_manager.is_server_running()
             minecraft_ready = self.minecraft_manager.is_server_ready()
-            
-            
-            # Use the resolved IP address for requests
-            if self.pato2_ip:
-                parsed_url = urlparse(self.config['pato2_endpoint'])
-                base_url = f"http://{self.pato2_ip}:{parsed_url.port}"
-            else:
-                base_url = self.config['pato2_endpoint']
-
-            response = requests.post(
-                f"{base_url}/api/host/heartbeat",
-                json={
-                    'token': self.config['host_token'],
-                    'leaseId': self.lease_id,
-                    'ready': minecraft_ready,
-                    'serverRunning': minecraft_running
-                },
-                timeout=10
-            )
+
+            response = self.control.post('/api/host/heartbeat', {
+                'token': self.config['host_token'],
+                'leaseId': self.lease_id,
+                'ready': minecraft_ready,
+                'serverRunning': minecraft_running
+            })
             
             if response.status_code == 200:
                 data = response.json()
@@ -234,25 +325,60 @@ class HostAgent:
             self.logger.error(f"Error sending heartbeat: {e}")
             return False
 
+    def send_ws_heartbeat(self) -> bool:
+        """Queue a lease heartbeat on the tunnel WebSocket, False when it cannot carry one"""
+        options = self.tunnel_engine.options if self.tunnel_engine else self.tunnel_options
+        if not self.lease_id or not options.ws_heartbeat:
+            return False
+        message = {
+            'type': 'heartbeat',
+            'ready': self.minecraft_manager.is_server_ready(),
+            'serverRunning': self.minecraft_manager.is_server_running(),
+            'sentAt': time.monotonic()
+        }
+        self.heartbeat_ack.clear()
+        if self.tunnel_engine:
+            return self.tunnel_engine.send_threadsafe(message)
+        if not self.sender.connected():
+            return False
+        self.send_websocket_message(message)
+        return True
+
+    def handle_heartbeat_ack(self, data: dict):
+        """Record the lease renewal and the tunnel round trip it measured"""
+        self.heartbeat_ok = bool(data.get('ok'))
+        if not self.heartbeat_ok:
+            self.logger.error(f"Heartbeat rejected: {data.get('error')}")
+        try:
+            rtt = time.monotonic() - float(data.get('sentAt'))
+        except (TypeError, ValueError):
+            rtt = -1.0
+        if rtt >= 0:
+            self.heartbeat_rtt.observe(rtt * 1000)
+            self.heartbeat_srtt = rtt if self.heartbeat_srtt is None else 0.875 * self.heartbeat_srtt + 0.125 * rtt
+        self.heartbeat_ack.set()
+
+    def heartbeat_ack_timeout(self) -> float:
+        """How long to wait for a heartbeat_ack: a few tunnel round trips, at most one interval"""
+        interval = float(self.config['heartbeat_interval'])
+        if self.heartbeat_srtt is None:
+            return min(5.0, interval)
+        return min(interval, max(1.0, 4 * self.heartbeat_srtt))
+
+    def get_heartbeat_metrics(self) -> dict:
+        return {
+            'srtt_ms': self.heartbeat_srtt * 1000 if self.heartbeat_srtt is not None else None,
+            'rtt_ms': self.heartbeat_rtt.snapshot(),
+            'counters': self.heartbeat_counters.snapshot()
+        }
+
     def end_lease(self):
         """End the current lease"""
         if not self.lease_id:
             return
             
         try:
-            
-            # Use the resolved IP address for requests
-            if self.pato2_ip:
-                parsed_url = urlparse(self.config['pato2_endpoint'])
-                base_url = f"http://{self.pato2_ip}:{parsed_url.port}"
-            else:
-                base_url = self.config['pato2_endpoint']
-
-            response = requests.post(
-                f"{base_url}/api/host/end",
-                json={'token': self.config['host_token']},
-                timeout=10
-            )
+            response = self.control.post('/api/host/end', {'token': self.config['host_token']})
             
             if response.status_code == 200:
                 self.logger.info("Lease ended successfully")
@@ -264,19 +390,18 @@ class HostAgent:
         
         self.lease_id = None
 
+    def build_websocket_url(self) -> str:
+        """Build the Pato2 host WebSocket URL for the current lease"""
+        base_url = self.control.websocket_base_url()
+        return f"{base_url}/ws/host?token={self.config['host_token']}&leaseId={self.lease_id}"
+
     def connect_websocket(self):
         """Connect to Pato2 WebSocket"""
         if not self.lease_id:
             self.logger.error("Cannot connect WebSocket without lease ID")
             return False
-            
-        # Use the resolved IP address for WebSocket connection
-        if self.pato2_ip:
-            parsed_url = urlparse(self.config['pato2_endpoint'])
-            ws_url = f"ws://{self.pato2_ip}:{parsed_url.port}/ws/host?token={self.config['host_token']}&leaseId={self.lease_id}"
-        else:
-            ws_url = f"{self.config['pato2_endpoint'].replace('http', 'ws')}/ws/host?token={self.config['host_token']}&leaseId={self.lease_id}"
-        
+
+        ws_url = self.build_websocket_url()
         self.logger.info(f"Connecting to WebSocket: {ws_url}")
         
         self.websocket = websocket.WebSocketApp(
@@ -292,12 +417,71 @@ class HostAgent:
     def on_websocket_open(self, ws):
         """WebSocket connection opened"""
         self.logger.info("WebSocket connected")
+        self.reconnect_backoff.reset()
+        self.tunnel_options = TunnelOptions()
+        # Nothing queued for the previous connection may go out on this one
+        if self.scheduler:
+            self.scheduler.clear()
+        self.batcher.clear()
+        self.sender.clear()
+        self.send_websocket_message(TunnelOptions.build_hello(self.config))
+
+    def handle_hello_ack(self, data: dict):
+        """Enable the capabilities accepted by Pato2"""
+        self.tunnel_options = TunnelOptions.from_hello_ack(self.config, data)
+        self.logger.info(f"Tunnel protocol negotiated: {self.tunnel_options.describe()}")
+        self.start_lanes(self.tunnel_options.lanes)
+        self.request_resume()
 
-    def on_websocket_message(self, ws, message):
-        """Handle WebSocket message from Pato2"""
+    def start_lanes(self, count: int):
+        """Open the data lanes of a striped tunnel"""
+        self.stop_lanes()
+        if count <= 0:
+            return
+        self.lanes = [TunnelLane(index, self) for index in range(count)]
+        for lane in self.lanes:
+            lane.start()
+        self.logger.info(f"Striping streams over {count} tunnel lanes")
+
+    def stop_lanes(self):
+        lanes, self.lanes = self.lanes, []
+        for lane in lanes:
+            lane.stop()
+
+    def lane_for(self, channel_id: str) -> Optional[TunnelLane]:
+        """Lane a stream/UDP client was opened on, None for the primary WebSocket
+
+        Never switches: a stream whose lane went down is closed (see
+        handle_lane_lost), its traffic is not rerouted to another socket.
+        """
+        if not self.lanes:
+            return None
+        return self.channel_lanes.get(channel_id)
+
+    def handle_lane_lost(self, lane: TunnelLane):
+        """Close the streams and UDP clients of a lane that disconnected, Pato2 does the same on its side"""
+        for channel_id, pinned in list(self.channel_lanes.items()):
+            if pinned is not lane:
+                continue
+            if channel_id in self.connections:
+                self.close_stream(channel_id)
+            else:
+                self.close_udp_client(channel_id)
+
+    def on_websocket_message(self, ws, message, lane: Optional[TunnelLane] = None):
+        """Handle WebSocket message from Pato2 (lane: data lane it arrived on, None for the primary)"""
+        if isinstance(message, (bytes, bytearray)):
+            self.handle_binary_frame(message)
+            return
         try:
             data = json.loads(message)
             message_type = data.get('type')
+
+            # A channel answers on the socket Pato2 opened it on
+            if message_type == 'open' and data.get('streamId'):
+                self.channel_lanes[data['streamId']] = lane
+            elif message_type == 'udp_open' and data.get('clientId'):
+                self.channel_lanes[data['clientId']] = lane
             
             if message_type == 'open':
                 self.handle_open_stream(data)
@@ -315,20 +499,142 @@ class HostAgent:
                 self.handle_backup_command(data)
             elif message_type == 'ping':
                 self.send_websocket_message({'type': 'pong'})
+            elif message_type == 'hello_ack':
+                self.handle_hello_ack(data)
+            elif message_type == 'ack':
+                self.handle_stream_ack(data)
+            elif message_type == 'heartbeat_ack':
+                self.handle_heartbeat_ack(data)
+            elif message_type == 'resume_ack':
+                self.handle_resume_ack(data)
             else:
                 self.logger.warning(f"Unknown message type: {message_type}")
                 
         except Exception as e:
             self.logger.error(f"Error handling WebSocket message: {e}")
 
+    def handle_binary_frame(self, frame: bytes):
+        """Handle binary tunnel frame from Pato2"""
+        try:
+            opcode, channel_id, payload = decode_frame(frame)
+            if opcode == OP_BATCH:
+                for record in iter_batch(payload):
+                    self.dispatch_binary_record(*record)
+            else:
+                self.dispatch_binary_record(opcode, channel_id, payload)
+        except FrameError as e:
+            self.logger.error(f"Invalid binary frame: {e}")
+
+    def dispatch_binary_record(self, opcode: int, channel_id: str, payload):
+        """Route one binary payload to its stream or UDP client"""
+        if opcode == OP_DATA:
+            self.write_stream(channel_id, payload)
+        elif opcode == OP_UDP_DATA:
+            self.write_udp(channel_id, payload)
+        else:
+            self.logger.warning(f"Unknown binary frame opcode: {opcode}")
+
     def on_websocket_error(self, ws, error):
         """WebSocket error occurred"""
         self.logger.error(f"WebSocket error: {error}")
 
     def on_websocket_close(self, ws, close_status_code, close_msg):
         """WebSocket connection closed"""
+        if ws is not self.websocket:
+            # Late close of a connection already replaced; the current one keeps the streams
+            self.logger.debug(f"Replaced WebSocket closed: {close_status_code} {close_msg}")
+            return
         self.logger.warning(f"WebSocket closed: {close_status_code} {close_msg}")
-        self.close_all_connections()
+        self.stop_lanes()
+        if self.tunnel_options.stream_resume and self.running:
+            self.detach_streams()
+        else:
+            self.close_all_connections()
+
+    def detach_streams(self):
+        """Keep TCP streams open across a reconnect, Pato2 holds the players meanwhile"""
+        for client_id in set(self.udp_connections) | set(self.udp_targets):
+            self.close_udp_client(client_id)
+        streams = list(self.connections.values())
+        if not streams:
+            return
+        for stream in streams:
+            stream.detach()
+        self.logger.info(f"Holding {len(streams)} stream(s) for up to {self.config['resume_grace']:.0f}s until the tunnel is back")
+        self.cancel_resume_timer()
+        self.resume_timer = threading.Timer(self.config['resume_grace'], self.expire_detached_streams)
+        self.resume_timer.daemon = True
+        self.resume_timer.start()
+
+    def cancel_resume_timer(self):
+        timer, self.resume_timer = self.resume_timer, None
+        if timer:
+            timer.cancel()
+
+    def expire_detached_streams(self):
+        """Grace period over without a resume: give up on the held streams"""
+        for stream_id, stream in list(self.connections.items()):
+            if not stream.attached.is_set():
+                self.close_stream(stream_id)
+
+    def request_resume(self):
+        """Ask Pato2 to resume the detached streams, reporting how much of each we received"""
+        detached = [stream for stream in list(self.connections.values()) if not stream.attached.is_set()]
+        if not detached:
+            return
+        if not self.tunnel_options.stream_resume:
+            self.logger.warning(f"Pato2 did not accept stream resumption, closing {len(detached)} stream(s)")
+            self.cancel_resume_timer()
+            for stream in detached:
+                self.close_stream(stream.stream_id)
+            return
+        self.send_websocket_message({
+            'type': 'resume',
+            'streams': [{'streamId': stream.stream_id, 'received': stream.resume_offset()} for stream in detached]
+        })
+
+    def handle_resume_ack(self, data: dict):
+        """Replay what Pato2 missed on the streams it still has, close the rest"""
+        self.cancel_resume_timer()
+        accepted: Dict[str, int] = {}
+        for entry in data.get('streams') or []:
+            try:
+                accepted[entry['streamId']] = int(entry.get('received') or 0)
+            except (KeyError, TypeError, ValueError):
+                self.logger.warning(f"Invalid resume entry: {entry}")
+
+        resumed = 0
+        for stream_id, stream in list(self.connections.items()):
+            if stream.attached.is_set():
+                continue
+            if stream_id in accepted and self.resume_stream(stream, accepted[stream_id]):
+                resumed += 1
+            else:
+                self.close_stream(stream_id)
+        # Streams that ended here while the tunnel was down
+        for stream_id in accepted:
+            if stream_id not in self.connections:
+                self.send_channel_message(stream_id, {'type': 'close', 'streamId': stream_id})
+        self.logger.info(f"Resumed {resumed} stream(s) after reconnect")
+
+    def resume_stream(self, stream: TunnelStream, peer_received: int) -> bool:
+        """Resend the bytes Pato2 did not receive and reattach, False if they are no longer buffered"""
+        if not stream.replay:
+            return False
+        with stream.send_lock:
+            pending = stream.replay.since(peer_received)
+            if pending is None:
+                self.logger.warning(
+                    f"Stream {stream.stream_id} cannot resume: offset {peer_received} "
+                    f"is outside the replay buffer ({stream.replay.start}-{stream.replay.end})"
+                )
+                return False
+            stream.resume_send(peer_received)
+            chunk = max(1, self.config['stream_read_max'])
+            for offset in range(0, len(pending), chunk):
+                self.send_resumable(stream, pending[offset:offset + chunk])
+            stream.attached.set()
+        return True
 
     def handle_open_stream(self, data):
         """Handle new stream open request"""
@@ -346,39 +652,111 @@ class HostAgent:
         else:
             self.logger.debug(f"Opening stream {stream_id} for client {client_address} -> 127.0.0.1:{port_to_use}")
         
-        try:
-            # Connect to local Minecraft server
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
-            sock.connect(('127.0.0.1', port_to_use))
-            
-            self.connections[stream_id] = sock
-            
-            # Start thread to handle data from Minecraft server
-            thread = threading.Thread(
-                target=self.handle_minecraft_data,
-                args=(stream_id, sock),
-                daemon=True
+        # Register the stream right away so data arriving while we connect is queued,
+        # then connect and write from the stream's own thread
+        send_window = self.tunnel_options.send_window if self.tunnel_options.flow_control else 0
+        replay_bytes = self.config['resume_buffer'] if self.tunnel_options.stream_resume else 0
+        stream = TunnelStream(stream_id, port_to_use, self.config['stream_write_buffer'], send_window, replay_bytes)
+        self.connections[stream_id] = stream
+        thread = threading.Thread(
+            target=self.stream_writer_loop,
+            args=(stream,),
+            daemon=True
+        )
+        thread.start()
+
+    def stream_writer_loop(self, stream: TunnelStream):
+        """Connect a stream to the local server and drain its write queue"""
+        stream_id = stream.stream_id
+        initial = None
+        if self.status_cache and stream.target_port == self.config['minecraft_port']:
+            # Server-list pings never reach the server; logins continue with the bytes read so far
+            initial = answer_status_ping(
+                lambda: stream.next_payload(CLIENT_TIMEOUT),
+                lambda data: self.send_status_reply(stream, data),
+                self.status_cache
             )
-            thread.start()
-            
+            if initial is None:
+                self.close_stream(stream_id)
+                return
+        try:
+            # Connect to local Minecraft server (pre-connected socket if the pool has one)
+            sock = self.connection_pool.acquire(stream.target_port)
         except Exception as e:
             self.logger.error(f"Failed to open stream {stream_id}: {e}")
-            self.send_websocket_message({
+            if self.connections.get(stream_id) is stream:
+                self.connections.pop(stream_id, None)
+            stream.close()
+            self.send_channel_message(stream_id, {
                 'type': 'error',
                 'streamId': stream_id,
                 'data': str(e)
             })
+            return
 
-    def handle_udp_open(self, data: dict):
-        client_id = data.get('clientId')
-        target_port = data.get('targetPort')
+        stream.sock = sock
+        if stream.closed:
+            # Closed by Pato2 while connecting
+            sock.close()
+            return
+
+        # Start thread to handle data from Minecraft server
+        thread = threading.Thread(
+            target=self.handle_minecraft_data,
+            args=(stream_id, sock),
+            daemon=True
+        )
+        thread.start()
+
+        ack_threshold = self.tunnel_options.ack_threshold
+        while True:
+            payload, initial = initial or stream.next_payload(), None
+            if payload is None:
+                break
+            try:
+                sock.sendall(payload)
+            except Exception as e:
+                if not stream.closed:
+                    self.logger.error(f"Error writing to Minecraft server for {stream_id}: {e}")
+                    self.close_stream(stream_id)
+                break
+            if self.tunnel_options.flow_control:
+                acked = stream.record_delivered(len(payload), ack_threshold)
+                if acked:
+                    self.send_channel_message(stream_id, {
+                        'type': 'ack',
+                        'streamId': stream_id,
+                        'bytes': acked
+                    })
+
+    def send_status_reply(self, stream: TunnelStream, data: bytes):
+        """Send a cached status response or pong on a stream that has no local socket"""
+        stream.consume_credit(len(data))
+        self.send_stream_data(stream.stream_id, data)
+
+    def udp_target_port(self, data: dict) -> int:
+        """Local port a 'udp_open' asks for, the Minecraft port if missing or invalid"""
         try:
-            target_port = int(target_port) if target_port is not None else self.config['minecraft_port']
+            return int(data.get('targetPort') or self.config['minecraft_port'])
         except Exception:
-            target_port = self.config['minecraft_port']
+            return self.config['minecraft_port']
+
+    def handle_udp_open(self, data: dict):
+        """Remember a new UDP client's target port
+
+        Most clients only ping the server list, so the socket and session are
+        created by the first datagram that the pong cache does not answer.
+        """
+        client_id = data.get('clientId')
         if not client_id:
             return
+        self.udp_targets[client_id] = self.udp_target_port(data)
+        if client_id not in self.udp_connections:
+            victim = self.udp_pending.add(client_id)
+            if victim:
+                self.drop_udp_client(victim)
+
+    def open_udp_client(self, client_id: str, target_port: int, implicit: bool = False):
         if client_id in self.udp_connections:
             return
         try:
@@ -389,9 +767,17 @@ class HostAgent:
             except Exception:
                 pass
             self.udp_connections[client_id] = sock
-            t = threading.Thread(target=self.udp_receive_loop, args=(client_id, sock), daemon=True)
-            self.udp_recv_threads[client_id] = t
-            t.start()
+            self.udp_pending.remove(client_id)
+            victim = self.udp_sessions.add(client_id, implicit)
+            if victim:
+                self.logger.warning(f"UDP session limit ({self.config['udp_max_sessions']}) reached, evicting {victim}")
+                self.drop_udp_client(victim)
+            if self.udp_relay:
+                self.udp_relay.add(client_id, sock)
+            else:
+                t = threading.Thread(target=self.udp_receive_loop, args=(client_id, sock), daemon=True)
+                self.udp_recv_threads[client_id] = t
+                t.start()
             self.logger.info(f"Jugador Bedrock conectando: {client_id} -> 127.0.0.1:{target_port}")
         except Exception as e:
             self.logger.error(f"Failed to open UDP client {client_id}: {e}")
@@ -401,15 +787,55 @@ class HostAgent:
         payload_b64 = data.get('data')
         if not client_id or payload_b64 is None:
             return
+        try:
+            payload = base64.b64decode(payload_b64)
+        except Exception as e:
+            self.logger.error(f"Invalid UDP payload for client {client_id}: {e}")
+            return
+        self.write_udp(client_id, payload)
+
+    def answer_ping(self, target_port: int, datagram) -> Optional[bytes]:
+        """Cached pong for a Bedrock ping sent to target_port, None to forward the datagram"""
+        if not self.config['bedrock_pong_cache'] or not is_unconnected_ping(datagram):
+            return None
+        with self.pong_caches_lock:
+            cache = self.pong_caches.get(target_port)
+            if cache is None:
+                cache = RakNetPongCache(target_port, self.config['bedrock_pong_ttl'])
+                self.pong_caches[target_port] = cache
+                cache.start()
+        return cache.answer(datagram)
+
+    def get_pong_metrics(self) -> Optional[dict]:
+        if not self.config['bedrock_pong_cache']:
+            return None
+        with self.pong_caches_lock:
+            caches = list(self.pong_caches.items())
+        return {str(port): cache.get_metrics() for port, cache in caches}
+
+    def write_udp(self, client_id: str, payload):
+        """Forward a datagram from Pato2 to the local server"""
+        target_port = self.udp_targets.get(client_id, self.config['minecraft_port'])
+        pong = self.answer_ping(target_port, payload)
+        if pong is not None:
+            # Server-list ping: reply without opening a session
+            self.udp_pending.touch(client_id)
+            self.send_payload(OP_UDP_DATA, client_id, pong)
+            return
         sock = self.udp_connections.get(client_id)
         if not sock:
-            # Implicit open using default port
-            self.handle_udp_open({'clientId': client_id, 'targetPort': self.config['minecraft_port']})
+            # First datagram of the client, implicit open on the default port if it was never announced
+            target_port = self.udp_targets.get(client_id)
+            if target_port is None:
+                self.open_udp_client(client_id, self.config['minecraft_port'], implicit=True)
+            else:
+                self.open_udp_client(client_id, target_port)
             sock = self.udp_connections.get(client_id)
             if not sock:
                 return
+        else:
+            self.udp_sessions.touch(client_id)
         try:
-            payload = base64.b64decode(payload_b64)
             sock.send(payload)
         except Exception as e:
             self.logger.error(f"UDP send error for client {client_id}: {e}")
@@ -419,18 +845,40 @@ class HostAgent:
         if not client_id:
             return
         try:
-            if client_id in self.udp_connections:
-                try:
-                    self.udp_connections[client_id].close()
-                except Exception:
-                    pass
-                del self.udp_connections[client_id]
-            if client_id in self.udp_recv_threads:
-                del self.udp_recv_threads[client_id]
+            self.close_udp_client(client_id)
             self.logger.debug(f"Closed UDP client {client_id}")
         except Exception as e:
             self.logger.error(f"Error closing UDP client {client_id}: {e}")
 
+    def close_udp_client(self, client_id: str):
+        """Release the socket (and receive thread) of a UDP client"""
+        sock = self.udp_connections.pop(client_id, None)
+        self.udp_targets.pop(client_id, None)
+        self.channel_lanes.pop(client_id, None)
+        self.udp_recv_threads.pop(client_id, None)
+        self.udp_sessions.remove(client_id)
+        self.udp_pending.remove(client_id)
+        if sock:
+            if self.udp_relay:
+                self.udp_relay.remove(sock)
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    def drop_udp_client(self, client_id: str):
+        """Close a UDP client on our own initiative and tell Pato2 to forget it"""
+        self.send_channel_message(client_id, {'type': 'udp_close', 'clientId': client_id})
+        self.close_udp_client(client_id)
+
+    def udp_sweep_loop(self):
+        """Periodically close UDP sessions (and ping-only clients) idle for too long"""
+        while self.running:
+            time.sleep(self.udp_sessions.sweep_interval())
+            for client_id in self.udp_sessions.expired() + self.udp_pending.expired():
+                self.logger.debug(f"UDP client {client_id} idle, closing")
+                self.drop_udp_client(client_id)
+
     def udp_receive_loop(self, client_id: str, sock: socket.socket):
         while self.running and client_id in self.udp_connections:
             try:
@@ -438,11 +886,7 @@ class HostAgent:
                 if not data:
                     time.sleep(0.05)
                     continue
-                self.send_websocket_message({
-                    'type': 'udp_data',
-                    'clientId': client_id,
-                    'data': base64.b64encode(data).decode('ascii')
-                })
+                self.send_udp_data(client_id, data)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -458,22 +902,41 @@ class HostAgent:
         if stream_id not in self.connections:
             self.logger.warning(f"Received data for unknown stream: {stream_id}")
             return
-            
+
         try:
-            # Decode and send to Minecraft server
             raw_data = base64.b64decode(base64_data)
-            sock = self.connections.get(stream_id)
-            # Validate socket before using it
-            try:
-                if not sock or sock.fileno() == -1:
-                    raise OSError(10038, 'Socket is invalid or closed')
-                sock.send(raw_data)
-            except Exception as e:
-                raise e
-            
         except Exception as e:
             self.logger.error(f"Error handling stream data for {stream_id}: {e}")
             self.close_stream(stream_id)
+            return
+        self.write_stream(stream_id, raw_data)
+
+    def write_stream(self, stream_id: str, raw_data):
+        """Queue stream payload from Pato2 for the local server"""
+        stream = self.connections.get(stream_id)
+        if not stream:
+            self.logger.warning(f"Received data for unknown stream: {stream_id}")
+            return
+
+        if not stream.enqueue(bytes(raw_data)):
+            if stream.closed:
+                # Data that was in flight when the stream closed
+                self.logger.debug(f"Dropping data for closed stream {stream_id}")
+                return
+            self.logger.error(
+                f"Write buffer full for stream {stream_id} "
+                f"({stream.buffered_bytes} bytes pending), closing"
+            )
+            self.close_stream(stream_id)
+
+    def handle_stream_ack(self, data: dict):
+        """Return send credit for bytes Pato2 delivered to the player"""
+        stream = self.connections.get(data.get('streamId'))
+        if stream:
+            try:
+                stream.release_credit(int(data.get('bytes') or 0))
+            except (TypeError, ValueError):
+                self.logger.warning(f"Invalid ack for stream {stream.stream_id}: {data.get('bytes')}")
 
     def handle_close_stream(self, data):
         """Handle stream close request"""
@@ -496,25 +959,31 @@ class HostAgent:
 
     def handle_minecraft_data(self, stream_id: str, sock: socket.socket):
         """Handle data from Minecraft server for a specific stream"""
+        buffer = ReceiveBuffer(self.recv_buffers, self.config['stream_read_min'], self.config['stream_read_max'])
         try:
             while stream_id in self.connections and self.running:
                 try:
                     # Always fetch current socket reference to avoid using a closed one
-                    current_sock = self.connections.get(stream_id)
+                    stream = self.connections.get(stream_id)
+                    current_sock = stream.sock if stream else None
                     if not current_sock or current_sock.fileno() == -1:
                         raise OSError(10038, 'Socket is invalid or closed')
 
-                    data = current_sock.recv(4096)
-                    if not data:
+                    # Hold the server's output while the tunnel is down and the stream waits to resume
+                    if not stream.wait_attached(1.0):
+                        continue
+
+                    # Stop reading while the player's side has too much unacknowledged data
+                    if not stream.wait_for_credit(1.0):
+                        continue
+
+                    # recv_into a reused buffer; send_stream_data encodes the view or takes the buffer over
+                    data = buffer.read(current_sock)
+                    if data is None:
                         break
-                        
-                    # Encode and send to Pato2
-                    base64_data = base64.b64encode(data).decode('utf-8')
-                    self.send_websocket_message({
-                        'type': 'data',
-                        'streamId': stream_id,
-                        'data': base64_data
-                    })
+
+                    stream.consume_credit(len(data))
+                    self.send_stream_data(stream_id, data, buffer)
                     
                 except socket.timeout:
                     continue
@@ -525,73 +994,252 @@ class HostAgent:
         except Exception as e:
             self.logger.error(f"Error in Minecraft data handler for {stream_id}: {e}")
         finally:
+            buffer.release()
             self.close_stream(stream_id)
 
     def close_stream(self, stream_id: str):
         """Close a specific stream"""
-        if stream_id in self.connections:
-            try:
-                self.connections[stream_id].close()
-            except:
-                pass
-            del self.connections[stream_id]
-            
+        stream = self.connections.pop(stream_id, None)
+        if stream:
+            stream.close()
+
             # Notify Pato2
-            self.send_websocket_message({
+            self.send_channel_message(stream_id, {
                 'type': 'close',
                 'streamId': stream_id
             })
+        self.channel_lanes.pop(stream_id, None)
 
     def close_all_connections(self):
         """Close all active connections"""
         for stream_id in list(self.connections.keys()):
             self.close_stream(stream_id)
-        for client_id in list(self.udp_connections.keys()):
-            try:
-                self.udp_connections[client_id].close()
-            except Exception:
-                pass
-            if client_id in self.udp_connections:
-                del self.udp_connections[client_id]
-            if client_id in self.udp_recv_threads:
-                del self.udp_recv_threads[client_id]
+        for client_id in set(self.udp_connections) | set(self.udp_targets):
+            self.close_udp_client(client_id)
 
     def send_websocket_message(self, message: dict):
-        """Send message via WebSocket"""
-        if self.websocket and self.websocket.sock and self.websocket.sock.connected:
-            try:
-                self.websocket.send(json.dumps(message))
-            except Exception as e:
-                self.logger.error(f"Error sending WebSocket message: {e}")
+        """Queue message for the WebSocket sender thread"""
+        priority = message_priority(message)
+        if priority == PRIORITY_DATA and self.tunnel_options.batch_frames:
+            # Keep in-order messages (close, udp_close, ...) behind data already batched
+            self.batcher.flush('control')
+        self.sender.send_message(message, priority)
+
+    def send_binary_frame(self, frame: bytes):
+        """Queue binary frame for the WebSocket sender thread"""
+        self.sender.send_binary_frame(frame)
+
+    def send_channel_message(self, channel_id: str, message: dict):
+        """Send a stream-scoped control message on the stream's lane"""
+        lane = self.lane_for(channel_id)
+        if lane:
+            lane.send_channel_message(channel_id, message)
+        elif self.scheduler and message_priority(message) == PRIORITY_DATA:
+            # In order behind the channel's data still waiting in the scheduler
+            self.scheduler.submit(channel_id, 0, self.send_websocket_message, message)
+        else:
+            self.send_websocket_message(message)
+
+    def send_payload(self, opcode: int, channel_id: str, data: bytes, owner: Optional[ReceiveBuffer] = None):
+        """Send a stream/UDP payload to Pato2 using the negotiated framing
+
+        data may be a view into owner, a reused receive buffer. Without a
+        scheduler it is encoded before returning; a scheduler queues the view
+        itself and takes the buffer over from owner (see queue_payload).
+        """
+        lane = self.lane_for(channel_id)
+        if lane:
+            lane.send_payload(opcode, channel_id, data, owner)
+        elif self.scheduler:
+            self.queue_payload(self.scheduler, self.deliver_payload, opcode, channel_id, data, owner)
+        else:
+            self.deliver_payload(opcode, channel_id, data)
+
+    def queue_payload(self, scheduler: FairScheduler, deliver: Callable, opcode: int, channel_id: str,
+                      data: bytes, owner: Optional[ReceiveBuffer]):
+        """Submit deliver(opcode, channel_id, data) to a scheduler without copying data
+
+        A view into owner keeps its buffer, which goes back to the pool once
+        delivered; other views are copied. bytes are queued as they are.
+        """
+        if owner is not None:
+            buf = owner.hand_off()
+            scheduler.submit(channel_id, len(data), self.deliver_pooled, buf, deliver, opcode, channel_id, data)
+        else:
+            scheduler.submit(channel_id, len(data), deliver, opcode, channel_id, bytes(data))
+
+    def deliver_pooled(self, buf: bytearray, deliver: Callable, opcode: int, channel_id: str, data: memoryview):
+        try:
+            deliver(opcode, channel_id, data)
+        finally:
+            self.recv_buffers.release(buf)
+
+    def deliver_payload(self, opcode: int, channel_id: str, data: bytes):
+        """Hand a payload to the batcher or sender of the primary WebSocket"""
+        if self.tunnel_options.batch_frames:
+            self.batcher.submit(opcode, channel_id, data)
+        elif self.tunnel_options.binary_frames:
+            self.send_binary_frame(encode_frame(opcode, channel_id, data))
+        else:
+            self.send_websocket_message(payload_message(opcode, channel_id, data))
+
+    def send_stream_data(self, stream_id: str, data: bytes, owner: Optional[ReceiveBuffer] = None):
+        """Send stream payload to Pato2, keeping a copy for replay when resumption is on
+
+        With resumption the one copy is shared by the replay buffer and the
+        scheduler; otherwise see send_payload.
+        """
+        stream = self.connections.get(stream_id)
+        if stream and stream.replay:
+            data = bytes(data)
+            with stream.send_lock:
+                stream.replay.append(data)
+                # While detached the bytes only go to the replay buffer, resume_stream sends them
+                if stream.attached.is_set():
+                    self.send_resumable(stream, data)
+            return
+        self.send_payload(OP_DATA, stream_id, data, owner)
+
+    def send_resumable(self, stream: TunnelStream, data: bytes):
+        """send_payload of bytes for a stream with a replay buffer (call with send_lock held)
+
+        Resumption is only offered without lanes, so this is the primary
+        WebSocket. Payloads still queued when the tunnel drops are dropped on
+        delivery: the replay resends them from the offset Pato2 reports.
+        """
+        if self.scheduler:
+            self.scheduler.submit(stream.stream_id, len(data), self.deliver_resumable, stream, stream.epoch, data)
+        else:
+            self.deliver_payload(OP_DATA, stream.stream_id, data)
+
+    def deliver_resumable(self, stream: TunnelStream, epoch: int, data: bytes):
+        with stream.deliver_lock:
+            if stream.epoch == epoch:
+                self.deliver_payload(OP_DATA, stream.stream_id, data)
+
+    def send_udp_data(self, client_id: str, data: bytes):
+        """Send datagram to Pato2"""
+        self.udp_sessions.touch(client_id)
+        self.send_payload(OP_UDP_DATA, client_id, data)
+
+    def send_udp_batch(self, datagrams: List[Tuple[str, bytes]]):
+        """Send datagrams read in one relay wakeup, as one batch frame per lane when possible"""
+        groups: Dict[Optional[TunnelLane], List[Tuple[int, str, bytes]]] = {}
+        for client_id, data in datagrams:
+            self.udp_sessions.touch(client_id)
+            groups.setdefault(self.lane_for(client_id), []).append((OP_UDP_DATA, client_id, data))
+        for lane, records in groups.items():
+            batcher = lane.batcher if lane else self.batcher
+            if self.tunnel_options.batch_frames:
+                batcher.submit_many(records, 'udp')
+            else:
+                for opcode, client_id, data in records:
+                    self.send_payload(opcode, client_id, data)
+
+    def get_status(self) -> dict:
+        """Get tunnel status including per-stream buffered bytes"""
+        if self.tunnel_engine:
+            return self.tunnel_engine.get_status()
+        return {
+            'engine': 'threads',
+            'connected': bool(self.websocket and self.websocket.sock and self.websocket.sock.connected),
+            'options': self.tunnel_options.describe(),
+            'streams': {stream_id: stream.get_status() for stream_id, stream in list(self.connections.items())},
+            'udp_clients': len(self.udp_connections),
+            'connection_pool': self.connection_pool.get_metrics(),
+            'java_status': self.status_cache.get_metrics() if self.status_cache else None,
+            'heartbeat': self.get_heartbeat_metrics(),
+            'bedrock_pong': self.get_pong_metrics(),
+            'udp_sessions': self.udp_sessions.get_metrics(),
+            'udp_pending': self.udp_pending.get_metrics(),
+            'udp_relay': self.udp_relay.get_metrics() if self.udp_relay else None,
+            'batching': self.batcher.get_metrics(),
+            'sender': self.sender.get_metrics(),
+            'scheduler': self.scheduler.get_metrics() if self.scheduler else None,
+            'lanes': [
+                {
+                    'index': lane.index,
+                    'connected': lane.connected,
+                    'batching': lane.batcher.get_metrics(),
+                    'sender': lane.sender.get_metrics(),
+                    'scheduler': lane.scheduler.get_metrics() if lane.scheduler else None
+                }
+                for lane in list(self.lanes)
+            ]
+        }
+
+    def status_loop(self):
+        """Periodically log tunnel status"""
+        while self.running:
+            time.sleep(self.config['status_interval'])
+            status = self.get_status()
+            buffered = sum(s['buffered_bytes'] for s in status['streams'].values())
+            in_flight = sum(s['in_flight_bytes'] for s in status['streams'].values())
+            batching = status['batching']
+            sender = status.get('sender')
+            self.logger.info(
+                f"Tunnel status: {len(status['streams'])} streams, {status['udp_clients']} UDP clients, "
+                f"{buffered} bytes buffered, {in_flight} bytes in flight, "
+                f"avg batch {batching['batch_records']['avg']:.1f} records, "
+                f"flushes {batching['flush_reasons']}"
+                + (f", send queue {sender['queue_depth']}" if sender else "")
+            )
+            for stream_id, stream_status in status['streams'].items():
+                self.logger.debug(f"Stream {stream_id}: {stream_status}")
 
     def heartbeat_loop(self):
-        """Heartbeat loop thread"""
+        """Heartbeat loop thread
+
+        Uses the tunnel WebSocket when Pato2 accepted ws_heartbeat. A missing
+        heartbeat_ack after a few tunnel round trips falls back to the HTTP
+        heartbeat, which decides whether the lease is lost.
+        """
         while self.running:
+            if self.send_ws_heartbeat():
+                if self.heartbeat_ack.wait(self.heartbeat_ack_timeout()):
+                    if not self.heartbeat_ok:
+                        self.logger.error("Heartbeat failed, attempting to reconnect...")
+                        break
+                    self.heartbeat_counters.inc('ws')
+                    time.sleep(self.config['heartbeat_interval'])
+                    continue
+                self.heartbeat_counters.inc('ws_timeouts')
+                self.logger.warning("No heartbeat_ack on the tunnel WebSocket, falling back to HTTP")
+            self.heartbeat_counters.inc('http')
             if not self.send_heartbeat():
                 self.logger.error("Heartbeat failed, attempting to reconnect...")
                 break
             time.sleep(self.config['heartbeat_interval'])
 
+    def reconnect_attempts_left(self, backoff: Backoff) -> bool:
+        """False once MAX_RECONNECT_ATTEMPTS consecutive attempts failed (0 = retry forever)"""
+        max_attempts = self.config['max_reconnect_attempts']
+        return max_attempts <= 0 or backoff.attempts < max_attempts
+
     def websocket_loop(self):
-        """WebSocket connection loop with reconnection"""
-        reconnect_attempts = 0
-        
-        while self.running and reconnect_attempts < self.config['max_reconnect_attempts']:
+        """WebSocket connection loop with reconnection
+
+        Attempts are spaced by a jittered exponential backoff that restarts
+        whenever a connection opens, and the Pato2 hostname is re-resolved
+        before each one.
+        """
+        backoff = self.reconnect_backoff
+        while self.running and self.reconnect_attempts_left(backoff):
             try:
                 if self.connect_websocket():
                     self.websocket.run_forever()
-                    
-                if self.running:
-                    reconnect_attempts += 1
-                    self.logger.warning(f"WebSocket disconnected, reconnecting... (attempt {reconnect_attempts})")
-                    time.sleep(self.config['reconnect_delay'])
-                    
             except Exception as e:
                 self.logger.error(f"WebSocket error: {e}")
-                reconnect_attempts += 1
-                time.sleep(self.config['reconnect_delay'])
-        
-        if reconnect_attempts >= self.config['max_reconnect_attempts']:
+
+            if not self.running:
+                break
+            if self.control.dns:
+                self.control.dns.invalidate()
+            delay = backoff.next_delay()
+            self.logger.warning(f"WebSocket disconnected, reconnecting in {delay:.1f}s... (attempt {backoff.attempts})")
+            time.sleep(delay)
+
+        if self.running and not self.reconnect_attempts_left(backoff):
             self.logger.error("Max reconnection attempts reached, shutting down")
             self.shutdown()
 
@@ -615,11 +1263,37 @@ class HostAgent:
         self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
         self.heartbeat_thread.start()
         
-        # Start WebSocket thread
-        self.websocket_thread = threading.Thread(target=self.websocket_loop, daemon=True)
+        self.connection_pool.start([self.config['minecraft_port']])
+        if self.status_cache:
+            self.status_cache.start()
+
+        # Start WebSocket thread (threaded tunnel or asyncio engine)
+        self.sender.start()
+        if self.scheduler:
+            self.scheduler.start()
+        self.batcher.start()
+        tunnel_target = self.websocket_loop
+        if self.config['tunnel_engine'] == 'asyncio':
+            if AsyncTunnelEngine.is_available():
+                self.tunnel_engine = AsyncTunnelEngine(self)
+                tunnel_target = self.tunnel_engine.run
+                self.logger.info("Using asyncio tunnel engine")
+                if self.config['tunnel_lanes'] > 0:
+                    self.logger.warning("TUNNEL_LANES is only supported by the threaded engine, using a single connection")
+            else:
+                self.logger.warning("TUNNEL_ENGINE=asyncio requires the 'websockets' package, falling back to threads")
+        self.websocket_thread = threading.Thread(target=tunnel_target, daemon=True)
         self.websocket_thread.start()
+        if not self.tunnel_engine:
+            if self.udp_relay:
+                self.udp_relay.start()
+            threading.Thread(target=self.udp_sweep_loop, daemon=True).start()
+
+        if self.config['status_interval'] > 0:
+            threading.Thread(target=self.status_loop, daemon=True).start()
         
         # Start Minecraft server if not running
+        self.minecraft_manager.start_monitor()
         if not self.minecraft_manager.is_server_running():
             self.logger.info("Starting Minecraft server...")
             # Descargar último backup (si existe) antes de iniciar el servidor
@@ -640,8 +1314,7 @@ class HostAgent:
             try:
                 if self.minecraft_manager.is_server_running():
                     self.logger.info("Enviando save-all al servidor antes de backup...")
-                    self.minecraft_manager.send_command("save-all")
-                    time.sleep(2)
+                    self.minecraft_manager.save_all()
                     self.logger.info("Deteniendo servidor Minecraft para liberar archivos...")
                     self.minecraft_manager.stop_server()
                     time.sleep(2)
@@ -651,8 +1324,8 @@ class HostAgent:
             # Al salir: crear y subir backup comprimiendo mundos y plugins
             try:
                 self.logger.info("Creando y subiendo backup antes de salir...")
-                self.backup_manager.create_backup()
-                self.exit_backup_done = True
+                # Un backup en curso se espera; si falla, shutdown lo reintenta
+                self.exit_backup_done = self.backup_manager.create_backup(wait=True)
             except Exception as e:
                 self.logger.error(f"No se pudo crear/subir el backup tras Ctrl+C: {e}")
 
@@ -672,8 +1345,7 @@ class HostAgent:
             if self.minecraft_manager.is_server_running():
                 self.logger.info("Deteniendo servidor Minecraft en shutdown...")
                 # Intentar flush previo
-                self.minecraft_manager.send_command("save-all")
-                time.sleep(2)
+                self.minecraft_manager.save_all()
                 self.minecraft_manager.stop_server()
                 time.sleep(2)
         except Exception as e:
@@ -683,20 +1355,38 @@ class HostAgent:
         if not self.exit_backup_done:
             try:
                 self.logger.info("Creando y subiendo backup en shutdown...")
-                self.backup_manager.create_backup()
-                self.exit_backup_done = True
+                self.exit_backup_done = self.backup_manager.create_backup(wait=True)
             except Exception as e:
                 self.logger.warning(f"No se pudo crear/subir backup en shutdown: {e}")
         
         # Close all connections
+        self.cancel_resume_timer()
         self.close_all_connections()
         
         # Close WebSocket
+        if self.scheduler:
+            self.scheduler.stop()
+        self.batcher.stop()
+        self.sender.stop()
+        self.stop_lanes()
+        if self.udp_relay:
+            self.udp_relay.stop()
+        self.connection_pool.stop()
+        if self.status_cache:
+            self.status_cache.stop()
+        with self.pong_caches_lock:
+            for cache in self.pong_caches.values():
+                cache.stop()
+        if self.tunnel_engine:
+            self.tunnel_engine.stop()
         if self.websocket:
             self.websocket.close()
         
+        self.minecraft_manager.stop_monitor()
+
         # End lease
         self.end_lease()
+        self.control.close()
         
         # Stop Minecraft server if we started it
         # self.minecraft_manager.stop_server()
@@ -0,0 +1,286 @@
+"""
+Java Status
+Answers Java Edition server-list pings from a cached status response
+"""
+
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from metrics import Counters
+
+# Handshake next-state values
+STATE_STATUS = 1
+STATE_LOGIN = 2
+
+# Pre-netty (1.6 and older) server-list ping starts with this byte
+LEGACY_PING = 0xFE
+
+# A handshake is a few dozen bytes; anything larger is not one we can parse
+MAX_HANDSHAKE_BYTES = 1024
+
+# Protocol version used for our own status queries until a client tells us one
+DEFAULT_PROTOCOL = 47
+
+# Seconds to wait for the next packet of a client during a status exchange
+CLIENT_TIMEOUT = 5.0
+
+
+class PacketError(ValueError):
+    """Raised when bytes cannot be a valid Java protocol packet"""
+
+
+def read_varint(data, offset: int) -> Optional[Tuple[int, int]]:
+    """Decode a VarInt at offset, returns (value, next_offset) or None if incomplete"""
+    value = 0
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            return None
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            if value & 0x80000000:
+                value -= 1 << 32
+            return value, offset
+    raise PacketError("VarInt too long")
+
+
+def encode_varint(value: int) -> bytes:
+    value &= 0xffffffff
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_packet(packet_id: int, body: bytes) -> bytes:
+    """Uncompressed packet: [length:varint][id:varint][body]"""
+    payload = encode_varint(packet_id) + body
+    return encode_varint(len(payload)) + payload
+
+
+def read_packet(data, offset: int = 0) -> Optional[Tuple[int, bytes, int]]:
+    """Split one packet off data at offset, returns (packet_id, body, next_offset) or None if incomplete"""
+    header = read_varint(data, offset)
+    if header is None:
+        return None
+    length, start = header
+    if length <= 0:
+        raise PacketError(f"Invalid packet length: {length}")
+    end = start + length
+    if len(data) < end:
+        return None
+    # Copied so the caller can keep appending to a bytearray buffer
+    payload = bytes(data[start:end])
+    packet_id = read_varint(payload, 0)
+    if packet_id is None:
+        raise PacketError("Truncated packet id")
+    return packet_id[0], payload[packet_id[1]:], end
+
+
+def parse_handshake(body) -> Tuple[int, str, int, int]:
+    """Decode a handshake body into (protocol, address, port, next_state)"""
+    parsed = read_varint(body, 0)
+    if parsed is None:
+        raise PacketError("Truncated handshake")
+    protocol, offset = parsed
+    parsed = read_varint(body, offset)
+    if parsed is None:
+        raise PacketError("Truncated handshake")
+    address_length, offset = parsed
+    if address_length < 0 or len(body) < offset + address_length + 2:
+        raise PacketError("Truncated handshake")
+    address = bytes(body[offset:offset + address_length]).decode('utf-8', 'replace')
+    offset += address_length
+    port = int.from_bytes(body[offset:offset + 2], 'big')
+    parsed = read_varint(body, offset + 2)
+    if parsed is None:
+        raise PacketError("Truncated handshake")
+    return protocol, address, port, parsed[0]
+
+
+def encode_handshake(protocol: int, address: str, port: int, next_state: int) -> bytes:
+    address_bytes = address.encode('utf-8')
+    body = (encode_varint(protocol) + encode_varint(len(address_bytes)) + address_bytes
+            + port.to_bytes(2, 'big') + encode_varint(next_state))
+    return encode_packet(0x00, body)
+
+
+class JavaStatusCache:
+    """Status response of the local server, re-queried in the background while pings keep coming
+
+    get() never blocks on the server: it returns the cached Status Response
+    packet while it is younger than ttl, otherwise None (the caller then
+    proxies the ping to the server) and wakes the refresher.
+    """
+
+    # Stop refreshing once nobody has asked for the status for this long
+    IDLE_AFTER = 60.0
+
+    def __init__(self, port: int, ttl: float, connect_timeout: float = 2.0):
+        self.port = port
+        self.ttl = ttl
+        self.connect_timeout = connect_timeout
+        self.logger = logging.getLogger('JavaStatusCache')
+
+        self._lock = threading.Lock()
+        self._response: Optional[bytes] = None
+        self._fetched_at = 0.0
+        self._last_request = 0.0
+        self.client_protocol = DEFAULT_PROTOCOL
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+        self.counters = Counters(['hits', 'misses', 'proxied', 'refreshes', 'refresh_errors'])
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def get(self) -> Optional[bytes]:
+        """Cached Status Response packet, None when missing or older than ttl"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_request = now
+            response = self._response if now - self._fetched_at < self.ttl else None
+        if response is None:
+            self.counters.inc('misses')
+            self._wakeup.set()
+        else:
+            self.counters.inc('hits')
+        return response
+
+    def fetch(self) -> bytes:
+        """Query the local server for a fresh Status Response packet"""
+        with socket.create_connection(('127.0.0.1', self.port), timeout=self.connect_timeout) as sock:
+            sock.sendall(encode_handshake(self.client_protocol, '127.0.0.1', self.port, STATE_STATUS)
+                         + encode_packet(0x00, b''))
+            data = bytearray()
+            while True:
+                parsed = read_packet(data)
+                if parsed is not None:
+                    packet_id, _, end = parsed
+                    if packet_id != 0x00:
+                        raise PacketError(f"Unexpected status packet id: {packet_id}")
+                    return bytes(data[:end])
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise PacketError("Server closed the connection before answering")
+                data += chunk
+
+    def refresh(self):
+        try:
+            response = self.fetch()
+        except Exception as e:
+            self.counters.inc('refresh_errors')
+            self.logger.debug(f"Could not refresh server status: {e}")
+            return
+        with self._lock:
+            self._response = response
+            self._fetched_at = time.monotonic()
+        self.counters.inc('refreshes')
+
+    def _refresh_loop(self):
+        while self._running:
+            self._wakeup.wait(max(0.5, self.ttl / 2))
+            self._wakeup.clear()
+            if not self._running:
+                return
+            now = time.monotonic()
+            with self._lock:
+                idle = now - self._last_request > self.IDLE_AFTER
+                age = now - self._fetched_at
+            # Refresh ahead of expiry so pings keep hitting the cache
+            if not idle and age >= self.ttl / 2:
+                self.refresh()
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            cached = self._response is not None
+            age = time.monotonic() - self._fetched_at if cached else None
+        return {
+            'cached': cached,
+            'age_seconds': age,
+            'ttl': self.ttl,
+            'counters': self.counters.snapshot()
+        }
+
+
+def answer_status_ping(next_payload: Callable[[], Optional[bytes]], send: Callable[[bytes], None],
+                       cache: JavaStatusCache) -> Optional[bytes]:
+    """Serve a server-list ping on a new stream from the cache
+
+    next_payload() returns the next bytes from the client, None once the
+    stream is closed or the client went quiet. Returns the bytes read so far
+    when the stream has to go to the real server (login, legacy ping, cache
+    miss, unparseable handshake), or None when it was handled here and should
+    be closed.
+    """
+    buf = bytearray()
+    while True:
+        try:
+            parsed = read_packet(buf)
+        except PacketError:
+            return bytes(buf)
+        if parsed is not None:
+            break
+        if (buf and buf[0] == LEGACY_PING) or len(buf) > MAX_HANDSHAKE_BYTES:
+            return bytes(buf)
+        payload = next_payload()
+        if payload is None:
+            return bytes(buf) if buf else None
+        buf += payload
+
+    packet_id, body, offset = parsed
+    try:
+        if packet_id != 0x00:
+            raise PacketError(f"Not a handshake: packet id {packet_id}")
+        protocol, _, _, next_state = parse_handshake(body)
+    except PacketError:
+        return bytes(buf)
+    if next_state != STATE_STATUS:
+        cache.counters.inc('proxied')
+        return bytes(buf)
+
+    cache.client_protocol = protocol
+    response = cache.get()
+    if response is None:
+        return bytes(buf)
+
+    # Status Request (0x00) gets the cached response, Ping (0x01) is echoed back as Pong
+    while True:
+        try:
+            parsed = read_packet(buf, offset)
+        except PacketError:
+            return None
+        if parsed is None:
+            payload = next_payload()
+            if payload is None:
+                return None
+            buf += payload
+            continue
+        packet_id, body, end = parsed
+        if packet_id == 0x00:
+            send(response)
+        elif packet_id == 0x01:
+            send(bytes(buf[offset:end]))
+            return None
+        else:
+            return None
+        offset = end
@@ -0,0 +1,60 @@
+"""
+Metrics
+Lightweight thread-safe counters and histograms for agent status output
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Optional
+
+
+class Counters:
+    """Named monotonically increasing counters"""
+
+    def __init__(self, names: Optional[List[str]] = None):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {name: 0 for name in (names or [])}
+
+    def inc(self, name: str, amount: int = 1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """Fixed-bucket histogram (bucket bounds are inclusive upper limits)"""
+
+    def __init__(self, buckets: List[float]):
+        self.bounds = sorted(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = {f"le_{bound:g}": count for bound, count in zip(self.bounds, self._counts)}
+            buckets['inf'] = self._counts[-1]
+            return {
+                'count': self._count,
+                'avg': (self._sum / self._count) if self._count else 0.0,
+                'max': self._max,
+                'buckets': buckets
+            }
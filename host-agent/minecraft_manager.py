@@ -8,9 +8,12 @@ import subprocess
 import time
 import logging
 import psutil
-import socket
 from typing import Optional
 
+from rcon_client import RconClient, RconError
+from server_console import ServerConsole
+from server_monitor import ServerStatusMonitor
+
 class MinecraftManager:
     def __init__(self, minecraft_dir: str, minecraft_port: int = 25565):
         self.minecraft_dir = minecraft_dir
@@ -21,38 +24,47 @@ class MinecraftManager:
         # Server configuration
         self.server_jar = os.getenv('SERVER_JAR', 'server.jar')
         self.java_args = os.getenv('JAVA_ARGS', '-Xmx2G -Xms1G')
+
+        # Process and readiness state, kept current in the background (see start_monitor)
+        self.monitor = ServerStatusMonitor(
+            minecraft_dir,
+            minecraft_port,
+            os.getenv('SERVER_PIDFILE') or os.path.join(minecraft_dir, 'server.pid'),
+            float(os.getenv('SERVER_MONITOR_INTERVAL_SECONDS', '1')),
+            float(os.getenv('SERVER_PORT_SCAN_INTERVAL_SECONDS', '60'))
+        )
+
+        # Server output is drained continuously (a full pipe would stall the server's tick loop)
+        self.console = ServerConsole(
+            int(os.getenv('SERVER_CONSOLE_LINES', '1000')),
+            os.getenv('SERVER_CONSOLE_LOG') or None,
+            int(os.getenv('SERVER_CONSOLE_LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            int(os.getenv('SERVER_CONSOLE_LOG_BACKUPS', '3'))
+        )
+        self.console.on('ready', lambda match, line: self.monitor.on_log_line(line))
+        self.console.on('stopping', lambda match, line: self.monitor.on_log_line(line))
+
+        # Commands go over RCON when server.properties enables it (see send_command)
+        self.rcon: Optional[RconClient] = None
+        self.rcon_timeout = float(os.getenv('RCON_TIMEOUT_SECONDS', '10'))
+        self.save_timeout = float(os.getenv('SAVE_TIMEOUT_SECONDS', '60'))
+
+    def start_monitor(self):
+        """Start tracking the server in the background"""
+        self.monitor.start()
+
+    def stop_monitor(self):
+        self.monitor.stop()
         
     def is_server_running(self) -> bool:
-        """Check if Minecraft server is running"""
-        try:
-            # Check if our process is still alive
-            if self.server_process and self.server_process.poll() is None:
-                return True
-            
-            # Check if any process is using the Minecraft port
-            for conn in psutil.net_connections():
-                if conn.laddr.port == self.minecraft_port and conn.status == 'LISTEN':
-                    return True
-                    
-            return False
-        except Exception as e:
-            self.logger.error(f"Error checking server status: {e}")
-            return False
+        """Check if Minecraft server is running (cached by the status monitor)"""
+        self.monitor.ensure_checked()
+        return self.monitor.running
     
     def is_server_ready(self) -> bool:
-        """Check if Minecraft server is ready to accept connections"""
-        if not self.is_server_running():
-            return False
-            
-        try:
-            # Try to connect to the server port
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            result = sock.connect_ex(('127.0.0.1', self.minecraft_port))
-            sock.close()
-            return result == 0
-        except Exception:
-            return False
+        """Check if Minecraft server is ready to accept connections (cached by the status monitor)"""
+        self.monitor.ensure_checked()
+        return self.monitor.ready
     
     def start_server(self) -> bool:
         """Start the Minecraft server"""
@@ -91,24 +103,21 @@ class MinecraftManager:
                 stdin=subprocess.PIPE,
                 text=True,
                 bufsize=1,
-                universal_newlines=True
+                universal_newlines=True,
+                errors='replace'
             )
+            self.console.attach(self.server_process.stdout)
             
-            # Wait a moment and check if it started successfully
-            time.sleep(2)
+            self.monitor.attach(self.server_process)
+            
+            # Wait for server to be ready (up to 60 seconds), returns early if it exits
+            if self.monitor.wait_ready(60):
+                self.logger.info("Minecraft server is ready")
+                return True
             if self.server_process.poll() is not None:
                 self.logger.error("Minecraft server failed to start")
                 return False
             
-            self.logger.info("Minecraft server started successfully")
-            
-            # Wait for server to be ready (up to 60 seconds)
-            for i in range(60):
-                if self.is_server_ready():
-                    self.logger.info("Minecraft server is ready")
-                    return True
-                time.sleep(1)
-            
             self.logger.warning("Minecraft server started but may not be fully ready")
             return True
             
@@ -123,6 +132,18 @@ class MinecraftManager:
             return True
             
         try:
+            if not self.server_process and self._get_rcon():
+                # Not started by us (no console): ask over RCON and wait for the process to exit
+                self.logger.info("Sending stop command to Minecraft server over RCON")
+                try:
+                    self.rcon.command("stop")
+                except (OSError, RconError) as e:
+                    self.logger.warning(f"Failed to send stop via RCON: {e}")
+                if self.monitor.wait_stopped(30):
+                    self.logger.info("Minecraft server stopped gracefully")
+                    self.monitor.detach()
+                    return True
+
             if self.server_process:
                 # Send stop command
                 try:
@@ -140,6 +161,7 @@ class MinecraftManager:
                     if self.server_process.poll() is not None:
                         self.logger.info("Minecraft server stopped gracefully")
                         self.server_process = None
+                        self.monitor.detach()
                         return True
                     time.sleep(1)
                 
@@ -155,6 +177,7 @@ class MinecraftManager:
             
             # Double-check by killing any process using the port
             self._kill_processes_on_port()
+            self.monitor.detach()
             
             return True
             
@@ -173,12 +196,61 @@ class MinecraftManager:
         
         return self.start_server()
     
-    def send_command(self, command: str) -> bool:
-        """Send a command to the Minecraft server"""
-        if not self.server_process or self.server_process.poll() is not None:
+    def send_command(self, command: str) -> Optional[str]:
+        """Send a command to the Minecraft server
+
+        Over RCON the command's output is returned once the server ran it;
+        through the console (stdin) there is no reply and '' is returned.
+        None if the command could not be sent.
+        """
+        if not self.is_server_running():
             self.logger.error("Cannot send command: server is not running")
+            return None
+
+        rcon = self._get_rcon()
+        if rcon:
+            try:
+                self.logger.debug(f"Sending command to server over RCON: {command}")
+                return rcon.command(command)
+            except (OSError, RconError) as e:
+                self.logger.warning(f"RCON command failed, falling back to the console: {e}")
+
+        return '' if self._write_console(command) else None
+
+    def save_all(self, flush: bool = True) -> bool:
+        """Save the world and wait until the server reports it is written, False if unconfirmed"""
+        if not self.is_server_running():
+            return False
+        command = "save-all flush" if flush else "save-all"
+
+        rcon = self._get_rcon()
+        if rcon:
+            try:
+                # The reply only comes back after the save ran on the server thread
+                output = rcon.command(command, self.save_timeout)
+                self.logger.info(f"World saved: {output.strip() or 'ok'}")
+                return True
+            except (OSError, RconError) as e:
+                self.logger.warning(f"RCON save failed, falling back to the console: {e}")
+
+        line = self.console.wait_for('saved', self.save_timeout, lambda: self._write_console(command))
+        if line is None:
+            self.logger.warning(f"Server did not confirm the save within {self.save_timeout:.0f}s")
+            return False
+        self.logger.info("World saved")
+        return True
+
+    def _get_rcon(self) -> Optional[RconClient]:
+        """RCON client for the local server, None when server.properties does not enable RCON"""
+        if self.rcon is None:
+            self.rcon = RconClient.from_properties(self.minecraft_dir, self.rcon_timeout)
+        return self.rcon
+
+    def _write_console(self, command: str) -> bool:
+        """Write a command to the console of a server we started"""
+        if not self.server_process or self.server_process.poll() is not None or not self.server_process.stdin:
+            self.logger.error("Cannot send command: server console is not available")
             return False
-            
         try:
             self.logger.debug(f"Sending command to server: {command}")
             self.server_process.stdin.write(f"{command}\n")
@@ -190,13 +262,19 @@ class MinecraftManager:
     
     def get_server_info(self) -> dict:
         """Get information about the Minecraft server"""
+        self.monitor.ensure_checked()
+        state = self.monitor.snapshot()
         return {
-            'running': self.is_server_running(),
-            'ready': self.is_server_ready(),
+            'running': state['running'],
+            'ready': state['ready'],
             'port': self.minecraft_port,
             'directory': self.minecraft_dir,
             'server_jar': self.server_jar,
-            'process_id': self.server_process.pid if self.server_process else None
+            'process_id': state['pid'],
+            'started_at': state['started_at'],
+            'ready_at': state['ready_at'],
+            'monitor': state['counters'],
+            'console': self.console.get_metrics()
         }
     
     def _kill_processes_on_port(self):
@@ -229,10 +307,9 @@ class MinecraftManager:
             return False
             
         try:
-            # Send save-all command if server is running
+            # Save and wait for the server to confirm before copying
             if self.is_server_running():
-                self.send_command("save-all")
-                time.sleep(2)  # Wait for save to complete
+                self.save_all()
             
             # Create backup
             self.logger.info(f"Creating world backup: {backup_path}")
@@ -0,0 +1,289 @@
+"""
+Parallel Zip
+Standard ZIP archives (deflate, ZIP64) compressed block by block on a process pool
+"""
+
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
+
+from backup_snapshot import BackupFile
+
+# Files larger than this are split; each block is compressed independently
+BLOCK_BYTES = 4 * 1024 * 1024
+# Small files are sent to the workers in batches of up to BLOCK_BYTES / this many blocks
+BATCH_BLOCKS = 256
+# Batches submitted ahead of the writer, per worker (bounds memory)
+QUEUE_DEPTH = 4
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_DEFLATED = 8
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+_END_LOCATOR64 = struct.Struct('<IIQI')
+
+# (path, offset, length, last block of the file)
+Block = Tuple[str, int, int, bool]
+
+
+def _gf2_times(matrix: List[int], vector: int) -> int:
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_square(matrix: List[int]) -> List[int]:
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """CRC-32 of A+B from crc32(A), crc32(B) and len(B) (zlib's crc32_combine)"""
+    if len2 <= 0:
+        return crc1
+    # Operator for one zero bit, then squared to two and four zero bits
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    # Apply len2 zero bytes to crc1, one bit of len2 per squaring
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+def compress_block(block: Block, level: int) -> Tuple[bytes, int, int]:
+    """Read and deflate one block in a worker, returns (raw deflate data, crc32, length)
+
+    Blocks other than the last end with a sync flush, so the deflate
+    streams of consecutive blocks concatenate into one valid stream.
+    """
+    path, offset, length, last = block
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    out = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return out, zlib.crc32(data), len(data)
+
+
+def compress_batch(blocks: List[Block], level: int) -> List[Union[Tuple[bytes, int, int], OSError]]:
+    """compress_block for each block of a batch, an OSError in place of blocks that could not be read"""
+    results = []
+    for block in blocks:
+        try:
+            results.append(compress_block(block, level))
+        except OSError as e:
+            results.append(e)
+    return results
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _Entry:
+    __slots__ = ('name', 'flags', 'dos_time', 'dos_date', 'attrs', 'offset', 'zip64', 'crc', 'compress_size',
+                 'file_size')
+
+    def __init__(self, arc: str, st: os.stat_result, offset: int, size: int):
+        self.name = arc.replace(os.sep, '/').encode('utf-8')
+        # Bit 11: file name is UTF-8
+        self.flags = 0x800 if not arc.isascii() else 0
+        self.dos_time, self.dos_date = _dos_time(st.st_mtime)
+        self.attrs = (st.st_mode & 0xFFFF) << 16
+        self.offset = offset
+        # Same margin as zipfile: deflate can grow incompressible data slightly
+        self.zip64 = size * 1.05 > ZIP64_LIMIT
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+    def local_header(self) -> bytes:
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, self.file_size, self.compress_size)
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+        else:
+            extra = b''
+            sizes = (self.compress_size, self.file_size)
+        return _LOCAL_HEADER.pack(
+            0x04034b50, 45 if self.zip64 else 20, self.flags, ZIP_DEFLATED, self.dos_time, self.dos_date,
+            self.crc, *sizes, len(self.name), len(extra)
+        ) + self.name + extra
+
+    def central_header(self) -> bytes:
+        fields = []
+        file_size, compress_size, offset = self.file_size, self.compress_size, self.offset
+        if file_size >= ZIP64_LIMIT:
+            fields.append(file_size)
+            file_size = ZIP64_LIMIT
+        if compress_size >= ZIP64_LIMIT:
+            fields.append(compress_size)
+            compress_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+        version = 45 if fields or self.zip64 else 20
+        return _CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | version, version, self.flags, ZIP_DEFLATED, self.dos_time, self.dos_date,
+            self.crc, compress_size, file_size, len(self.name), len(extra), 0, 0, 0, self.attrs, offset
+        ) + self.name + extra
+
+
+class ParallelZipWriter:
+    """Writes a deflated ZIP archive with compression spread over worker processes
+
+    Files are cut into BLOCK_BYTES blocks (small files are batched) that
+    workers read and deflate; the parent writes the results in order,
+    combines the per-block CRCs and then patches each local header. The
+    output is a regular archive any unzip tool (and zipfile) can read.
+    """
+
+    def __init__(self, workers: int, level: int = 6, block_bytes: int = BLOCK_BYTES):
+        self.workers = max(1, workers)
+        self.level = level
+        self.block_bytes = max(64 * 1024, block_bytes)
+        self.logger = logging.getLogger('ParallelZipWriter')
+
+    def write(self, archive_path: str, files: List[BackupFile],
+              progress: Optional[Callable[[int], None]] = None) -> int:
+        """Create archive_path from files, returns the number of files added
+
+        progress(bytes) is called with the uncompressed bytes written so far.
+        """
+        entries: List[_Entry] = []
+        written_bytes = 0
+        with open(archive_path, 'wb') as out, ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            batches = self._batches(files)
+            current: Optional[_Entry] = None
+            skipping = None
+            while True:
+                while len(pending) < self.workers * QUEUE_DEPTH:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    future = pool.submit(compress_batch, [block for _, _, block in batch], self.level)
+                    pending.append((batch, future))
+                if not pending:
+                    break
+                batch, future = pending.popleft()
+                for (arc, st, block), result in zip(batch, future.result()):
+                    path, offset, _, last = block
+                    if skipping == path:
+                        if last:
+                            skipping = None
+                        continue
+                    if isinstance(result, OSError):
+                        self.logger.warning(f"Failed to add file to backup: {path} ({result})")
+                        if current is not None:
+                            # Drop what was written of this file
+                            out.seek(current.offset)
+                            out.truncate()
+                            current = None
+                        skipping = None if last else path
+                        continue
+                    data, crc, length = result
+                    if offset == 0:
+                        current = _Entry(arc, st, out.tell(), st.st_size)
+                        # Final right away for a file in one block, patched by _finish_entry otherwise
+                        current.crc, current.compress_size, current.file_size = crc, len(data), length
+                        out.write(current.local_header())
+                        out.write(data)
+                    else:
+                        out.write(data)
+                        current.crc = crc32_combine(current.crc, crc, length)
+                        current.compress_size += len(data)
+                        current.file_size += length
+                    written_bytes += length
+                    if last:
+                        if offset:
+                            self._finish_entry(out, current)
+                        entries.append(current)
+                        current = None
+                        if progress:
+                            progress(written_bytes)
+            self._write_central_directory(out, entries)
+        return len(entries)
+
+    def _batches(self, files: List[BackupFile]) -> Iterator[list]:
+        """Consecutive blocks grouped up to block_bytes, so small files do not cost a task each"""
+        batch = []
+        batch_bytes = 0
+        for item in self._blocks(files):
+            length = item[2][2]
+            if batch and (batch_bytes + length > self.block_bytes or len(batch) >= BATCH_BLOCKS):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += length
+        if batch:
+            yield batch
+
+    def _blocks(self, files: List[BackupFile]):
+        """(arc, stat, block) for every block of every file, in archive order"""
+        for path, arc, _ in files:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                self.logger.warning(f"Failed to add file to backup: {path} ({e})")
+                continue
+            size = st.st_size
+            offset = 0
+            while True:
+                length = min(self.block_bytes, size - offset)
+                last = offset + length >= size
+                yield arc, st, (path, offset, length, last)
+                if last:
+                    break
+                offset += length
+
+    def _finish_entry(self, out: BinaryIO, entry: _Entry):
+        """Rewrite the local header with the final CRC and sizes"""
+        if not entry.zip64 and (entry.compress_size >= ZIP64_LIMIT or entry.file_size >= ZIP64_LIMIT):
+            raise ValueError(f"{entry.name.decode('utf-8')} grew past 4 GiB while it was being archived")
+        end = out.tell()
+        out.seek(entry.offset)
+        out.write(entry.local_header())
+        out.seek(end)
+
+    def _write_central_directory(self, out: BinaryIO, entries: List[_Entry]):
+        start = out.tell()
+        for entry in entries:
+            out.write(entry.central_header())
+        end = out.tell()
+        size = end - start
+        count = len(entries)
+        if count >= 0xFFFF or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            out.write(_END_RECORD64.pack(0x06064b50, 44, (3 << 8) | 45, 45, 0, 0, count, count, size, start))
+            out.write(_END_LOCATOR64.pack(0x07064b50, 0, end, 1))
+        out.write(_END_RECORD.pack(
+            0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0
+        ))
@@ -0,0 +1,142 @@
+"""
+RakNet Status
+Answers Bedrock unconnected pings from a cached unconnected pong
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+
+from metrics import Counters
+
+ID_UNCONNECTED_PING = 0x01
+ID_UNCONNECTED_PING_OPEN_CONNECTIONS = 0x02
+ID_UNCONNECTED_PONG = 0x1c
+
+# Offline message marker carried by every unconnected RakNet packet
+MAGIC = bytes.fromhex('00ffff00fefefefefdfdfdfd12345678')
+
+# [id:u8][time:i64][magic:16][client_guid:i64]
+PING_LENGTH = 1 + 8 + len(MAGIC) + 8
+# [id:u8][time:i64][server_guid:i64][magic:16][len:u16][server id string]
+PONG_HEADER_LENGTH = 1 + 8 + 8 + len(MAGIC) + 2
+
+_PING = struct.Struct('>Bq16sq')
+
+
+def is_unconnected_ping(data) -> bool:
+    return (len(data) >= PING_LENGTH
+            and data[0] in (ID_UNCONNECTED_PING, ID_UNCONNECTED_PING_OPEN_CONNECTIONS)
+            and bytes(data[9:9 + len(MAGIC)]) == MAGIC)
+
+
+class RakNetPongCache:
+    """Unconnected pong of the local Bedrock server, re-queried in the background while pings keep coming
+
+    answer() builds the reply to a client's ping from the cached server GUID
+    and MOTD, echoing the client's timestamp, so pings never create a UDP
+    session. While the cache is cold or older than ttl it returns None and the
+    ping goes to the server as before.
+    """
+
+    # Stop refreshing once nobody has pinged for this long
+    IDLE_AFTER = 60.0
+
+    def __init__(self, port: int, ttl: float, timeout: float = 1.0):
+        self.port = port
+        self.ttl = ttl
+        self.timeout = timeout
+        self.logger = logging.getLogger('RakNetPongCache')
+        self.client_guid = struct.unpack('>q', os.urandom(8))[0]
+
+        self._lock = threading.Lock()
+        # Pong bytes after the timestamp: server GUID, magic and server id string
+        self._pong_tail: Optional[bytes] = None
+        self._fetched_at = 0.0
+        self._last_request = 0.0
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+        self.counters = Counters(['hits', 'misses', 'refreshes', 'refresh_errors'])
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def answer(self, datagram) -> Optional[bytes]:
+        """Unconnected pong for a client's ping, None if not a ping or the cache is cold"""
+        if not is_unconnected_ping(datagram):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._last_request = now
+            tail = self._pong_tail if now - self._fetched_at < self.ttl else None
+        if tail is None:
+            self.counters.inc('misses')
+            self._wakeup.set()
+            return None
+        self.counters.inc('hits')
+        return bytes((ID_UNCONNECTED_PONG,)) + bytes(datagram[1:9]) + tail
+
+    def fetch(self) -> bytes:
+        """Ping the local server, returns the pong bytes after the timestamp"""
+        ping = _PING.pack(ID_UNCONNECTED_PING, int(time.time() * 1000), MAGIC, self.client_guid)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.sendto(ping, ('127.0.0.1', self.port))
+            deadline = time.monotonic() + self.timeout
+            while True:
+                data = sock.recv(2048)
+                if len(data) >= PONG_HEADER_LENGTH and data[0] == ID_UNCONNECTED_PONG:
+                    return data[9:]
+                if time.monotonic() >= deadline:
+                    raise socket.timeout("No unconnected pong from server")
+
+    def refresh(self):
+        try:
+            tail = self.fetch()
+        except Exception as e:
+            self.counters.inc('refresh_errors')
+            self.logger.debug(f"Could not refresh Bedrock pong: {e}")
+            return
+        with self._lock:
+            self._pong_tail = tail
+            self._fetched_at = time.monotonic()
+        self.counters.inc('refreshes')
+
+    def _refresh_loop(self):
+        while self._running:
+            self._wakeup.wait(max(0.5, self.ttl / 2))
+            self._wakeup.clear()
+            if not self._running:
+                return
+            now = time.monotonic()
+            with self._lock:
+                idle = now - self._last_request > self.IDLE_AFTER
+                age = now - self._fetched_at
+            # Refresh ahead of expiry so pings keep hitting the cache
+            if not idle and age >= self.ttl / 2:
+                self.refresh()
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            cached = self._pong_tail is not None
+            age = time.monotonic() - self._fetched_at if cached else None
+        return {
+            'cached': cached,
+            'age_seconds': age,
+            'ttl': self.ttl,
+            'counters': self.counters.snapshot()
+        }
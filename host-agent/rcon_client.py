@@ -0,0 +1,160 @@
+"""
+RCON Client
+Persistent Source RCON connection to the local Minecraft server, with request/response matching
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import Dict, Optional
+
+SERVERDATA_RESPONSE_VALUE = 0
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_AUTH = 3
+# Not a valid request type: the server answers it after the previous command's last packet
+SENTINEL_TYPE = 200
+
+# [length:i32le][request id:i32le][type:i32le][body][0][0]
+_HEADER = struct.Struct('<iii')
+# Largest packet the server sends is 4096 bytes of body plus headers
+MAX_PACKET_BYTES = 4096 + 14
+
+
+class RconError(Exception):
+    """Raised when the RCON connection fails or the password is rejected"""
+
+
+class RconAuthError(RconError):
+    """Raised when the server rejects the RCON password (not retried)"""
+
+
+def read_server_properties(path: str) -> Dict[str, str]:
+    """Parse server.properties into a dict (empty if missing)"""
+    properties: Dict[str, str] = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(('#', '!')) or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                properties[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return properties
+
+
+class RconClient:
+    """One authenticated RCON socket reused for every command
+
+    Commands are serialized on the connection. Each one is followed by a
+    sentinel packet so responses split over several packets are read up to
+    the sentinel's reply, and packets for other request ids are skipped. A
+    connection found broken is reopened once per command; a command that
+    timed out is not sent again.
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.logger = logging.getLogger('RconClient')
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._next_id = 0
+
+    @classmethod
+    def from_properties(cls, minecraft_dir: str, timeout: float = 10.0) -> Optional['RconClient']:
+        """Client for the server in minecraft_dir, None when RCON is not enabled in server.properties"""
+        properties = read_server_properties(os.path.join(minecraft_dir, 'server.properties'))
+        if properties.get('enable-rcon', 'false').lower() != 'true' or not properties.get('rcon.password'):
+            return None
+        try:
+            port = int(properties.get('rcon.port', '25575'))
+        except ValueError:
+            return None
+        return cls('127.0.0.1', port, properties['rcon.password'], timeout)
+
+    def command(self, command: str, timeout: Optional[float] = None) -> str:
+        """Run a console command and return its output (timeout overrides the default for slow commands)"""
+        with self._lock:
+            try:
+                return self._command(command, timeout)
+            except (RconAuthError, socket.timeout):
+                self._disconnect()
+                raise
+            except (OSError, RconError) as e:
+                self.logger.debug(f"RCON command failed ({e}), reconnecting")
+                self._disconnect()
+            try:
+                return self._command(command, timeout)
+            except (OSError, RconError):
+                self._disconnect()
+                raise
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _command(self, command: str, timeout: Optional[float]) -> str:
+        if self._sock is None:
+            self._connect()
+        self._sock.settimeout(timeout or self.timeout)
+        request_id = self._send(SERVERDATA_EXECCOMMAND, command)
+        sentinel_id = self._send(SENTINEL_TYPE, '')
+        parts = []
+        while True:
+            response_id, _, body = self._read_packet()
+            if response_id == sentinel_id:
+                return ''.join(parts)
+            if response_id == request_id:
+                parts.append(body)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock = sock
+        try:
+            auth_id = self._send(SERVERDATA_AUTH, self.password)
+            while True:
+                response_id, packet_type, _ = self._read_packet()
+                if response_id == -1:
+                    raise RconAuthError("RCON password rejected")
+                if response_id == auth_id and packet_type == SERVERDATA_EXECCOMMAND:
+                    return
+        except Exception:
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _send(self, packet_type: int, body: str) -> int:
+        self._next_id = (self._next_id + 1) & 0x7fffffff
+        payload = body.encode('utf-8') + b'\x00\x00'
+        self._sock.sendall(_HEADER.pack(8 + len(payload), self._next_id, packet_type) + payload)
+        return self._next_id
+
+    def _read_packet(self):
+        length = struct.unpack('<i', self._recv_exact(4))[0]
+        if length < 10 or length > MAX_PACKET_BYTES:
+            raise RconError(f"Invalid RCON packet length: {length}")
+        data = self._recv_exact(length)
+        response_id, packet_type = struct.unpack_from('<ii', data)
+        return response_id, packet_type, data[8:-2].decode('utf-8', 'replace')
+
+    def _recv_exact(self, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self._sock.recv(size - len(buf))
+            if not chunk:
+                raise RconError("RCON connection closed by server")
+            buf += chunk
+        return bytes(buf)
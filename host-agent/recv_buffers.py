@@ -0,0 +1,110 @@
+"""
+Receive Buffers
+Reusable receive buffers and adaptive read sizing for the tunnel read path
+"""
+
+import socket
+import threading
+from typing import Dict, List, Optional
+
+
+class BufferPool:
+    """Free lists of bytearrays in power-of-two sizes shared by all streams"""
+
+    def __init__(self, max_free_per_size: int = 32):
+        self.max_free_per_size = max_free_per_size
+        self._lock = threading.Lock()
+        self._free: Dict[int, List[bytearray]] = {}
+
+    @staticmethod
+    def size_class(size: int) -> int:
+        return 1 << max(0, size - 1).bit_length()
+
+    def acquire(self, size: int) -> bytearray:
+        size = self.size_class(size)
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                return free.pop()
+        return bytearray(size)
+
+    def release(self, buf: bytearray):
+        size = len(buf)
+        if size != self.size_class(size):
+            return
+        with self._lock:
+            free = self._free.setdefault(size, [])
+            if len(free) < self.max_free_per_size:
+                free.append(buf)
+
+
+class AdaptiveReadSize:
+    """Doubles the read size after a full read, halves it after a run of small ones"""
+
+    SHRINK_AFTER = 8
+
+    def __init__(self, min_size: int, max_size: int):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = self.min_size
+        self._small_reads = 0
+
+    def update(self, nbytes: int) -> int:
+        """Record how much the last read returned, returns the size for the next one"""
+        if nbytes >= self.size and self.size < self.max_size:
+            self.size = min(self.size * 2, self.max_size)
+            self._small_reads = 0
+        elif nbytes < self.size // 4 and self.size > self.min_size:
+            self._small_reads += 1
+            if self._small_reads >= self.SHRINK_AFTER:
+                self.size = max(self.size // 2, self.min_size)
+                self._small_reads = 0
+        else:
+            self._small_reads = 0
+        return self.size
+
+
+class ReceiveBuffer:
+    """Per-stream recv_into target borrowed from a BufferPool
+
+    read() returns a memoryview into the buffer that is only valid until the
+    next read(), so consumers must encode or copy it before returning, or take
+    the buffer over with hand_off().
+    """
+
+    def __init__(self, pool: BufferPool, min_size: int, max_size: int):
+        self.pool = pool
+        self.read_size = AdaptiveReadSize(min_size, max_size)
+        self._buf = pool.acquire(self.read_size.size)
+        self._view = memoryview(self._buf)
+
+    def read(self, sock: socket.socket) -> Optional[memoryview]:
+        """Receive into the buffer, None on EOF"""
+        if self.read_size.size > len(self._buf):
+            # The previous view is no longer in use, safe to recycle its buffer
+            self.pool.release(self._buf)
+            self._buf = self.pool.acquire(self.read_size.size)
+            self._view = memoryview(self._buf)
+        nbytes = sock.recv_into(self._view, self.read_size.size)
+        if nbytes == 0:
+            return None
+        self.read_size.update(nbytes)
+        return self._view[:nbytes]
+
+    def hand_off(self) -> bytearray:
+        """Give the buffer behind the last read's view to the caller, who releases it to the pool
+
+        The next read() goes into a fresh buffer, so the view stays valid while
+        it waits in a queue.
+        """
+        buf = self._buf
+        self._buf = self.pool.acquire(self.read_size.size)
+        self._view = memoryview(self._buf)
+        return buf
+
+    def release(self):
+        """Give the buffer back to the pool (the stream is done reading)"""
+        if self._buf is not None:
+            self.pool.release(self._buf)
+            self._buf = None
+            self._view = None
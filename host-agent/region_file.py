@@ -0,0 +1,69 @@
+"""
+Region File
+Reads and writes Anvil region files (.mca) chunk by chunk
+"""
+
+import struct
+from typing import BinaryIO, List, Tuple
+
+SECTOR_BYTES = 4096
+SLOTS = 1024
+# Location table (offset:u24 sectors:u8 per slot) then the timestamp table (u32 per slot)
+HEADER_BYTES = 2 * SECTOR_BYTES
+# Largest chunk kept inside the region file; bigger ones go to an external .mcc file
+MAX_CHUNK_SECTORS = 255
+
+_TABLE = struct.Struct(f'>{SLOTS}I')
+
+
+class RegionFormatError(ValueError):
+    """Raised when a file does not look like a valid region file"""
+
+
+def read_header(f: BinaryIO, file_size: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """Parse the header, returns ([(sector offset, sector count)] and [timestamp]) per slot"""
+    header = f.read(HEADER_BYTES)
+    if len(header) < HEADER_BYTES:
+        raise RegionFormatError("Region file shorter than its header")
+    locations = []
+    for entry in _TABLE.unpack_from(header, 0):
+        offset, sectors = entry >> 8, entry & 0xff
+        if offset and (offset < 2 or (offset + sectors) * SECTOR_BYTES > file_size + SECTOR_BYTES):
+            raise RegionFormatError(f"Chunk location out of the file: sector {offset}")
+        locations.append((offset, sectors))
+    return locations, list(_TABLE.unpack_from(header, SECTOR_BYTES))
+
+
+def read_chunk(f: BinaryIO, offset: int, sectors: int) -> bytes:
+    """Stored chunk at a location: its length prefix, compression type and data"""
+    f.seek(offset * SECTOR_BYTES)
+    head = f.read(5)
+    if len(head) < 5:
+        raise RegionFormatError(f"Truncated chunk at sector {offset}")
+    length = struct.unpack_from('>I', head)[0]
+    if length < 1 or length + 4 > sectors * SECTOR_BYTES:
+        raise RegionFormatError(f"Invalid chunk length {length} at sector {offset}")
+    data = f.read(length - 1)
+    if len(data) < length - 1:
+        raise RegionFormatError(f"Truncated chunk at sector {offset}")
+    return head + data
+
+
+def write_region(f: BinaryIO, chunks: List[Tuple[int, int, bytes]]):
+    """Write a region file from (slot, timestamp, stored chunk), laid out in slot order"""
+    locations = [0] * SLOTS
+    timestamps = [0] * SLOTS
+    f.seek(HEADER_BYTES)
+    sector = HEADER_BYTES // SECTOR_BYTES
+    for slot, timestamp, payload in sorted(chunks):
+        sectors = -(-len(payload) // SECTOR_BYTES)
+        if sectors > MAX_CHUNK_SECTORS:
+            raise RegionFormatError(f"Chunk in slot {slot} is too large for a region file")
+        f.write(payload)
+        f.write(b'\x00' * (sectors * SECTOR_BYTES - len(payload)))
+        locations[slot] = (sector << 8) | sectors
+        timestamps[slot] = timestamp
+        sector += sectors
+    f.seek(0)
+    f.write(_TABLE.pack(*locations))
+    f.write(_TABLE.pack(*timestamps))
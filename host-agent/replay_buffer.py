@@ -0,0 +1,65 @@
+"""
+Replay Buffer
+Bounded record of the bytes sent on a stream, for replay after a tunnel reconnect
+"""
+
+import threading
+from collections import deque
+from typing import Deque, Optional
+
+
+class ReplayBuffer:
+    """Holds stream bytes [start, end) that the peer may not have received yet
+
+    Offsets count every byte ever sent on the stream. Bytes are dropped once
+    the peer acknowledges them (trim) or when the buffer exceeds max_bytes, in
+    which case a peer that is further behind than start can no longer resume.
+    Appended chunks are kept as they are, so dropping bytes only ever slices
+    the oldest chunk.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._chunks: Deque[bytes] = deque()
+        self._length = 0
+        self.start = 0
+
+    @property
+    def end(self) -> int:
+        return self.start + self._length
+
+    def append(self, data):
+        chunk = bytes(data)
+        if not chunk:
+            return
+        with self._lock:
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+            if self._length > self.max_bytes:
+                self._drop(self._length - self.max_bytes)
+
+    def trim(self, offset: int):
+        """Forget bytes before offset (the peer has them)"""
+        with self._lock:
+            self._drop(min(offset - self.start, self._length))
+
+    def _drop(self, drop: int):
+        while drop > 0 and self._chunks:
+            head = self._chunks[0]
+            if len(head) <= drop:
+                self._chunks.popleft()
+                taken = len(head)
+            else:
+                self._chunks[0] = head[drop:]
+                taken = drop
+            self.start += taken
+            self._length -= taken
+            drop -= taken
+
+    def since(self, offset: int) -> Optional[bytes]:
+        """Bytes from offset to the end, None if offset is no longer (or not yet) covered"""
+        with self._lock:
+            if offset < self.start or offset > self.end:
+                return None
+            return b''.join(self._chunks)[offset - self.start:]
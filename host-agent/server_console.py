@@ -0,0 +1,153 @@
+"""
+Server Console
+Drains the Minecraft server's output into a ring buffer and dispatches log events
+"""
+
+import logging
+import logging.handlers
+import re
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Pattern, TextIO, Tuple, Union
+
+from metrics import Counters
+from server_monitor import READY_PATTERN, STOPPING_PATTERN
+
+# Named events other components can subscribe to (see ServerConsole.on)
+EVENT_PATTERNS: Dict[str, Pattern] = {
+    'ready': READY_PATTERN,
+    'stopping': STOPPING_PATTERN,
+    'saved': re.compile(r'\]: Saved the game$'),
+    # Optional '.' is the Floodgate prefix of Bedrock players
+    'player_join': re.compile(r'\]: (?P<player>\.?\w{3,16}) joined the game$'),
+    'player_leave': re.compile(r'\]: (?P<player>\.?\w{3,16}) left the game$'),
+}
+
+LineCallback = Callable[[re.Match, str], None]
+
+
+class ServerConsole:
+    """Owns the read side of the server's stdout
+
+    A reader thread per server process consumes every line as soon as it is
+    written, so the server never blocks on a full pipe. Lines go to a bounded
+    ring buffer, to an optional rotating log file, and to the callbacks whose
+    pattern matches. Subscriptions outlive the process, a restarted server
+    keeps feeding them.
+    """
+
+    def __init__(self, max_lines: int, log_file: Optional[str] = None, log_max_bytes: int = 10 * 1024 * 1024,
+                 log_backups: int = 3):
+        self.logger = logging.getLogger('ServerConsole')
+        self._lock = threading.Lock()
+        self._lines: Deque[str] = deque(maxlen=max(1, max_lines))
+        self._listeners: Dict[int, Tuple[Pattern, LineCallback]] = {}
+        self._next_handle = 0
+        self._thread = None
+
+        # Raw server output, kept out of the agent's own log
+        self.file_logger: Optional[logging.Logger] = None
+        if log_file:
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=log_max_bytes, backupCount=log_backups, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.file_logger = logging.getLogger('ServerConsole.file')
+            self.file_logger.propagate = False
+            self.file_logger.setLevel(logging.INFO)
+            self.file_logger.handlers = [handler]
+
+        self.counters = Counters(['lines', 'bytes', 'events', 'callback_errors'])
+
+    def attach(self, stream: TextIO):
+        """Start draining the output of a newly launched server"""
+        self._thread = threading.Thread(target=self._read_loop, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def on(self, event: Union[str, Pattern], callback: LineCallback) -> int:
+        """Call callback(match, line) for every line matching a named event or a regex, returns a handle"""
+        pattern = EVENT_PATTERNS[event] if isinstance(event, str) and event in EVENT_PATTERNS else event
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._listeners[handle] = (pattern, callback)
+        return handle
+
+    def off(self, handle: int):
+        with self._lock:
+            self._listeners.pop(handle, None)
+
+    def wait_for(self, event: Union[str, Pattern], timeout: float,
+                 trigger: Optional[Callable[[], object]] = None) -> Optional[str]:
+        """Block until a matching line is printed, None on timeout
+
+        trigger (e.g. sending a command) runs after subscribing, so a line
+        printed right away is not missed.
+        """
+        done = threading.Event()
+        matched: List[str] = []
+
+        def callback(match, line):
+            if not done.is_set():
+                matched.append(line)
+                done.set()
+
+        handle = self.on(event, callback)
+        try:
+            if trigger:
+                trigger()
+            done.wait(timeout)
+        finally:
+            self.off(handle)
+        return matched[0] if matched else None
+
+    def tail(self, count: int = 50) -> List[str]:
+        """Most recent lines of server output"""
+        with self._lock:
+            lines = list(self._lines)
+        return lines[-count:] if count > 0 else []
+
+    def _read_loop(self, stream: TextIO):
+        try:
+            for raw in stream:
+                self._dispatch(raw.rstrip('\r\n'))
+        except (OSError, ValueError) as e:
+            # ValueError: the pipe was closed under us when the process was killed
+            self.logger.debug(f"Server output closed: {e}")
+        finally:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, line: str):
+        with self._lock:
+            self._lines.append(line)
+            listeners = list(self._listeners.values())
+        self.counters.inc('lines')
+        self.counters.inc('bytes', len(line) + 1)
+        if self.file_logger:
+            self.file_logger.info(line)
+        for pattern, callback in listeners:
+            match = pattern.search(line)
+            if not match:
+                continue
+            self.counters.inc('events')
+            try:
+                callback(match, line)
+            except Exception as e:
+                self.counters.inc('callback_errors')
+                self.logger.error(f"Error in server console listener: {e}")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            buffered = len(self._lines)
+            listeners = len(self._listeners)
+        return {
+            'buffered_lines': buffered,
+            'listeners': listeners,
+            'reading': bool(self._thread and self._thread.is_alive()),
+            'counters': self.counters.snapshot()
+        }
@@ -0,0 +1,305 @@
+"""
+Server Monitor
+Background tracker of the Minecraft server process and readiness, read by callers without probing
+"""
+
+import logging
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import psutil
+
+from metrics import Counters
+
+# Logged by the server thread once the world is loaded and the server accepts players.
+# Anchored on the '[time] [thread/LEVEL]: ' prefix so player chat cannot fake these lines.
+READY_PATTERN = re.compile(r'\]: Done \([0-9.,]+s\)! For help, type "help"( or "\?")?$')
+# Logged when the server starts shutting down
+STOPPING_PATTERN = re.compile(r'\]: Stopping (the )?server$')
+
+
+class ServerStatusMonitor:
+    """Cached running/ready state of the local server
+
+    Process state comes from the Popen handle or the pid in the pidfile, each
+    watched by a thread blocked in wait(), so an exit is seen immediately.
+    Readiness comes from the server log ("Done (...)!" / "Stopping server");
+    servers without a logs/latest.log are probed on the port once per
+    interval until they answer. Only when no pid is known does the monitor
+    scan the socket table for a listener, at most once per scan_interval.
+    """
+
+    def __init__(self, minecraft_dir: str, port: int, pidfile: str, interval: float = 1.0,
+                 scan_interval: float = 60.0):
+        self.minecraft_dir = minecraft_dir
+        self.port = port
+        self.pidfile = pidfile
+        self.interval = max(0.1, interval)
+        self.scan_interval = scan_interval
+        self.logger = logging.getLogger('ServerStatusMonitor')
+
+        self._cond = threading.Condition()
+        # Published state: plain attributes, safe to read from any thread
+        self.running = False
+        self.ready = False
+        self.pid: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+
+        self._process: Optional[subprocess.Popen] = None
+        self._checked = False
+        self._last_scan = 0.0
+        self._log_path = os.path.join(minecraft_dir, 'logs', 'latest.log')
+        self._log_inode: Optional[int] = None
+        self._log_offset = 0
+        self._log_partial = b''
+        self._wakeup = threading.Event()
+        self._active = False
+        self._thread = None
+
+        self.counters = Counters(['port_scans', 'port_probes', 'log_events', 'exits'])
+
+    def start(self):
+        if self._active:
+            return
+        self._active = True
+        self.refresh()
+        self._thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        self._wakeup.set()
+
+    def ensure_checked(self):
+        """Run one synchronous check if nothing has been observed yet (before start())"""
+        if not self._checked:
+            self.refresh()
+
+    def attach(self, process: subprocess.Popen):
+        """Track a server we just launched"""
+        with self._cond:
+            self._process = process
+            # Only log lines written from now on count, the old latest.log belongs to the last run
+            self._skip_current_log()
+            self._set_running(process.pid)
+        self._write_pidfile(process.pid)
+        threading.Thread(target=self._watch_exit, args=(process.pid, process.wait), daemon=True).start()
+
+    def detach(self):
+        """Forget the server after it was stopped"""
+        with self._cond:
+            self._process = None
+            self._set_stopped()
+        self._remove_pidfile()
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Block until the server is ready, False on timeout or if it exits first"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.ready or not self.running, timeout)
+            return self.ready
+
+    def wait_stopped(self, timeout: float) -> bool:
+        """Block until the server process is gone, False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.running, timeout)
+
+    def on_log_line(self, line: str):
+        """Feed one line of server output"""
+        if READY_PATTERN.search(line):
+            self.counters.inc('log_events')
+            with self._cond:
+                if self.running and not self.ready:
+                    self.ready = True
+                    self.ready_at = time.time()
+                    self.logger.info("Minecraft server reported ready")
+                    self._cond.notify_all()
+        elif STOPPING_PATTERN.search(line):
+            self.counters.inc('log_events')
+            with self._cond:
+                self.ready = False
+                self._cond.notify_all()
+
+    def refresh(self):
+        """One monitoring step: find the server if none is known, then update readiness"""
+        self._checked = True
+        if not self.running or self.pid is None:
+            self._discover()
+        if self.running:
+            if not self._tail_log() and not self.ready:
+                self._probe_port()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                'running': self.running,
+                'ready': self.ready,
+                'pid': self.pid,
+                'started_at': self.started_at,
+                'ready_at': self.ready_at,
+                'counters': self.counters.snapshot()
+            }
+
+    def _monitor_loop(self):
+        while self._active:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self._active:
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Error monitoring server: {e}")
+
+    def _set_running(self, pid: Optional[int]):
+        if not self.running:
+            self.started_at = time.time()
+            self.ready = False
+            self.ready_at = None
+        self.running = True
+        self.pid = pid
+        self._cond.notify_all()
+
+    def _set_stopped(self):
+        self.running = False
+        self.ready = False
+        self.pid = None
+        self.started_at = None
+        self.ready_at = None
+        self._cond.notify_all()
+
+    def _watch_exit(self, pid: int, wait):
+        """Block until the process exits and publish it (runs on its own thread)"""
+        try:
+            wait()
+        except Exception as e:
+            self.logger.debug(f"Stopped watching server process {pid}: {e}")
+        with self._cond:
+            if self.pid != pid:
+                return
+            if self._process is not None and self._process.pid == pid:
+                self._process = None
+            self._set_stopped()
+        self.counters.inc('exits')
+        self.logger.info(f"Minecraft server process {pid} exited")
+        self._remove_pidfile()
+        self._wakeup.set()
+
+    def _discover(self):
+        """Adopt a server started before us: pidfile first, socket table scan as a last resort"""
+        pid = self._read_pidfile()
+        if pid is None and time.monotonic() - self._last_scan >= self.scan_interval:
+            self._last_scan = time.monotonic()
+            pid = self._scan_port()
+            if pid is None and self.running:
+                # The unidentified listener went away
+                with self._cond:
+                    self._set_stopped()
+                return
+        if pid is None:
+            return
+        if pid == 0:
+            # A listener we cannot map to a process: running, re-scanned next time
+            with self._cond:
+                self._set_running(None)
+            return
+        try:
+            process = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            return
+        with self._cond:
+            if self.pid == pid:
+                return
+            self._read_current_log()
+            self._set_running(pid)
+        self.logger.info(f"Tracking running Minecraft server process {pid}")
+        threading.Thread(target=self._watch_exit, args=(pid, process.wait), daemon=True).start()
+
+    def _read_pidfile(self) -> Optional[int]:
+        try:
+            with open(self.pidfile, 'r') as f:
+                pid = int(f.read().strip())
+            written_at = os.path.getmtime(self.pidfile)
+            # A process created after the pidfile was written reused the pid
+            if psutil.Process(pid).create_time() > written_at + 1:
+                return None
+            return pid
+        except (OSError, ValueError, psutil.Error):
+            return None
+
+    def _write_pidfile(self, pid: int):
+        try:
+            with open(self.pidfile, 'w') as f:
+                f.write(f"{pid}\n")
+        except OSError as e:
+            self.logger.warning(f"Could not write pidfile {self.pidfile}: {e}")
+
+    def _remove_pidfile(self):
+        try:
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+
+    def _scan_port(self) -> Optional[int]:
+        """Pid listening on the server port, 0 if unknown, None if nothing listens"""
+        self.counters.inc('port_scans')
+        try:
+            for conn in psutil.net_connections('inet'):
+                if conn.laddr and conn.laddr.port == self.port and conn.status == psutil.CONN_LISTEN:
+                    return conn.pid or 0
+        except (psutil.Error, OSError) as e:
+            self.logger.debug(f"Could not scan sockets: {e}")
+        return None
+
+    def _probe_port(self):
+        self.counters.inc('port_probes')
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                pass
+        except OSError:
+            return
+        with self._cond:
+            if self.running and not self.ready:
+                self.ready = True
+                self.ready_at = time.time()
+                self._cond.notify_all()
+
+    def _skip_current_log(self):
+        try:
+            stat = os.stat(self._log_path)
+            self._log_inode, self._log_offset = stat.st_ino, stat.st_size
+        except OSError:
+            self._log_inode, self._log_offset = None, 0
+        self._log_partial = b''
+
+    def _read_current_log(self):
+        self._log_inode, self._log_offset, self._log_partial = None, 0, b''
+
+    def _tail_log(self) -> bool:
+        """Feed new lines of logs/latest.log to on_log_line, False if there is no log file"""
+        try:
+            stat = os.stat(self._log_path)
+        except OSError:
+            return False
+        if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+            # Rotated at server start: read the new file from the beginning
+            self._log_inode, self._log_offset, self._log_partial = stat.st_ino, 0, b''
+        if stat.st_size == self._log_offset:
+            return True
+        try:
+            with open(self._log_path, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except OSError:
+            return False
+        self._log_offset += len(data)
+        lines = (self._log_partial + data).split(b'\n')
+        self._log_partial = lines.pop()
+        for line in lines:
+            self.on_log_line(line.rstrip(b'\r').decode('utf-8', 'replace'))
+        return True
@@ -0,0 +1,203 @@
+"""
+Stream Scheduler
+Deficit round robin over per-channel outbound queues, with optional per-channel rate caps
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import Counters, Histogram
+
+# (size, callback, args, queued_at) - one queued outbound item of a channel
+Item = Tuple[int, Callable, tuple, float]
+
+
+class ChannelQueue:
+    """Outbound items of one stream/UDP client plus its DRR and token bucket state"""
+
+    def __init__(self, rate_limit: int):
+        self.items: Deque[Item] = deque()
+        self.queued_bytes = 0
+        self.deficit = 0
+        # Token bucket (rate_limit 0 = uncapped); tokens may go negative to pay for a large item
+        self.tokens = float(rate_limit)
+        self.refilled_at = time.monotonic()
+
+    def refill(self, rate_limit: int, now: float):
+        if rate_limit:
+            self.tokens = min(float(rate_limit), self.tokens + (now - self.refilled_at) * rate_limit)
+            self.refilled_at = now
+
+
+class FairScheduler:
+    """Shares one outbound connection fairly between channels
+
+    Producers submit items to their channel's queue and only block once that
+    queue holds more than max_queued_bytes. A dispatcher thread visits active
+    channels in deficit round robin order, delivering up to `quantum` bytes per
+    visit, so a stream streaming chunks cannot starve another player's small
+    packets. Items keep their submission order within a channel, which is also
+    how zero-size items (a stream's close message) stay behind its data.
+
+    Before each visit the dispatcher calls wait_writable(), which lets the
+    connection's sender push back; queues then build up here, where the
+    scheduling happens, instead of in one FIFO further down.
+    """
+
+    def __init__(self, name: str, wait_writable: Callable[[], None], quantum: int,
+                 max_queued_bytes: int, rate_limit: int = 0):
+        self.wait_writable = wait_writable
+        self.quantum = max(1, quantum)
+        self.max_queued_bytes = max_queued_bytes
+        self.rate_limit = max(0, rate_limit)
+        self.logger = logging.getLogger(name)
+
+        self._cond = threading.Condition()
+        self._channels: Dict[str, ChannelQueue] = {}
+        # Channels with queued items, in round robin order
+        self._active: Deque[str] = deque()
+        self._running = False
+        self._thread = None
+
+        self.counters = Counters(['delivered', 'delivered_bytes', 'throttled', 'errors'])
+        # Milliseconds an item waited in its channel queue
+        self.queue_delay = Histogram([1, 5, 10, 25, 50, 100, 250, 500, 1000])
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._channels.clear()
+            self._active.clear()
+            self._cond.notify_all()
+
+    def clear(self):
+        """Drop everything queued for a previous connection"""
+        with self._cond:
+            for channel in self._channels.values():
+                channel.items.clear()
+                channel.queued_bytes = 0
+            self._channels.clear()
+            self._active.clear()
+            self._cond.notify_all()
+
+    def submit(self, channel_id: str, size: int, callback: Callable, *args):
+        """Queue callback(*args) on a channel; size is what it counts against quantum and rate cap"""
+        with self._cond:
+            if not self._running:
+                return
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                self._prune_idle()
+                channel = self._channels[channel_id] = ChannelQueue(self.rate_limit)
+            if size:
+                while self._running and channel.queued_bytes > self.max_queued_bytes:
+                    self._cond.wait(1.0)
+                if not self._running:
+                    return
+                if self._channels.get(channel_id) is not channel:
+                    channel = self._channels.setdefault(channel_id, ChannelQueue(self.rate_limit))
+            if not channel.items:
+                self._active.append(channel_id)
+            channel.items.append((size, callback, args, time.monotonic()))
+            channel.queued_bytes += size
+            self._cond.notify_all()
+
+    def _next_batch(self) -> Optional[List[Item]]:
+        """Items for the next DRR visit (None when stopped)"""
+        with self._cond:
+            while True:
+                if not self._running:
+                    return None
+                if not self._active:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                wait_until = None
+                for _ in range(len(self._active)):
+                    channel_id = self._active.popleft()
+                    channel = self._channels[channel_id]
+                    channel.refill(self.rate_limit, now)
+                    head_size = channel.items[0][0]
+                    if self.rate_limit and head_size and channel.tokens <= 0:
+                        # Over its rate cap: skip this round
+                        self._active.append(channel_id)
+                        ready_at = now - channel.tokens / self.rate_limit
+                        wait_until = ready_at if wait_until is None else min(wait_until, ready_at)
+                        continue
+                    return self._take(channel_id, channel)
+                self.counters.inc('throttled')
+                self._cond.wait(max(0.001, wait_until - now))
+
+    def _take(self, channel_id: str, channel: ChannelQueue) -> List[Item]:
+        channel.deficit += self.quantum
+        batch = []
+        while channel.items:
+            size = channel.items[0][0]
+            if size > channel.deficit or (self.rate_limit and size and channel.tokens <= 0):
+                break
+            batch.append(channel.items.popleft())
+            channel.deficit -= size
+            channel.tokens -= size
+            channel.queued_bytes -= size
+        if channel.items:
+            self._active.append(channel_id)
+        else:
+            # Idle channels keep no DRR credit; their token bucket is kept until it refills
+            channel.deficit = 0
+            if not self.rate_limit or channel.tokens >= self.rate_limit:
+                del self._channels[channel_id]
+        self._cond.notify_all()
+        return batch
+
+    def _prune_idle(self):
+        """Forget idle rate-capped channels whose bucket has refilled"""
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        for channel_id, channel in list(self._channels.items()):
+            if not channel.items:
+                channel.refill(self.rate_limit, now)
+                if channel.tokens >= self.rate_limit:
+                    del self._channels[channel_id]
+
+    def _dispatch_loop(self):
+        while True:
+            self.wait_writable()
+            batch = self._next_batch()
+            if batch is None:
+                return
+            now = time.monotonic()
+            for size, callback, args, queued_at in batch:
+                self.queue_delay.observe((now - queued_at) * 1000)
+                try:
+                    callback(*args)
+                except Exception as e:
+                    self.counters.inc('errors')
+                    self.logger.error(f"Error delivering scheduled item: {e}")
+                    continue
+                self.counters.inc('delivered')
+                self.counters.inc('delivered_bytes', size)
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            active = len(self._active)
+            queued = sum(channel.queued_bytes for channel in self._channels.values())
+        return {
+            'active_channels': active,
+            'queued_bytes': queued,
+            'quantum': self.quantum,
+            'rate_limit': self.rate_limit,
+            'counters': self.counters.snapshot(),
+            'queue_delay_ms': self.queue_delay.snapshot()
+        }
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import StandInMinecraft, StandInPato2  # noqa: E402
+
+
+@pytest.fixture
+def minecraft():
+    server = StandInMinecraft()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_agent(monkeypatch, tmp_path, minecraft):
+    """Build a HostAgent wired to the stand-in servers (settings override the env)"""
+    import host_agent
+
+    agents = []
+
+    def build(**settings):
+        monkeypatch.chdir(tmp_path)
+        env = {
+            'HOST_TOKEN': 'test-token',
+            'PATO2_ENDPOINT': 'http://127.0.0.1:9',
+            'MINECRAFT_PORT': str(minecraft.port),
+            'MINECRAFT_DIR': str(tmp_path / 'minecraft'),
+            'JAVA_STATUS_CACHE': 'false',
+            'TUNNEL_LANES': '0',
+            'LOG_LEVEL': 'WARNING',
+        }
+        env.update({key: str(value) for key, value in settings.items()})
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        agent = host_agent.HostAgent()
+        # What HostAgent.run starts for the threaded tunnel, minus registration and the server
+        agent.running = True
+        agent.sender.start()
+        if agent.scheduler:
+            agent.scheduler.start()
+        agent.batcher.start()
+        agents.append(agent)
+        return agent
+
+    yield build
+
+    for agent in agents:
+        agent.running = False
+        agent.cancel_resume_timer()
+        agent.close_all_connections()
+        if agent.scheduler:
+            agent.scheduler.stop()
+        agent.batcher.stop()
+        agent.sender.stop()
+
+
+@pytest.fixture
+def pato2_for():
+    def build(agent, **options):
+        pato2 = StandInPato2(agent, **options)
+        pato2.connect()
+        return pato2
+    return build
@@ -0,0 +1,270 @@
+"""
+Test Harness
+Local stand-ins for Pato2 and the Minecraft server around a real HostAgent
+"""
+
+import base64
+import json
+import queue
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from replay_buffer import ReplayBuffer
+from tunnel_protocol import (
+    CAP_BATCH_FRAMES, CAP_BINARY_FRAMES, CAP_FLOW_CONTROL, CAP_STREAM_RESUME,
+    OP_BATCH, OP_DATA, decode_frame, encode_frame, iter_batch, payload_message
+)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    """Poll condition until it holds, False on timeout"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class StandInMinecraft:
+    """TCP server on 127.0.0.1 recording what each connection receives"""
+
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.connections: List[socket.socket] = []
+        self.received: List[bytearray] = []
+        self.closed: List[threading.Event] = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with self._lock:
+                index = len(self.connections)
+                self.connections.append(conn)
+                self.received.append(bytearray())
+                self.closed.append(threading.Event())
+            threading.Thread(target=self._read_loop, args=(index, conn), daemon=True).start()
+
+    def _read_loop(self, index: int, conn: socket.socket):
+        try:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                with self._lock:
+                    self.received[index] += data
+        except OSError:
+            pass
+        self.closed[index].set()
+
+    def data(self, index: int) -> bytes:
+        with self._lock:
+            return bytes(self.received[index])
+
+    def send(self, index: int, data: bytes):
+        self.connections[index].sendall(data)
+
+    def stop(self):
+        self.server.close()
+        for conn in self.connections:
+            conn.close()
+
+
+class FakeWebSocket:
+    """In-process replacement for the agent's websocket.WebSocketApp
+
+    Whatever the agent's sender writes is handed to the stand-in Pato2 while
+    the link is up and silently lost while it is cut, like bytes still in
+    flight when a real connection dies.
+    """
+
+    class _Sock:
+        connected = True
+
+    def __init__(self, pato2: 'StandInPato2'):
+        self.pato2 = pato2
+        self.sock = self._Sock()
+        self.cut = False
+
+    def send(self, payload, opcode=None):
+        if self.sock.connected and not self.cut:
+            self.pato2.inbox.put(payload)
+
+    def close(self):
+        self.sock.connected = False
+
+
+class StandInStream:
+    """Pato2's side of one stream: what the player sent and what reached them"""
+
+    def __init__(self, stream_id: str, replay_bytes: int):
+        self.stream_id = stream_id
+        self.replay = ReplayBuffer(replay_bytes)
+        self.from_host = bytearray()
+        self.acked_by_host = 0
+        self.closed = threading.Event()
+
+
+class StandInPato2:
+    """Pato2's tunnel protocol (ProxyManager/HostManager) speaking to an agent in process
+
+    Messages from the agent are handled on one thread, the way Pato2 handles
+    a WebSocket, and answered by calling agent.on_websocket_message. Streams
+    keep a replay buffer and follow the same resume rules as Pato2.
+    """
+
+    def __init__(self, agent, stream_resume: bool = True, replay_bytes: int = 1024 * 1024):
+        self.agent = agent
+        self.stream_resume = stream_resume
+        self.replay_bytes = replay_bytes
+        self.streams: Dict[str, StandInStream] = {}
+        self.capabilities = set()
+        self.resumed = threading.Event()
+        self.inbox: queue.Queue = queue.Queue()
+        self.ws: Optional[FakeWebSocket] = None
+        self.connected = threading.Event()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+
+    # Link
+
+    def connect(self, timeout: float = 5.0):
+        """Open a new tunnel and wait for the hello exchange (and resume, if any)"""
+        self.connected.clear()
+        self.resumed.clear()
+        self.ws = FakeWebSocket(self)
+        self.agent.websocket = self.ws
+        self.agent.on_websocket_open(self.ws)
+        if not self.connected.wait(timeout):
+            raise TimeoutError("Agent did not say hello")
+
+    def cut(self):
+        """Keep the link open but lose everything sent on it from now on"""
+        self.ws.cut = True
+
+    def drop(self):
+        """Close the tunnel as a network failure would"""
+        ws = self.ws
+        ws.close()
+        self.agent.on_websocket_close(ws, 1006, 'Connection lost')
+
+    @property
+    def link_up(self) -> bool:
+        return bool(self.ws and self.ws.sock.connected and not self.ws.cut)
+
+    def _to_agent(self, message):
+        if not self.link_up:
+            return
+        if isinstance(message, dict):
+            message = json.dumps(message)
+        self.agent.on_websocket_message(self.ws, message)
+
+    # Streams
+
+    def open_stream(self, stream_id: str, target_port: int) -> StandInStream:
+        stream = StandInStream(stream_id, self.replay_bytes)
+        with self._lock:
+            self.streams[stream_id] = stream
+        self._to_agent({'type': 'open', 'streamId': stream_id, 'clientAddress': '127.0.0.1:50000',
+                        'targetPort': target_port})
+        return stream
+
+    def send(self, stream_id: str, data: bytes):
+        """Player bytes for a stream, replayed on resume if the agent does not get them"""
+        self.streams[stream_id].replay.append(data)
+        self._send_data(stream_id, data)
+
+    def _send_data(self, stream_id: str, data: bytes):
+        if CAP_BINARY_FRAMES in self.capabilities:
+            self._to_agent(encode_frame(OP_DATA, stream_id, data))
+        else:
+            self._to_agent(payload_message(OP_DATA, stream_id, data))
+
+    def received(self, stream_id: str) -> bytes:
+        with self._lock:
+            return bytes(self.streams[stream_id].from_host)
+
+    # Agent messages
+
+    def _receive_loop(self):
+        while True:
+            payload = self.inbox.get()
+            if isinstance(payload, (bytes, bytearray)):
+                opcode, channel_id, body = decode_frame(payload)
+                records = iter_batch(body) if opcode == OP_BATCH else [(opcode, channel_id, body)]
+                for record_opcode, record_id, data in records:
+                    if record_opcode == OP_DATA:
+                        self._host_data(record_id, bytes(data))
+            else:
+                message = json.loads(payload)
+                if message.get('type') == 'data':
+                    self._host_data(message['streamId'], base64.b64decode(message['data']))
+                else:
+                    self._host_message(message)
+
+    def _host_data(self, stream_id: str, data: bytes):
+        with self._lock:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                return
+            stream.from_host += data
+        if CAP_FLOW_CONTROL in self.capabilities:
+            # The player took it right away
+            self._to_agent({'type': 'ack', 'streamId': stream_id, 'bytes': len(data)})
+
+    def _host_message(self, message: dict):
+        message_type = message.get('type')
+        if message_type == 'hello':
+            offered = set(message.get('capabilities') or [])
+            supported = {CAP_BINARY_FRAMES, CAP_FLOW_CONTROL, CAP_BATCH_FRAMES}
+            if self.stream_resume:
+                supported.add(CAP_STREAM_RESUME)
+            self.capabilities = offered & supported
+            self._to_agent({'type': 'hello_ack', 'capabilities': sorted(self.capabilities),
+                            'window': message.get('window', 0), 'lanes': 0})
+            self.connected.set()
+        elif message_type == 'ack':
+            stream = self.streams.get(message.get('streamId'))
+            if stream:
+                stream.acked_by_host += int(message.get('bytes') or 0)
+                stream.replay.trim(stream.acked_by_host)
+        elif message_type in ('close', 'error'):
+            stream = self.streams.get(message.get('streamId'))
+            if stream:
+                stream.closed.set()
+        elif message_type == 'resume':
+            self._resume(message.get('streams') or [])
+
+    def _resume(self, entries: list):
+        """Same rules as ProxyManager.resumeConnections"""
+        requested = {entry['streamId']: int(entry.get('received') or 0) for entry in entries}
+        resumed = []
+        for stream_id, stream in list(self.streams.items()):
+            if stream.closed.is_set():
+                continue
+            pending = stream.replay.since(requested[stream_id]) if stream_id in requested else None
+            if pending is None:
+                stream.closed.set()
+                self._to_agent({'type': 'close', 'streamId': stream_id})
+                continue
+            resumed.append((stream, requested[stream_id], pending))
+        with self._lock:
+            ack = [{'streamId': stream.stream_id, 'received': len(stream.from_host)} for stream, _, _ in resumed]
+        self._to_agent({'type': 'resume_ack', 'streams': ack})
+        for stream, received, pending in resumed:
+            stream.acked_by_host = received
+            stream.replay.trim(received)
+            if pending:
+                self._send_data(stream.stream_id, pending)
+        self.resumed.set()
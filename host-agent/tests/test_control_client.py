@@ -0,0 +1,124 @@
+"""Pooled control-plane HTTP client (ControlClient, DnsCache, Backoff)"""
+
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import control_client
+from control_client import Backoff, ControlClient, DnsCache
+
+
+class StandInControlPlane(ThreadingHTTPServer):
+    """Pato2's HTTP API on 127.0.0.1, recording each request"""
+
+    def __init__(self):
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), self.Handler)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            self.server.requests.append((self.path, self.headers['Host'], json.loads(body)))
+            reply = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+
+@pytest.fixture
+def control_plane():
+    server = StandInControlPlane()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Answers for pato2.test, in order (the last one repeats); records every lookup"""
+    answers = []
+    calls = []
+
+    def gethostbyname(hostname):
+        calls.append(hostname)
+        answer = answers[min(len(calls), len(answers)) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(control_client.socket, 'gethostbyname', gethostbyname)
+    return answers, calls
+
+
+def test_post_re_resolves_after_a_failed_connect(control_plane, lookups):
+    answers, calls = lookups
+    port = control_plane.server_address[1]
+    # Nothing listens on 127.0.0.2 (the server moved to 127.0.0.1)
+    answers[:] = ['127.0.0.2', '127.0.0.1']
+    client = ControlClient(f'http://pato2.test:{port}', dns_ttl=3600, timeout=2)
+
+    response = client.post('/api/heartbeat', {'token': 't'})
+
+    assert response.json() == {'ok': True}
+    assert calls == ['pato2.test', 'pato2.test']
+    assert control_plane.requests == [('/api/heartbeat', f'pato2.test:{port}', {'token': 't'})]
+
+    # The new address is cached for later calls
+    client.post('/api/heartbeat', {'token': 't'})
+    assert len(calls) == 2
+    assert len(control_plane.requests) == 2
+    client.close()
+
+
+def test_post_raises_when_the_retry_fails_too(lookups):
+    answers, calls = lookups
+    answers[:] = ['127.0.0.2']
+    client = ControlClient('http://pato2.test:9', dns_ttl=3600, timeout=2)
+
+    with pytest.raises(requests.ConnectionError):
+        client.post('/api/heartbeat', {})
+    assert len(calls) == 2
+    client.close()
+
+
+def test_failed_lookup_keeps_the_last_address(lookups):
+    answers, calls = lookups
+    answers[:] = ['127.0.0.1', socket.gaierror('no network')]
+    dns = DnsCache('pato2.test', ttl=3600)
+
+    assert dns.resolve() == '127.0.0.1'
+    dns.invalidate()
+    assert dns.resolve() == '127.0.0.1'
+    assert len(calls) == 2
+
+
+def test_backoff_grows_to_its_cap_with_jitter():
+    backoff = Backoff(1.0, 10.0)
+
+    caps = [1, 2, 4, 8, 10, 10, 10]
+    for cap in caps:
+        assert cap / 2 <= backoff.next_delay() <= cap
+
+    # A long outage stays at the cap and keeps counting attempts
+    for _ in range(5000):
+        assert 5 <= backoff.next_delay() <= 10
+    assert backoff.attempts == len(caps) + 5000
+
+    backoff.reset()
+    assert 0.5 <= backoff.next_delay() <= 1.0
+
+
+def test_backoff_cap_is_never_below_base():
+    backoff = Backoff(5.0, 1.0)
+
+    assert all(2.5 <= backoff.next_delay() <= 5.0 for _ in range(20))
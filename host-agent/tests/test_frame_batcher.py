@@ -0,0 +1,59 @@
+"""Batch frames built by FrameBatcher"""
+
+from frame_batcher import FrameBatcher
+from tunnel_protocol import OP_BATCH, OP_DATA, OP_UDP_DATA, decode_frame, iter_batch
+
+
+def make_batcher(sent, max_bytes=1024, bypass_bytes=0):
+    return FrameBatcher(sent.append, flush_window=60.0, max_bytes=max_bytes, bypass_bytes=bypass_bytes)
+
+
+def records_of(frame):
+    opcode, channel_id, body = decode_frame(frame)
+    assert (opcode, channel_id) == (OP_BATCH, '')
+    return [(record_opcode, record_id, bytes(data)) for record_opcode, record_id, data in iter_batch(body)]
+
+
+def test_records_are_sent_in_one_frame():
+    sent = []
+    batcher = make_batcher(sent)
+    received = bytearray(b'abc')
+
+    batcher.submit(OP_DATA, 's1', memoryview(received))
+    # The batch holds its own copy of a submitted view
+    received[:] = b'xyz'
+    batcher.submit(OP_UDP_DATA, 'u1', b'')
+    batcher.submit(OP_DATA, 's2', b'd' * 100)
+    assert not sent
+    batcher.flush('timer')
+
+    assert len(sent) == 1
+    assert records_of(sent[0]) == [(OP_DATA, 's1', b'abc'), (OP_UDP_DATA, 'u1', b''), (OP_DATA, 's2', b'd' * 100)]
+    assert batcher.get_metrics()['flush_reasons']['timer'] == 1
+
+
+def test_full_batch_is_sent_including_an_oversized_record():
+    sent = []
+    batcher = make_batcher(sent, max_bytes=100)
+
+    batcher.submit(OP_DATA, 's1', b'a' * 50)
+    batcher.submit(OP_DATA, 's1', b'b' * 500)
+    batcher.submit(OP_DATA, 's2', b'c' * 10)
+    batcher.flush('timer')
+
+    assert [records_of(frame) for frame in sent] == [
+        [(OP_DATA, 's1', b'a' * 50), (OP_DATA, 's1', b'b' * 500)],
+        [(OP_DATA, 's2', b'c' * 10)],
+    ]
+
+
+def test_clear_drops_pending_records():
+    sent = []
+    batcher = make_batcher(sent)
+
+    batcher.submit(OP_DATA, 's1', b'old')
+    batcher.clear()
+    batcher.submit(OP_DATA, 's1', b'new')
+    batcher.flush('timer')
+
+    assert [records_of(frame) for frame in sent] == [[(OP_DATA, 's1', b'new')]]
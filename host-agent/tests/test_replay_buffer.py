@@ -0,0 +1,44 @@
+"""ReplayBuffer offsets across appends, trims and overflow"""
+
+from replay_buffer import ReplayBuffer
+
+
+def test_trim_drops_acknowledged_bytes_across_chunks():
+    replay = ReplayBuffer(1024)
+    for data in (b'abc', b'defg', b'hi'):
+        replay.append(data)
+
+    replay.trim(5)
+
+    assert (replay.start, replay.end) == (5, 9)
+    assert replay.since(5) == b'fghi'
+    assert replay.since(7) == b'hi'
+    assert replay.since(9) == b''
+    assert replay.since(4) is None
+    assert replay.since(10) is None
+
+
+def test_overflow_keeps_the_newest_max_bytes():
+    replay = ReplayBuffer(5)
+    replay.append(b'abc')
+    replay.append(memoryview(b'defg'))
+
+    assert (replay.start, replay.end) == (2, 7)
+    assert replay.since(2) == b'cdefg'
+
+    # A chunk larger than the buffer keeps only its tail
+    replay.append(b'0123456789')
+    assert (replay.start, replay.end) == (12, 17)
+    assert replay.since(12) == b'56789'
+
+
+def test_trim_before_start_or_past_end():
+    replay = ReplayBuffer(1024)
+    replay.append(b'abcdef')
+    replay.trim(2)
+
+    replay.trim(1)
+    assert replay.start == 2
+    replay.trim(100)
+    assert (replay.start, replay.end) == (6, 6)
+    assert replay.since(6) == b''
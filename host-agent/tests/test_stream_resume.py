@@ -0,0 +1,119 @@
+"""Stream resumption across tunnel reconnects (TUNNEL_STREAM_RESUME)"""
+
+from harness import wait_until
+
+
+def open_stream(agent, pato2, minecraft, stream_id='s1'):
+    """Open a stream and exchange a first round of bytes both ways"""
+    pato2.open_stream(stream_id, minecraft.port)
+    assert wait_until(lambda: len(minecraft.connections) == 1)
+    pato2.send(stream_id, b'A' * 1000)
+    minecraft.send(0, b'B' * 1000)
+    assert wait_until(lambda: minecraft.data(0) == b'A' * 1000)
+    assert wait_until(lambda: pato2.received(stream_id) == b'B' * 1000)
+    return agent.connections[stream_id]
+
+
+def test_reconnect_mid_transfer_replays_both_ways(make_agent, pato2_for, minecraft):
+    agent = make_agent()
+    pato2 = pato2_for(agent)
+    stream = open_stream(agent, pato2, minecraft)
+
+    # Bytes sent by each side are lost with the connection
+    pato2.cut()
+    pato2.send('s1', b'C' * 5000)
+    minecraft.send(0, b'D' * 7000)
+    assert wait_until(lambda: stream.replay.end == 8000)
+    pato2.drop()
+    assert not stream.attached.is_set()
+
+    pato2.connect()
+    assert pato2.resumed.wait(5)
+    assert wait_until(lambda: minecraft.data(0) == b'A' * 1000 + b'C' * 5000)
+    assert wait_until(lambda: pato2.received('s1') == b'B' * 1000 + b'D' * 7000)
+
+    # The stream carries on after the resume
+    pato2.send('s1', b'E' * 10)
+    minecraft.send(0, b'F' * 10)
+    assert wait_until(lambda: minecraft.data(0).endswith(b'C' * 5000 + b'E' * 10))
+    assert wait_until(lambda: pato2.received('s1').endswith(b'D' * 7000 + b'F' * 10))
+    assert 's1' in agent.connections
+    assert not minecraft.closed[0].is_set()
+    assert not pato2.streams['s1'].closed.is_set()
+
+
+def test_offset_outside_replay_buffer_closes_stream(make_agent, pato2_for, minecraft):
+    agent = make_agent(RESUME_BUFFER_BYTES=4096)
+    pato2 = pato2_for(agent)
+    stream = open_stream(agent, pato2, minecraft)
+
+    # More than the agent's replay buffer holds never reaches Pato2
+    pato2.cut()
+    minecraft.send(0, b'D' * 10000)
+    assert wait_until(lambda: stream.replay.end == 11000)
+    assert stream.replay.start > 1000
+    pato2.drop()
+
+    pato2.connect()
+    assert wait_until(lambda: pato2.streams['s1'].closed.is_set())
+    assert wait_until(lambda: minecraft.closed[0].is_set())
+    assert 's1' not in agent.connections
+
+
+def test_streams_closed_when_grace_period_expires(make_agent, pato2_for, minecraft):
+    agent = make_agent(RESUME_GRACE_SECONDS=0.3)
+    pato2 = pato2_for(agent)
+    open_stream(agent, pato2, minecraft)
+
+    pato2.drop()
+    assert 's1' in agent.connections
+    assert not minecraft.closed[0].is_set()
+
+    assert wait_until(lambda: minecraft.closed[0].is_set(), timeout=3)
+    assert 's1' not in agent.connections
+
+
+def test_reconnect_without_stream_resume_closes_streams(make_agent, pato2_for, minecraft):
+    agent = make_agent()
+    pato2 = pato2_for(agent)
+    open_stream(agent, pato2, minecraft)
+
+    pato2.drop()
+    pato2.stream_resume = False
+    pato2.connect()
+
+    assert wait_until(lambda: minecraft.closed[0].is_set())
+    assert 's1' not in agent.connections
+    assert agent.resume_timer is None
+
+
+def test_without_resume_a_drop_closes_streams(make_agent, pato2_for, minecraft):
+    agent = make_agent()
+    pato2 = pato2_for(agent, stream_resume=False)
+    open_stream(agent, pato2, minecraft)
+
+    pato2.drop()
+
+    assert wait_until(lambda: minecraft.closed[0].is_set())
+    assert 's1' not in agent.connections
+
+
+def test_late_close_of_replaced_connection_keeps_streams(make_agent, pato2_for, minecraft):
+    agent = make_agent()
+    pato2 = pato2_for(agent)
+    stream = open_stream(agent, pato2, minecraft)
+
+    # The agent is already on a new connection when the old one reports its close
+    old_ws = pato2.ws
+    pato2.connect()
+    old_ws.close()
+    agent.on_websocket_close(old_ws, 1006, 'Connection lost')
+
+    assert stream.attached.is_set()
+    assert agent.resume_timer is None
+    assert agent.tunnel_options.stream_resume
+    pato2.send('s1', b'C' * 10)
+    minecraft.send(0, b'D' * 10)
+    assert wait_until(lambda: minecraft.data(0) == b'A' * 1000 + b'C' * 10)
+    assert wait_until(lambda: pato2.received('s1') == b'B' * 1000 + b'D' * 10)
+    assert 's1' in agent.connections
@@ -0,0 +1,33 @@
+"""Bookkeeping of Bedrock UDP clients announced with udp_open"""
+
+import json
+import threading
+
+from harness import wait_until
+
+
+def announce(agent, pato2, count):
+    for i in range(count):
+        agent.on_websocket_message(pato2.ws, json.dumps({'type': 'udp_open', 'clientId': f'u{i}'}))
+
+
+def test_ping_only_clients_are_capped(make_agent, pato2_for):
+    agent = make_agent(UDP_MAX_SESSIONS=2)
+    pato2 = pato2_for(agent)
+
+    announce(agent, pato2, 5)
+
+    # Least recently announced ones are forgotten
+    assert set(agent.udp_targets) == {'u3', 'u4'}
+    assert agent.udp_pending.get_metrics()['counters']['evicted'] == 3
+
+
+def test_ping_only_clients_expire_when_idle(make_agent, pato2_for):
+    agent = make_agent(UDP_IDLE_TIMEOUT_SECONDS=0.2)
+    pato2 = pato2_for(agent)
+
+    announce(agent, pato2, 3)
+    threading.Thread(target=agent.udp_sweep_loop, daemon=True).start()
+
+    assert wait_until(lambda: not agent.udp_targets, timeout=3)
+    assert agent.udp_pending.get_metrics()['active'] == 0
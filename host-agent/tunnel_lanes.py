@@ -0,0 +1,146 @@
+"""
+Tunnel Lanes
+Extra WebSocket connections that carry the traffic of a subset of streams
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+import websocket
+
+from control_client import Backoff
+from frame_batcher import FrameBatcher
+from recv_buffers import ReceiveBuffer
+from stream_scheduler import FairScheduler
+from tunnel_protocol import encode_frame, payload_message
+from ws_sender import PRIORITY_DATA, WebSocketSender, message_priority
+
+
+class TunnelLane:
+    """One data lane of a striped tunnel
+
+    Pato2 hashes streams and UDP clients onto lanes (see tunnel_protocol.lane_index)
+    and opens each on its lane, or on the primary WebSocket while the lane is down.
+    Every later message of the stream - data, ack, close, error - travels on that
+    same socket so per-stream ordering holds. Connection-level control (hello, ping, backup
+    commands, heartbeats) stays on the agent's primary WebSocket.
+    """
+
+    def __init__(self, index: int, agent):
+        self.index = index
+        self.agent = agent
+        self.config = agent.config
+        self.logger = logging.getLogger(f'TunnelLane{index}')
+
+        self.websocket: Optional[websocket.WebSocketApp] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = False
+        self.backoff = Backoff(self.config['reconnect_delay'], self.config['reconnect_max_delay'])
+        self.sender = WebSocketSender(f'TunnelLane{index}Sender', lambda: self.websocket, self.config['ws_send_queue_bytes'])
+        self.batcher = FrameBatcher(
+            self.send_binary_frame,
+            self.config['batch_flush_ms'] / 1000.0,
+            self.config['batch_max_bytes'],
+            self.config['batch_bypass_bytes']
+        )
+        self.scheduler: Optional[FairScheduler] = None
+        if self.config['fair_scheduling']:
+            self.scheduler = FairScheduler(
+                f'TunnelLane{index}Scheduler',
+                lambda: self.sender.wait_writable(self.config['batch_max_bytes']),
+                self.config['fair_quantum'],
+                self.config['stream_send_queue_bytes'],
+                self.config['stream_rate_limit']
+            )
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.websocket and self.websocket.sock and self.websocket.sock.connected)
+
+    def start(self):
+        self.sender.start()
+        if self.scheduler:
+            self.scheduler.start()
+        self.batcher.start()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.scheduler:
+            self.scheduler.stop()
+        self.batcher.stop()
+        self.sender.stop()
+        if self.websocket:
+            self.websocket.close()
+
+    def run(self):
+        """Lane connection loop with reconnection"""
+        while self.agent.running and not self.stopped:
+            url = f"{self.agent.build_websocket_url()}&lane={self.index}"
+            self.websocket = websocket.WebSocketApp(
+                url,
+                on_open=self.on_open,
+                on_message=lambda ws, message: self.agent.on_websocket_message(ws, message, self),
+                on_error=self.on_error,
+                on_close=self.on_close
+            )
+            try:
+                self.websocket.run_forever()
+            except Exception as e:
+                self.logger.error(f"Lane WebSocket error: {e}")
+            if self.agent.running and not self.stopped:
+                time.sleep(self.backoff.next_delay())
+
+    def on_open(self, ws):
+        self.logger.info(f"Tunnel lane {self.index} connected")
+        self.backoff.reset()
+        if self.scheduler:
+            self.scheduler.clear()
+        self.batcher.clear()
+        self.sender.clear()
+
+    def on_error(self, ws, error):
+        self.logger.error(f"Lane WebSocket error: {error}")
+
+    def on_close(self, ws, close_status_code, close_msg):
+        self.logger.warning(f"Tunnel lane {self.index} closed: {close_status_code} {close_msg}")
+        # A late close of a replaced lane connection does not touch the current one
+        if not self.stopped and ws is self.websocket:
+            self.agent.handle_lane_lost(self)
+
+    def send_message(self, message: dict):
+        priority = message_priority(message)
+        if priority == PRIORITY_DATA and self.agent.tunnel_options.batch_frames:
+            # Keep in-order stream messages (close, ...) behind data already batched on this lane
+            self.batcher.flush('control')
+        self.sender.send_message(message, priority)
+
+    def send_channel_message(self, channel_id: str, message: dict):
+        """Send a stream-scoped message, in order behind the stream's scheduled data"""
+        if self.scheduler and message_priority(message) == PRIORITY_DATA:
+            self.scheduler.submit(channel_id, 0, self.send_message, message)
+        else:
+            self.send_message(message)
+
+    def send_binary_frame(self, frame: bytes):
+        self.sender.send_binary_frame(frame)
+
+    def send_payload(self, opcode: int, channel_id: str, data: bytes, owner: Optional[ReceiveBuffer] = None):
+        """Queue a stream/UDP payload on the lane's scheduler (see HostAgent.send_payload)"""
+        if self.scheduler:
+            self.agent.queue_payload(self.scheduler, self.deliver_payload, opcode, channel_id, data, owner)
+        else:
+            self.deliver_payload(opcode, channel_id, data)
+
+    def deliver_payload(self, opcode: int, channel_id: str, data: bytes):
+        """Send a stream/UDP payload using the negotiated framing"""
+        options = self.agent.tunnel_options
+        if options.batch_frames:
+            self.batcher.submit(opcode, channel_id, data)
+        elif options.binary_frames:
+            self.send_binary_frame(encode_frame(opcode, channel_id, data))
+        else:
+            self.send_message(payload_message(opcode, channel_id, data))
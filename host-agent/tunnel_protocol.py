@@ -0,0 +1,218 @@
+"""
+Tunnel Protocol
+Binary frame format shared with Pato2 for tunnel payloads
+"""
+
+import base64
+import struct
+from typing import Iterator, Tuple, Union
+
+PROTOCOL_VERSION = 1
+
+# Capabilities announced in the 'hello' control message
+CAP_BINARY_FRAMES = 'binary_frames'
+CAP_FLOW_CONTROL = 'flow_control'
+CAP_BATCH_FRAMES = 'batch_frames'
+CAP_STRIPED_LANES = 'striped_lanes'
+# Lease heartbeats sent as 'heartbeat' control messages instead of HTTP polls
+CAP_WS_HEARTBEAT = 'ws_heartbeat'
+# Streams survive a reconnect: both sides replay what the other did not receive
+CAP_STREAM_RESUME = 'stream_resume'
+
+# Frame opcodes
+OP_DATA = 0x01
+OP_UDP_DATA = 0x02
+# Several [opcode][id_len][id][len:u32][payload] records packed into one frame
+OP_BATCH = 0x03
+
+MAX_ID_LENGTH = 255
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class FrameError(ValueError):
+    """Raised when a binary frame cannot be decoded"""
+
+
+class TunnelOptions:
+    """Protocol options in effect for one WebSocket connection"""
+
+    def __init__(self):
+        self.binary_frames = False
+        self.flow_control = False
+        self.batch_frames = False
+        self.ws_heartbeat = False
+        self.stream_resume = False
+        # Number of data lanes (extra WebSockets) streams are striped over, 0 = single connection
+        self.lanes = 0
+        # Max unacknowledged bytes per stream we may send to Pato2 (0 = unlimited)
+        self.send_window = 0
+        # Bytes delivered to the local server per ack sent to Pato2
+        self.ack_threshold = 1
+
+    @staticmethod
+    def receive_window(config: dict) -> int:
+        """Bytes per stream we let Pato2 send before it waits for our acks"""
+        return min(config['flow_window'], config['stream_write_buffer'])
+
+    @staticmethod
+    def resume_supported(config: dict) -> bool:
+        """Resumption replays on the primary WebSocket, so it is not offered with striped lanes"""
+        return config['stream_resume'] and config['tunnel_lanes'] == 0
+
+    @staticmethod
+    def build_hello(config: dict) -> dict:
+        """Build the 'hello' control message announcing our capabilities"""
+        capabilities = []
+        if config['binary_frames']:
+            capabilities.append(CAP_BINARY_FRAMES)
+        if config['flow_control']:
+            capabilities.append(CAP_FLOW_CONTROL)
+        if config['binary_frames'] and config['batching']:
+            capabilities.append(CAP_BATCH_FRAMES)
+        if config['tunnel_lanes'] > 0:
+            capabilities.append(CAP_STRIPED_LANES)
+        if config['ws_heartbeat']:
+            capabilities.append(CAP_WS_HEARTBEAT)
+        if TunnelOptions.resume_supported(config):
+            capabilities.append(CAP_STREAM_RESUME)
+        return {
+            'type': 'hello',
+            'version': PROTOCOL_VERSION,
+            'capabilities': capabilities,
+            'window': TunnelOptions.receive_window(config),
+            'lanes': config['tunnel_lanes']
+        }
+
+    @classmethod
+    def from_hello_ack(cls, config: dict, ack: dict) -> 'TunnelOptions':
+        """Options accepted by Pato2 in its 'hello_ack' reply"""
+        accepted = set(ack.get('capabilities') or [])
+        options = cls()
+        options.binary_frames = config['binary_frames'] and CAP_BINARY_FRAMES in accepted
+        options.flow_control = config['flow_control'] and CAP_FLOW_CONTROL in accepted
+        options.batch_frames = options.binary_frames and config['batching'] and CAP_BATCH_FRAMES in accepted
+        options.ws_heartbeat = config['ws_heartbeat'] and CAP_WS_HEARTBEAT in accepted
+        options.stream_resume = TunnelOptions.resume_supported(config) and CAP_STREAM_RESUME in accepted
+        if options.flow_control:
+            try:
+                peer_window = int(ack.get('window') or 0)
+            except (TypeError, ValueError):
+                peer_window = 0
+            options.send_window = min(config['flow_window'], peer_window) if peer_window > 0 else config['flow_window']
+            # Pato2 may cap its window to us below what we announced: ack well before either limit
+            receive_window = TunnelOptions.receive_window(config)
+            if peer_window > 0:
+                receive_window = min(receive_window, peer_window)
+            options.ack_threshold = max(1, receive_window // 4)
+        if config['tunnel_lanes'] > 0 and CAP_STRIPED_LANES in accepted:
+            try:
+                options.lanes = max(0, min(config['tunnel_lanes'], int(ack.get('lanes') or 0)))
+            except (TypeError, ValueError):
+                options.lanes = 0
+        return options
+
+    def describe(self) -> str:
+        return (
+            f"binary_frames={self.binary_frames}, flow_control={self.flow_control}, "
+            f"batch_frames={self.batch_frames}, ws_heartbeat={self.ws_heartbeat}, "
+            f"stream_resume={self.stream_resume}, "
+            f"lanes={self.lanes}, send_window={self.send_window}"
+        )
+
+
+def lane_index(channel_id: str, lane_count: int) -> int:
+    """Data lane carrying a stream/UDP client (FNV-1a, must match Pato2)"""
+    value = 0x811c9dc5
+    for byte in channel_id.encode('ascii'):
+        value = ((value ^ byte) * 0x01000193) & 0xffffffff
+    return value % lane_count
+
+
+def payload_message(opcode: int, channel_id: str, payload: BytesLike) -> dict:
+    """JSON + base64 form of a payload, for peers without binary frames"""
+    data = base64.b64encode(payload).decode('ascii')
+    if opcode == OP_UDP_DATA:
+        return {'type': 'udp_data', 'clientId': channel_id, 'data': data}
+    return {'type': 'data', 'streamId': channel_id, 'data': data}
+
+
+def encode_frame(opcode: int, channel_id: str, payload: BytesLike) -> bytes:
+    """Encode a binary tunnel frame
+
+    Layout: [opcode:u8][id_len:u8][id:ascii][payload...]
+    """
+    id_bytes = channel_id.encode('ascii')
+    if len(id_bytes) > MAX_ID_LENGTH:
+        raise FrameError(f"Channel id too long: {len(id_bytes)} bytes")
+    return b''.join((bytes((opcode, len(id_bytes))), id_bytes, payload))
+
+
+def _decode_channel_id(raw: BytesLike) -> str:
+    try:
+        return bytes(raw).decode('ascii')
+    except UnicodeDecodeError:
+        raise FrameError("Channel id is not ASCII") from None
+
+
+def decode_frame(frame: BytesLike) -> Tuple[int, str, memoryview]:
+    """Decode a binary tunnel frame into (opcode, channel_id, payload)"""
+    view = memoryview(frame)
+    if len(view) < 2:
+        raise FrameError("Frame too short")
+    opcode = view[0]
+    id_end = 2 + view[1]
+    if len(view) < id_end:
+        raise FrameError("Truncated channel id")
+    channel_id = _decode_channel_id(view[2:id_end])
+    return opcode, channel_id, view[id_end:]
+
+
+_RECORD_LENGTH = struct.Struct('>I')
+
+
+# An OP_BATCH frame is this header (empty channel id) followed by the records
+BATCH_FRAME_HEADER = bytes((OP_BATCH, 0))
+
+
+def batch_record_size(channel_id: str, payload: BytesLike) -> int:
+    return 2 + len(channel_id) + _RECORD_LENGTH.size + len(payload)
+
+
+def write_batch_record(buf: bytearray, offset: int, opcode: int, channel_id: str, payload: BytesLike) -> int:
+    """Encode one record of an OP_BATCH frame body into buf at offset, returns the offset after it
+
+    buf must already have batch_record_size() bytes of room at offset.
+    """
+    id_bytes = channel_id.encode('ascii')
+    if len(id_bytes) > MAX_ID_LENGTH:
+        raise FrameError(f"Channel id too long: {len(id_bytes)} bytes")
+    buf[offset] = opcode
+    buf[offset + 1] = len(id_bytes)
+    offset += 2
+    buf[offset:offset + len(id_bytes)] = id_bytes
+    offset += len(id_bytes)
+    _RECORD_LENGTH.pack_into(buf, offset, len(payload))
+    offset += _RECORD_LENGTH.size
+    buf[offset:offset + len(payload)] = payload
+    return offset + len(payload)
+
+
+def iter_batch(body: BytesLike) -> Iterator[Tuple[int, str, memoryview]]:
+    """Iterate over the (opcode, channel_id, payload) records of an OP_BATCH frame body"""
+    view = memoryview(body)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < 2:
+            raise FrameError("Truncated batch record")
+        opcode = view[offset]
+        id_end = offset + 2 + view[offset + 1]
+        if len(view) < id_end + _RECORD_LENGTH.size:
+            raise FrameError("Truncated batch record header")
+        channel_id = _decode_channel_id(view[offset + 2:id_end])
+        (length,) = _RECORD_LENGTH.unpack_from(view, id_end)
+        start = id_end + _RECORD_LENGTH.size
+        if len(view) < start + length:
+            raise FrameError("Truncated batch record payload")
+        yield opcode, channel_id, view[start:start + length]
+        offset = start + length
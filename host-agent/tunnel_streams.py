@@ -0,0 +1,180 @@
+"""
+Tunnel Streams
+Per-stream state for the threaded tunnel: local socket plus a bounded write queue
+"""
+
+import queue
+import socket
+import threading
+from typing import Optional
+
+from replay_buffer import ReplayBuffer
+
+
+class TunnelStream:
+    """Local TCP connection backing one tunnel stream
+
+    Payloads from Pato2 are queued here and written to the local server by the
+    stream's own writer thread, so a slow or stuck socket only stalls itself.
+    """
+
+    # Queue sentinel telling the writer thread to exit
+    _STOP = None
+
+    def __init__(self, stream_id: str, target_port: int, max_buffered_bytes: int, send_window: int = 0,
+                 replay_bytes: int = 0):
+        self.stream_id = stream_id
+        self.target_port = target_port
+        self.max_buffered_bytes = max_buffered_bytes
+        self.sock: Optional[socket.socket] = None
+        self.closed = False
+
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.buffered_bytes = 0
+
+        # Flow control: bytes sent to Pato2 and not yet acknowledged (0 window = disabled)
+        self.send_window = send_window
+        self.in_flight = 0
+        self._credit = threading.Condition(self._lock)
+        # Bytes written to the local server that we have not acknowledged to Pato2 yet
+        self.unacked_received = 0
+
+        # Stream resumption (replay_bytes 0 = disabled): bytes received from Pato2, bytes
+        # sent to it that it may not have yet, and whether the tunnel is attached
+        self.received = 0
+        self.peer_acked = 0
+        self.delivered = 0
+        # Bytes not yet delivered when we reported our offset; Pato2 counts them as acknowledged
+        self.ack_skip = 0
+        self.replay: Optional[ReplayBuffer] = ReplayBuffer(replay_bytes) if replay_bytes > 0 else None
+        self.send_lock = threading.Lock()
+        self.attached = threading.Event()
+        self.attached.set()
+        # Bumped on detach: payloads queued for an older connection are dropped (see HostAgent.deliver_resumable)
+        self.epoch = 0
+        self.deliver_lock = threading.Lock()
+
+    def enqueue(self, payload: bytes) -> bool:
+        """Queue payload for the local server, False if the stream is closed or over its buffer limit"""
+        with self._lock:
+            if self.closed:
+                return False
+            if self.buffered_bytes + len(payload) > self.max_buffered_bytes:
+                return False
+            self.buffered_bytes += len(payload)
+            self.received += len(payload)
+        self._queue.put(payload)
+        return True
+
+    def next_payload(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Block until the next queued payload is available, None once the stream is closed or on timeout"""
+        try:
+            payload = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if payload is self._STOP:
+            return None
+        with self._lock:
+            self.buffered_bytes -= len(payload)
+        return payload
+
+    def consume_credit(self, nbytes: int):
+        """Account bytes sent to Pato2 against the stream's window"""
+        if self.send_window:
+            with self._lock:
+                self.in_flight += nbytes
+
+    def release_credit(self, nbytes: int):
+        """Handle an ack from Pato2 for bytes it delivered to the player"""
+        with self._credit:
+            self.in_flight = max(0, self.in_flight - nbytes)
+            self.peer_acked += nbytes
+            self._credit.notify_all()
+        if self.replay:
+            self.replay.trim(self.peer_acked)
+
+    def wait_attached(self, timeout: float) -> bool:
+        """Block while the tunnel is down and the stream waits to be resumed"""
+        return self.attached.wait(timeout) or self.closed
+
+    def detach(self):
+        """Tunnel lost: hold outbound data until the stream is resumed or closed
+
+        Returns once no payload of the old connection is being delivered.
+        """
+        with self.send_lock, self.deliver_lock:
+            if not self.closed:
+                self.attached.clear()
+                self.epoch += 1
+
+    def resume_offset(self) -> int:
+        """Bytes received from Pato2, reported when asking to resume
+
+        Everything up to this offset counts as acknowledged from now on, so the
+        acks lost with the old connection are not sent again.
+        """
+        with self._lock:
+            self.unacked_received = 0
+            self.ack_skip = self.received - self.delivered
+            return self.received
+
+    def resume_send(self, peer_received: int):
+        """Restart send accounting from the offset Pato2 received up to (call with send_lock held)"""
+        with self._credit:
+            self.peer_acked = peer_received
+            if self.send_window:
+                self.in_flight = max(0, self.replay.end - peer_received)
+            self._credit.notify_all()
+        self.replay.trim(peer_received)
+
+    def wait_for_credit(self, timeout: float) -> bool:
+        """Block while the window is exhausted; False if still exhausted after timeout"""
+        if not self.send_window:
+            return True
+        with self._credit:
+            if self.in_flight >= self.send_window and not self.closed:
+                self._credit.wait(timeout)
+            return self.closed or self.in_flight < self.send_window
+
+    def record_delivered(self, nbytes: int, ack_threshold: int) -> int:
+        """Count bytes written locally, returning how many to ack once over the threshold"""
+        with self._lock:
+            self.delivered += nbytes
+            skipped = min(self.ack_skip, nbytes)
+            self.ack_skip -= skipped
+            self.unacked_received += nbytes - skipped
+            if self.unacked_received < ack_threshold:
+                return 0
+            acked, self.unacked_received = self.unacked_received, 0
+            return acked
+
+    def get_status(self) -> dict:
+        """Buffered and in-flight byte counters for status output"""
+        return {
+            'target_port': self.target_port,
+            'buffered_bytes': self.buffered_bytes,
+            'in_flight_bytes': self.in_flight,
+            'send_window': self.send_window,
+            'attached': self.attached.is_set()
+        }
+
+    def close(self):
+        """Close the local socket and release the writer and reader threads"""
+        with self._credit:
+            if self.closed:
+                return
+            self.closed = True
+            self._credit.notify_all()
+        self.attached.set()
+        self._queue.put(self._STOP)
+        if self.sock:
+            # close() alone leaves the connection up while the reader thread is still in recv
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self.sock.close()
+            except Exception:
+                pass
@@ -0,0 +1,112 @@
+"""
+UDP Relay
+Services every Bedrock UDP session from a single selector loop
+"""
+
+import logging
+import selectors
+import socket
+import threading
+import time
+from typing import List, Tuple
+
+from metrics import Counters, Histogram
+
+
+class UdpRelay:
+    """One thread waits on all UDP session sockets (epoll/kqueue via selectors)
+
+    On each wakeup every ready socket is drained of up to max_batch datagrams
+    (recvmmsg-style) and everything read is handed to the agent in one call, so
+    it can be forwarded to Pato2 as a single batch instead of a message per
+    datagram.
+    """
+
+    def __init__(self, agent, max_batch: int):
+        self.agent = agent
+        self.max_batch = max(1, max_batch)
+        self.logger = logging.getLogger('UdpRelay')
+
+        self.selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self.counters = Counters(['wakeups', 'datagrams', 'recv_errors'])
+        self.wakeup_datagrams = Histogram([1, 2, 4, 8, 16, 32, 64])
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def add(self, client_id: str, sock: socket.socket):
+        """Start relaying datagrams received on a session socket"""
+        sock.setblocking(False)
+        with self._lock:
+            self.selector.register(sock, selectors.EVENT_READ, client_id)
+
+    def remove(self, sock: socket.socket):
+        with self._lock:
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+
+    def run(self):
+        while self._running and self.agent.running:
+            with self._lock:
+                has_sessions = bool(self.selector.get_map())
+            if not has_sessions:
+                # selectors on some platforms reject select() with nothing registered
+                time.sleep(0.1)
+                continue
+            try:
+                ready = self.selector.select(timeout=1.0)
+            except OSError as e:
+                self.logger.error(f"UDP relay select error: {e}")
+                continue
+
+            datagrams: List[Tuple[str, bytes]] = []
+            for key, _ in ready:
+                self.drain(key.data, key.fileobj, datagrams)
+            if not datagrams:
+                continue
+
+            self.counters.inc('wakeups')
+            self.counters.inc('datagrams', len(datagrams))
+            self.wakeup_datagrams.observe(len(datagrams))
+            self.agent.send_udp_batch(datagrams)
+
+    def drain(self, client_id: str, sock: socket.socket, out: List[Tuple[str, bytes]]):
+        """Read up to max_batch queued datagrams from one socket"""
+        for _ in range(self.max_batch):
+            try:
+                data = sock.recv(65535)
+            except BlockingIOError:
+                return
+            except ConnectionRefusedError:
+                # ICMP port unreachable from the local server, nothing to read
+                return
+            except OSError as e:
+                # Socket closed by udp_close while we were waiting
+                if self._running:
+                    self.counters.inc('recv_errors')
+                    self.logger.debug(f"UDP receive error for {client_id}: {e}")
+                return
+            if data:
+                out.append((client_id, data))
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            sessions = len(self.selector.get_map())
+        return {
+            'sessions': sessions,
+            'counters': self.counters.snapshot(),
+            'datagrams_per_wakeup': self.wakeup_datagrams.snapshot()
+        }
@@ -0,0 +1,80 @@
+"""
+UDP Sessions
+Idle tracking and LRU bookkeeping for Bedrock UDP sessions
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from metrics import Counters
+
+
+class UdpSessionTracker:
+    """Least-recently-used order and idle expiry of UDP client ids
+
+    Only tracks ids; the owner keeps the sockets/transports and closes whatever
+    add() evicts or expired() returns.
+    """
+
+    def __init__(self, max_sessions: int, idle_timeout: float):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._last_seen: 'OrderedDict[str, float]' = OrderedDict()
+        self.counters = Counters(['opened', 'implicit_opens', 'evicted', 'expired'])
+
+    def add(self, client_id: str, implicit: bool = False) -> Optional[str]:
+        """Track a new session, returns the least recently used one to evict when over the cap"""
+        self.counters.inc('opened')
+        if implicit:
+            self.counters.inc('implicit_opens')
+        with self._lock:
+            self._last_seen[client_id] = time.monotonic()
+            self._last_seen.move_to_end(client_id)
+            if self.max_sessions <= 0 or len(self._last_seen) <= self.max_sessions:
+                return None
+            victim, _ = self._last_seen.popitem(last=False)
+        self.counters.inc('evicted')
+        return victim
+
+    def touch(self, client_id: str):
+        with self._lock:
+            if client_id in self._last_seen:
+                self._last_seen[client_id] = time.monotonic()
+                self._last_seen.move_to_end(client_id)
+
+    def remove(self, client_id: str):
+        with self._lock:
+            self._last_seen.pop(client_id, None)
+
+    def expired(self) -> List[str]:
+        """Remove and return sessions idle for longer than idle_timeout"""
+        if self.idle_timeout <= 0:
+            return []
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            # Oldest first, stop at the first session still in use
+            for client_id, last_seen in self._last_seen.items():
+                if last_seen > deadline:
+                    break
+                expired.append(client_id)
+            for client_id in expired:
+                del self._last_seen[client_id]
+        if expired:
+            self.counters.inc('expired', len(expired))
+        return expired
+
+    def sweep_interval(self) -> float:
+        return max(1.0, self.idle_timeout / 4) if self.idle_timeout > 0 else 5.0
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            active = len(self._last_seen)
+        return {
+            'active': active,
+            'max_sessions': self.max_sessions,
+            'counters': self.counters.snapshot()
+        }
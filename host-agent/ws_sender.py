@@ -0,0 +1,154 @@
+"""
+WebSocket Sender
+Single writer thread with a prioritized outbound queue for one WebSocket
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple, Union
+
+import websocket
+
+from metrics import Counters, Histogram
+
+PRIORITY_CONTROL = 0
+PRIORITY_DATA = 1
+PRIORITY_NAMES = ['control', 'data']
+
+# Messages that may overtake queued payloads. 'close' and 'udp_close' are not
+# here: they must stay behind the data already queued for their channel.
+CONTROL_MESSAGE_TYPES = frozenset(['hello', 'pong', 'ack', 'error', 'heartbeat'])
+
+
+def message_priority(message: dict) -> int:
+    """Outbound priority of a JSON control message"""
+    return PRIORITY_CONTROL if message.get('type') in CONTROL_MESSAGE_TYPES else PRIORITY_DATA
+
+
+class WebSocketSender:
+    """Owns every write to a WebSocketApp
+
+    Producers (stream readers, the UDP relay, the batcher, the receive thread)
+    only enqueue; the writer thread always drains the control queue before the
+    data queue, so pongs and acks are not stuck behind bulk payloads. Data
+    producers block while more than max_queued_bytes of data is waiting, which
+    keeps memory bounded when the WebSocket is slower than the local server.
+    """
+
+    def __init__(self, name: str, get_websocket: Callable[[], Optional[websocket.WebSocketApp]],
+                 max_queued_bytes: int):
+        self.get_websocket = get_websocket
+        self.max_queued_bytes = max_queued_bytes
+        self.logger = logging.getLogger(name)
+
+        self._cond = threading.Condition()
+        self._queues: Tuple[Deque, Deque] = (deque(), deque())
+        self._queued_bytes = 0
+        self._running = False
+        self._thread = None
+
+        self.counters = Counters(['sent', 'dropped', 'send_errors'])
+        self.send_latency = [Histogram([1, 5, 10, 50, 100, 500, 1000]) for _ in PRIORITY_NAMES]
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def clear(self):
+        """Drop everything queued for a previous connection"""
+        with self._cond:
+            dropped = sum(len(q) for q in self._queues)
+            for q in self._queues:
+                q.clear()
+            self._queued_bytes = 0
+            self._cond.notify_all()
+        if dropped:
+            self.counters.inc('dropped', dropped)
+
+    def wait_writable(self, max_bytes: int):
+        """Block while more than max_bytes of data is waiting to be written"""
+        with self._cond:
+            while self._running and self._queued_bytes > max_bytes:
+                self._cond.wait(1.0)
+
+    def connected(self) -> bool:
+        ws = self.get_websocket()
+        return bool(ws and ws.sock and ws.sock.connected)
+
+    def send_message(self, message: dict, priority: Optional[int] = None):
+        """Queue a JSON message (priority defaults to message_priority)"""
+        if priority is None:
+            priority = message_priority(message)
+        self._put(priority, json.dumps(message), websocket.ABNF.OPCODE_TEXT)
+
+    def send_binary_frame(self, frame: bytes, priority: int = PRIORITY_DATA):
+        self._put(priority, frame, websocket.ABNF.OPCODE_BINARY)
+
+    def _put(self, priority: int, payload: Union[str, bytes], opcode: int):
+        if not self.connected():
+            return
+        size = len(payload)
+        with self._cond:
+            if priority == PRIORITY_DATA:
+                while self._running and self._queued_bytes > self.max_queued_bytes:
+                    self._cond.wait(1.0)
+                self._queued_bytes += size
+            self._queues[priority].append((payload, opcode, time.monotonic()))
+            self._cond.notify_all()
+
+    def _next(self) -> Optional[Tuple[int, Union[str, bytes], int, float]]:
+        with self._cond:
+            while self._running and not any(self._queues):
+                self._cond.wait()
+            if not self._running:
+                return None
+            for priority, q in enumerate(self._queues):
+                if q:
+                    payload, opcode, queued_at = q.popleft()
+                    if priority == PRIORITY_DATA:
+                        self._queued_bytes -= len(payload)
+                        self._cond.notify_all()
+                    return priority, payload, opcode, queued_at
+        return None
+
+    def _write_loop(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            priority, payload, opcode, queued_at = item
+            ws = self.get_websocket()
+            if not (ws and ws.sock and ws.sock.connected):
+                self.counters.inc('dropped')
+                continue
+            try:
+                ws.send(payload, opcode=opcode)
+            except Exception as e:
+                self.counters.inc('send_errors')
+                self.logger.error(f"Error sending WebSocket message: {e}")
+                continue
+            self.counters.inc('sent')
+            self.send_latency[priority].observe((time.monotonic() - queued_at) * 1000)
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            depth = {name: len(q) for name, q in zip(PRIORITY_NAMES, self._queues)}
+            queued_bytes = self._queued_bytes
+        return {
+            'queue_depth': depth,
+            'queued_data_bytes': queued_bytes,
+            'counters': self.counters.snapshot(),
+            'send_latency_ms': {name: h.snapshot() for name, h in zip(PRIORITY_NAMES, self.send_latency)}
+        }
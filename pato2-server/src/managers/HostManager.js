@@ -1,11 +1,25 @@
 const { v4: uuidv4 } = require('uuid');
 const { logger } = require('../utils/logger');
+const {
+    CAP_BINARY_FRAMES,
+    CAP_FLOW_CONTROL,
+    CAP_STRIPED_LANES,
+    OP_DATA,
+    OP_UDP_DATA,
+    SUPPORTED_CAPABILITIES,
+    encodeFrame,
+    laneIndex
+} = require('../utils/tunnelProtocol');
 
 class HostManager {
     constructor() {
         this.activeHost = null;
         this.hosts = new Map(); // leaseId -> host info
         this.leaseTTL = parseInt(process.env.HOST_LEASE_TTL_MS) || 45000;
+        // Unacknowledged bytes per stream we accept from the host (flow control)
+        this.flowWindow = parseInt(process.env.FLOW_WINDOW_BYTES) || 256 * 1024;
+        // Upper bound for data lanes a host may stripe its streams over
+        this.maxLanes = parseInt(process.env.MAX_TUNNEL_LANES) || 8;
         
         // Start cleanup interval
         this.cleanupInterval = setInterval(() => {
@@ -44,6 +58,11 @@ class HostManager {
             ready: false,
             serverRunning: false,
             websocket: null,
+            capabilities: new Set(),
+            sendWindow: 0,
+            laneCount: 0,
+            lanes: new Map(), // lane index -> WebSocket
+            channelSockets: new Map(), // stream/UDP client -> WebSocket it was opened on
             connections: 0
         };
 
@@ -91,6 +110,21 @@ class HostManager {
         };
     }
 
+    /**
+     * Heartbeat received as a control message on the host's WebSocket
+     * @param {string} leaseId - Host lease ID (already authenticated by the WebSocket)
+     * @param {boolean} ready - Host ready status
+     * @param {boolean} serverRunning - Minecraft server status
+     * @returns {Object} Heartbeat result
+     */
+    socketHeartbeat(leaseId, ready = false, serverRunning = false) {
+        const host = this.hosts.get(leaseId);
+        if (!host) {
+            return { ok: false, error: 'Invalid leaseId' };
+        }
+        return this.heartbeat(host.token, leaseId, ready, serverRunning);
+    }
+
     /**
      * End host lease
      * @param {string} token - Host token
@@ -127,19 +161,193 @@ class HostManager {
         const host = this.hosts.get(leaseId);
         if (host) {
             host.websocket = ws;
+            host.capabilities = new Set();
+            host.sendWindow = 0;
+            host.laneCount = 0;
             host.lastHeartbeat = Date.now();
         }
     }
 
+    /**
+     * Attach a data lane WebSocket to host
+     * @param {string} leaseId - Host lease ID
+     * @param {number} index - Lane index
+     * @param {WebSocket} ws - WebSocket connection
+     * @returns {boolean} Whether the lane was accepted
+     */
+    attachLane(leaseId, index, ws) {
+        const host = this.hosts.get(leaseId);
+        if (!host || !host.websocket || index < 0 || index >= host.laneCount) {
+            return false;
+        }
+        const previous = host.lanes.get(index);
+        if (previous && previous !== ws) {
+            previous.close(1000, 'Lane replaced');
+        }
+        host.lanes.set(index, ws);
+        return true;
+    }
+
+    /**
+     * Detach a data lane WebSocket from host
+     * @param {string} leaseId - Host lease ID
+     * @param {number} index - Lane index
+     * @param {WebSocket} ws - WebSocket connection that closed
+     * @returns {boolean} Whether it was the current lane
+     */
+    detachLane(leaseId, index, ws) {
+        const host = this.hosts.get(leaseId);
+        if (!host || host.lanes.get(index) !== ws) {
+            return false;
+        }
+        host.lanes.delete(index);
+        return host.laneCount > 0;
+    }
+
+    /**
+     * Lane a stream/UDP client of the active host is striped onto
+     * @param {string} channelId - Stream or UDP client identifier
+     * @returns {number} Lane index, -1 when the host does not use lanes
+     */
+    activeHostLaneIndex(channelId) {
+        if (!this.activeHost || this.activeHost.laneCount <= 0) {
+            return -1;
+        }
+        return laneIndex(channelId, this.activeHost.laneCount);
+    }
+
+    /**
+     * Pin a new stream/UDP client of the active host to one WebSocket for its lifetime:
+     * its lane if connected, else the primary one. Call before sending its open message.
+     * @param {string} channelId - Stream or UDP client identifier
+     */
+    pinChannel(channelId) {
+        const host = this.activeHost;
+        if (!host || host.laneCount <= 0) {
+            return;
+        }
+        const lane = host.lanes.get(this.activeHostLaneIndex(channelId));
+        host.channelSockets.set(channelId, lane && lane.readyState === lane.OPEN ? lane : host.websocket);
+    }
+
+    /**
+     * Forget the WebSocket of a closed stream/UDP client
+     * @param {string} channelId - Stream or UDP client identifier
+     */
+    unpinChannel(channelId) {
+        if (this.activeHost) {
+            this.activeHost.channelSockets.delete(channelId);
+        }
+    }
+
+    /**
+     * Streams/UDP clients of the active host pinned to a WebSocket
+     * @param {WebSocket} ws - Lane or primary WebSocket
+     * @returns {string[]} Channel identifiers
+     */
+    channelsOnSocket(ws) {
+        if (!this.activeHost) {
+            return [];
+        }
+        return Array.from(this.activeHost.channelSockets.entries())
+            .filter(([, pinned]) => pinned === ws)
+            .map(([channelId]) => channelId);
+    }
+
+    /**
+     * WebSocket to use for a channel. A pinned channel only ever uses the socket it was
+     * opened on (null once that socket is down, never another one, so its bytes stay in order).
+     * @param {string|null} channelId - Stream or UDP client identifier, null for control
+     * @returns {WebSocket|null} WebSocket or null
+     */
+    socketFor(channelId) {
+        if (!this.activeHost) {
+            return null;
+        }
+        const pinned = channelId ? this.activeHost.channelSockets.get(channelId) : undefined;
+        if (pinned) {
+            return pinned.readyState === pinned.OPEN ? pinned : null;
+        }
+        return this.activeHost.websocket;
+    }
+
+    /**
+     * Negotiate tunnel capabilities announced by the host
+     * @param {string} leaseId - Host lease ID
+     * @param {string[]} capabilities - Capabilities offered by the host
+     * @param {number} window - Unacknowledged bytes per stream the host accepts from us
+     * @param {number} lanes - Data lanes requested by the host
+     * @returns {string[]} Accepted capabilities
+     */
+    negotiateCapabilities(leaseId, capabilities = [], window = 0, lanes = 0) {
+        const host = this.hosts.get(leaseId);
+        if (!host) {
+            return [];
+        }
+
+        const accepted = capabilities.filter(c => SUPPORTED_CAPABILITIES.includes(c));
+        host.capabilities = new Set(accepted);
+        host.sendWindow = accepted.includes(CAP_FLOW_CONTROL) ? Math.max(0, parseInt(window) || 0) : 0;
+        host.laneCount = accepted.includes(CAP_STRIPED_LANES)
+            ? Math.max(0, Math.min(this.maxLanes, parseInt(lanes) || 0))
+            : 0;
+        logger.info(`Host ${leaseId} tunnel capabilities: ${accepted.join(', ') || 'none'}`);
+        return accepted;
+    }
+
+    /**
+     * Bytes from the active host to flush to clients per ack. The host's send window is
+     * min(its own FLOW_WINDOW_BYTES, ours); it announced a receive window no larger than
+     * its own setting, so a quarter of min(announced, ours) is under a quarter of its window.
+     * @returns {number} Threshold in bytes
+     */
+    activeHostAckThreshold() {
+        const hostWindow = this.activeHost ? this.activeHost.sendWindow : 0;
+        const window = hostWindow > 0 ? Math.min(hostWindow, this.flowWindow) : this.flowWindow;
+        return Math.max(1, Math.floor(window / 4));
+    }
+
+    /**
+     * Flow control window for data sent to the active host
+     * @returns {number} Window in bytes, 0 when flow control is off
+     */
+    activeHostSendWindow() {
+        if (!this.activeHostSupports(CAP_FLOW_CONTROL)) {
+            return 0;
+        }
+        return this.activeHost.sendWindow;
+    }
+
+    /**
+     * Check if the active host negotiated a capability
+     * @param {string} capability - Capability name
+     * @returns {boolean} Support status
+     */
+    activeHostSupports(capability) {
+        return !!(this.activeHost && this.activeHost.capabilities.has(capability));
+    }
+
     /**
      * Detach WebSocket from host
      * @param {string} leaseId - Host lease ID
+     * @param {WebSocket} ws - WebSocket connection that closed
+     * @returns {boolean} Whether it was the host's current connection (a late close of a
+     *     replaced one must not tear down the tunnel that took over)
      */
-    detachWebSocket(leaseId) {
+    detachWebSocket(leaseId, ws) {
         const host = this.hosts.get(leaseId);
-        if (host) {
-            host.websocket = null;
+        if (!host || host.websocket !== ws) {
+            return false;
         }
+        host.websocket = null;
+        host.capabilities = new Set();
+        host.laneCount = 0;
+        for (const lane of host.lanes.values()) {
+            lane.close(1000, 'Control connection closed');
+        }
+        host.lanes.clear();
+        host.channelSockets.clear();
+        return true;
     }
 
     /**
@@ -156,15 +364,17 @@ class HostManager {
     /**
      * Send message to active host
      * @param {Object} message - Message to send
+     * @param {string|null} channelId - Stream/UDP client the message belongs to (routes it to its lane)
      * @returns {boolean} Success status
      */
-    sendToActiveHost(message) {
-        if (!this.activeHost || !this.activeHost.websocket) {
+    sendToActiveHost(message, channelId = null) {
+        const ws = this.socketFor(channelId);
+        if (!ws) {
             return false;
         }
 
         try {
-            this.activeHost.websocket.send(JSON.stringify(message));
+            ws.send(JSON.stringify(message));
             return true;
         } catch (error) {
             logger.error('Error sending message to host:', error);
@@ -172,6 +382,61 @@ class HostManager {
         }
     }
 
+    /**
+     * Send raw binary frame to active host
+     * @param {Buffer} frame - Encoded frame
+     * @param {string|null} channelId - Stream/UDP client the frame belongs to (routes it to its lane)
+     * @returns {boolean} Success status
+     */
+    sendFrameToActiveHost(frame, channelId = null) {
+        const ws = this.socketFor(channelId);
+        if (!ws) {
+            return false;
+        }
+
+        try {
+            ws.send(frame, { binary: true });
+            return true;
+        } catch (error) {
+            logger.error('Error sending frame to host:', error);
+            return false;
+        }
+    }
+
+    /**
+     * Send stream payload to active host using the negotiated framing
+     * @param {string} streamId - Stream identifier
+     * @param {Buffer} data - Raw payload
+     * @returns {boolean} Success status
+     */
+    sendStreamData(streamId, data) {
+        if (this.activeHostSupports(CAP_BINARY_FRAMES)) {
+            return this.sendFrameToActiveHost(encodeFrame(OP_DATA, streamId, data), streamId);
+        }
+        return this.sendToActiveHost({
+            type: 'data',
+            streamId,
+            data: data.toString('base64')
+        }, streamId);
+    }
+
+    /**
+     * Send UDP datagram to active host using the negotiated framing
+     * @param {string} clientId - UDP client identifier
+     * @param {Buffer} data - Raw datagram
+     * @returns {boolean} Success status
+     */
+    sendUdpData(clientId, data) {
+        if (this.activeHostSupports(CAP_BINARY_FRAMES)) {
+            return this.sendFrameToActiveHost(encodeFrame(OP_UDP_DATA, clientId, data), clientId);
+        }
+        return this.sendToActiveHost({
+            type: 'udp_data',
+            clientId,
+            data: data.toString('base64')
+        }, clientId);
+    }
+
     /**
      * Get host by lease ID
      * @param {string} leaseId - Host lease ID
@@ -1,5 +1,7 @@
 const { v4: uuidv4 } = require('uuid');
 const { logger } = require('../utils/logger');
+const { CAP_FLOW_CONTROL, CAP_STREAM_RESUME } = require('../utils/tunnelProtocol');
+const ReplayBuffer = require('../utils/replayBuffer');
 
 class ProxyManager {
     constructor(hostManager) {
@@ -12,6 +14,11 @@ class ProxyManager {
             bytesTransferred: 0,
             errors: 0
         };
+        // Stream resumption: players are held this long for the host tunnel to come back
+        this.resumeGraceMs = parseInt(process.env.STREAM_RESUME_GRACE_MS) || 30000;
+        this.resumeBufferBytes = parseInt(process.env.RESUME_BUFFER_BYTES) || 1024 * 1024;
+        this.suspended = false;
+        this.resumeTimer = null;
     }
 
     /**
@@ -52,7 +59,21 @@ class ProxyManager {
             clientAddress,
             startTime: Date.now(),
             bytesFromClient: 0,
-            bytesToClient: 0
+            bytesToClient: 0,
+            // Flow control: bytes sent to the host it has not acknowledged yet
+            inFlightToHost: 0,
+            paused: false,
+            // Bytes from the host flushed to the client but not yet acknowledged
+            unackedFromHost: 0,
+            bufferedToClient: 0,
+            // Stream resumption: bytes sent to the host it may not have yet, bytes received from it,
+            // bytes it acknowledged, and bytes still being flushed when it resumed (already acked)
+            replay: this.hostManager.activeHostSupports(CAP_STREAM_RESUME)
+                ? new ReplayBuffer(this.resumeBufferBytes)
+                : null,
+            receivedFromHost: 0,
+            ackedByHost: 0,
+            ackSkip: 0
         });
 
         // Update stats
@@ -68,7 +89,8 @@ class ProxyManager {
             targetPort: listenPort
         };
 
-        if (!this.hostManager.sendToActiveHost(openMessage)) {
+        this.hostManager.pinChannel(streamId);
+        if (!this.hostManager.sendToActiveHost(openMessage, streamId)) {
             logger.error(`Failed to send open message for stream ${streamId}`);
             this.closeClientConnection(streamId, 'Host communication failed');
             return;
@@ -121,25 +143,102 @@ class ProxyManager {
         connection.bytesFromClient += data.length;
         this.stats.bytesTransferred += data.length;
 
-        // Send data to host
-        const dataMessage = {
-            type: 'data',
-            streamId,
-            data: data.toString('base64')
-        };
+        if (connection.replay) {
+            connection.replay.append(data);
+        }
+
+        // Tunnel down: keep the bytes for replay and stop reading until the host resumes
+        if (this.suspended && connection.replay) {
+            this.pauseClient(streamId, connection);
+            return;
+        }
 
-        if (!this.hostManager.sendToActiveHost(dataMessage)) {
+        // Send data to host
+        if (!this.hostManager.sendStreamData(streamId, data)) {
+            if (connection.replay) {
+                // The tunnel is closing; the bytes are replayed if the host resumes the stream
+                this.pauseClient(streamId, connection);
+                return;
+            }
             logger.error(`Failed to send data for stream ${streamId}`);
             this.closeClientConnection(streamId, 'Host communication failed');
+            return;
+        }
+
+        // Stop reading from the player while the host has a full window
+        const window = this.hostManager.activeHostSendWindow();
+        if (window > 0) {
+            connection.inFlightToHost += data.length;
+            if (connection.inFlightToHost >= window) {
+                this.pauseClient(streamId, connection);
+            }
+        }
+    }
+
+    /**
+     * Stop reading from a player
+     * @param {string} streamId - Stream identifier
+     * @param {Object} connection - Connection info
+     */
+    pauseClient(streamId, connection) {
+        if (!connection.paused) {
+            connection.paused = true;
+            this.clientSockets.get(streamId).pause();
+        }
+    }
+
+    /**
+     * Handle flow control ack from host
+     * @param {string} streamId - Stream identifier
+     * @param {number} bytes - Bytes the host delivered to the Minecraft server
+     */
+    handleHostAck(streamId, bytes) {
+        const connection = this.activeConnections.get(streamId);
+        if (!connection) {
+            return;
+        }
+
+        const acked = parseInt(bytes) || 0;
+        connection.inFlightToHost = Math.max(0, connection.inFlightToHost - acked);
+        if (connection.replay) {
+            connection.ackedByHost += acked;
+            connection.replay.trim(connection.ackedByHost);
+        }
+        if (connection.paused && !this.suspended
+            && connection.inFlightToHost < this.hostManager.activeHostSendWindow()) {
+            connection.paused = false;
+            const clientSocket = this.clientSockets.get(streamId);
+            if (clientSocket && !clientSocket.destroyed) {
+                clientSocket.resume();
+            }
+        }
+    }
+
+    /**
+     * Acknowledge host data once flushed to the client
+     * @param {string} streamId - Stream identifier
+     * @param {Object} connection - Connection info
+     * @param {number} length - Bytes flushed
+     */
+    ackHostData(streamId, connection, length) {
+        connection.bufferedToClient -= length;
+        const skipped = Math.min(connection.ackSkip, length);
+        connection.ackSkip -= skipped;
+        connection.unackedFromHost += length - skipped;
+        const threshold = this.hostManager.activeHostAckThreshold();
+        if (connection.unackedFromHost >= threshold) {
+            const bytes = connection.unackedFromHost;
+            connection.unackedFromHost = 0;
+            this.hostManager.sendToActiveHost({ type: 'ack', streamId, bytes }, streamId);
         }
     }
 
     /**
      * Handle data from host
      * @param {string} streamId - Stream identifier
-     * @param {string} base64Data - Base64 encoded data from host
+     * @param {string|Buffer} payload - Base64 encoded (JSON) or raw (binary frame) data from host
      */
-    handleHostData(streamId, base64Data) {
+    handleHostData(streamId, payload) {
         const clientSocket = this.clientSockets.get(streamId);
         const connection = this.activeConnections.get(streamId);
         
@@ -149,14 +248,20 @@ class ProxyManager {
         }
 
         try {
-            const data = Buffer.from(base64Data, 'base64');
+            const data = Buffer.isBuffer(payload) ? payload : Buffer.from(payload, 'base64');
             
             // Update stats
             connection.bytesToClient += data.length;
+            connection.receivedFromHost += data.length;
             this.stats.bytesTransferred += data.length;
             
-            // Send to client
-            clientSocket.write(data);
+            // Send to client, acknowledging to the host once flushed
+            if (this.hostManager.activeHostSupports(CAP_FLOW_CONTROL)) {
+                connection.bufferedToClient += data.length;
+                clientSocket.write(data, () => this.ackHostData(streamId, connection, data.length));
+            } else {
+                clientSocket.write(data);
+            }
         } catch (error) {
             logger.error(`Error handling host data for ${streamId}:`, error);
             this.closeClientConnection(streamId, 'Data processing error');
@@ -207,8 +312,9 @@ class ProxyManager {
                 type: 'close',
                 streamId
             };
-            this.hostManager.sendToActiveHost(closeMessage);
+            this.hostManager.sendToActiveHost(closeMessage, streamId);
         }
+        this.hostManager.unpinChannel(streamId);
 
         // Clean up
         this.clientSockets.delete(streamId);
@@ -233,6 +339,120 @@ class ProxyManager {
         }
     }
 
+    /**
+     * Close the connections pinned to a tunnel lane that disconnected
+     * @param {number} laneIndex - Lane index
+     * @param {WebSocket} ws - Lane WebSocket that closed
+     */
+    closeLaneConnections(laneIndex, ws) {
+        const streamIds = this.hostManager.channelsOnSocket(ws)
+            .filter(streamId => this.activeConnections.has(streamId));
+        if (streamIds.length > 0) {
+            logger.warn(`Tunnel lane ${laneIndex} lost, closing ${streamIds.length} connection(s)`);
+        }
+        for (const streamId of streamIds) {
+            this.closeClientConnection(streamId, 'Tunnel lane lost');
+        }
+    }
+
+    /**
+     * Hold resumable connections after the host tunnel dropped, closing the rest
+     */
+    suspendConnections() {
+        const streamIds = Array.from(this.activeConnections.keys());
+        const held = streamIds.filter(streamId => this.activeConnections.get(streamId).replay);
+        for (const streamId of streamIds) {
+            if (!held.includes(streamId)) {
+                this.closeClientConnection(streamId, 'Host disconnected');
+            }
+        }
+        if (held.length === 0) {
+            return;
+        }
+
+        logger.warn(`Host tunnel lost, holding ${held.length} connection(s) for ${this.resumeGraceMs}ms`);
+        this.suspended = true;
+        for (const streamId of held) {
+            this.pauseClient(streamId, this.activeConnections.get(streamId));
+        }
+        clearTimeout(this.resumeTimer);
+        this.resumeTimer = setTimeout(() => {
+            this.endSuspension();
+            this.closeAllConnections('Host did not resume streams');
+        }, this.resumeGraceMs);
+    }
+
+    /**
+     * Stop holding connections (resumed or abandoned)
+     */
+    endSuspension() {
+        clearTimeout(this.resumeTimer);
+        this.resumeTimer = null;
+        this.suspended = false;
+    }
+
+    /**
+     * Resume held connections the host still has, replaying what it did not receive
+     * @param {Array<{streamId: string, received: number}>} streams - Streams the host asks for and
+     *     the bytes it received on each
+     * @returns {Array<{streamId: string, received: number}>} Resumed streams and the bytes received from the host
+     */
+    resumeConnections(streams = []) {
+        this.endSuspension();
+        const requested = new Map();
+        for (const entry of Array.isArray(streams) ? streams : []) {
+            if (entry && typeof entry.streamId === 'string') {
+                requested.set(entry.streamId, parseInt(entry.received) || 0);
+            }
+        }
+
+        const resumed = [];
+        for (const [streamId, connection] of Array.from(this.activeConnections.entries())) {
+            const pending = connection.replay && requested.has(streamId)
+                ? connection.replay.since(requested.get(streamId))
+                : null;
+            if (pending === null) {
+                this.closeClientConnection(streamId, 'Stream could not be resumed');
+                continue;
+            }
+            resumed.push({ streamId, connection, received: requested.get(streamId), pending });
+        }
+
+        // Report our offsets before replaying so the host replays what we missed in turn
+        const ack = resumed.map(({ streamId, connection }) => ({
+            streamId,
+            received: connection.receivedFromHost
+        }));
+        this.hostManager.sendToActiveHost({ type: 'resume_ack', streams: ack });
+
+        const window = this.hostManager.activeHostSendWindow();
+        for (const { streamId, connection, received, pending } of resumed) {
+            // Restart flow control from the offsets both sides reported
+            connection.ackedByHost = received;
+            connection.replay.trim(received);
+            connection.inFlightToHost = window > 0 ? pending.length : 0;
+            connection.unackedFromHost = 0;
+            connection.ackSkip = connection.bufferedToClient;
+
+            if (pending.length > 0 && !this.hostManager.sendStreamData(streamId, pending)) {
+                this.closeClientConnection(streamId, 'Host communication failed');
+                continue;
+            }
+            if (connection.paused && (window === 0 || connection.inFlightToHost < window)) {
+                connection.paused = false;
+                const clientSocket = this.clientSockets.get(streamId);
+                if (clientSocket && !clientSocket.destroyed) {
+                    clientSocket.resume();
+                }
+            }
+        }
+
+        if (resumed.length > 0) {
+            logger.info(`Resumed ${resumed.length} connection(s) after host reconnect`);
+        }
+        return ack;
+    }
+
     /**
      * Get proxy statistics
      * @returns {Object} Proxy statistics
@@ -243,11 +463,15 @@ class ProxyManager {
             clientAddress: conn.clientAddress,
             duration: Date.now() - conn.startTime,
             bytesFromClient: conn.bytesFromClient,
-            bytesToClient: conn.bytesToClient
+            bytesToClient: conn.bytesToClient,
+            inFlightToHost: conn.inFlightToHost,
+            bufferedToClient: conn.bufferedToClient,
+            replayBytes: conn.replay ? conn.replay.length : null
         }));
 
         return {
             ...this.stats,
+            suspended: this.suspended,
             connections,
             uptime: process.uptime()
         };
@@ -299,6 +523,7 @@ class ProxyManager {
      * Cleanup resources
      */
     destroy() {
+        this.endSuspension();
         this.closeAllConnections('Proxy manager destroyed');
     }
 }
@@ -16,6 +16,15 @@ const ProxyManager = require('./managers/ProxyManager');
 const apiRoutes = require('./routes/api');
 const webRoutes = require('./routes/web');
 const { logger } = require('./utils/logger');
+const {
+    PROTOCOL_VERSION,
+    CAP_STREAM_RESUME,
+    OP_DATA,
+    OP_UDP_DATA,
+    OP_BATCH,
+    decodeFrame,
+    decodeBatch
+} = require('./utils/tunnelProtocol');
 
 class Pato2Server {
     constructor() {
@@ -128,14 +137,23 @@ class Pato2Server {
             return;
         }
 
+        if (url.searchParams.has('lane')) {
+            this.handleHostLaneWebSocket(ws, leaseId, parseInt(url.searchParams.get('lane')));
+            return;
+        }
+
         // Attach WebSocket to host
         this.hostManager.attachWebSocket(leaseId, ws);
         logger.info(`Host WebSocket connected: ${leaseId}`);
 
-        ws.on('message', (data) => {
+        ws.on('message', (data, isBinary) => {
             try {
+                if (isBinary) {
+                    this.handleHostFrame(leaseId, data);
+                    return;
+                }
                 const message = JSON.parse(data);
-                this.handleHostMessage(leaseId, message);
+                this.handleHostMessage(leaseId, ws, message);
             } catch (error) {
                 logger.error('Invalid WebSocket message:', error);
             }
@@ -143,7 +161,17 @@ class Pato2Server {
 
         ws.on('close', () => {
             logger.info(`Host WebSocket disconnected: ${leaseId}`);
-            this.hostManager.detachWebSocket(leaseId);
+            // Checked before detaching, which forgets the negotiated capabilities
+            const host = this.hostManager.getHostByLeaseId(leaseId);
+            const resumable = !!host && host === this.hostManager.activeHost
+                && this.hostManager.activeHostSupports(CAP_STREAM_RESUME);
+            if (!this.hostManager.detachWebSocket(leaseId, ws)) {
+                // Replaced by a newer connection of the same host, which keeps the tunnel
+                return;
+            }
+            if (resumable) {
+                this.proxyManager.suspendConnections();
+            }
         });
 
         ws.on('error', (error) => {
@@ -160,38 +188,89 @@ class Pato2Server {
         }, 30000);
     }
 
-    handleHostMessage(leaseId, message) {
+    handleHostLaneWebSocket(ws, leaseId, index) {
+        if (!this.hostManager.attachLane(leaseId, index, ws)) {
+            ws.close(1008, 'Invalid lane');
+            return;
+        }
+        logger.info(`Host tunnel lane ${index} connected: ${leaseId}`);
+
+        ws.on('message', (data, isBinary) => {
+            try {
+                if (isBinary) {
+                    this.handleHostFrame(leaseId, data);
+                    return;
+                }
+                this.handleHostMessage(leaseId, ws, JSON.parse(data));
+            } catch (error) {
+                logger.error('Invalid WebSocket lane message:', error);
+            }
+        });
+
+        ws.on('close', () => {
+            logger.info(`Host tunnel lane ${index} disconnected: ${leaseId}`);
+            // Streams stay pinned to the socket they were opened on, even one already replaced
+            this.hostManager.detachLane(leaseId, index, ws);
+            this.proxyManager.closeLaneConnections(index, ws);
+            for (const clientId of this.hostManager.channelsOnSocket(ws)) {
+                this.removeUdpSession(clientId);
+            }
+        });
+
+        ws.on('error', (error) => {
+            logger.error(`Host tunnel lane ${index} error for ${leaseId}:`, error);
+        });
+    }
+
+    handleHostMessage(leaseId, ws, message) {
         const { type, streamId, data } = message;
 
         switch (type) {
+            case 'hello': {
+                const offered = Array.isArray(message.capabilities) ? message.capabilities : [];
+                const accepted = this.hostManager.negotiateCapabilities(
+                    leaseId, offered, message.window, message.lanes
+                );
+                const host = this.hostManager.getHostByLeaseId(leaseId);
+                ws.send(JSON.stringify({
+                    type: 'hello_ack',
+                    version: PROTOCOL_VERSION,
+                    capabilities: accepted,
+                    window: this.hostManager.flowWindow,
+                    lanes: host ? host.laneCount : 0
+                }));
+                // Held connections cannot come back over a tunnel without resumption
+                if (this.proxyManager.suspended && !accepted.includes(CAP_STREAM_RESUME)) {
+                    this.proxyManager.endSuspension();
+                    this.proxyManager.closeAllConnections('Host reconnected without stream resume');
+                }
+                break;
+            }
+            case 'resume':
+                this.proxyManager.resumeConnections(message.streams);
+                break;
+            case 'ack':
+                this.proxyManager.handleHostAck(streamId, message.bytes);
+                break;
             case 'pong':
                 this.hostManager.updateHeartbeat(leaseId);
                 break;
+            case 'heartbeat': {
+                const result = this.hostManager.socketHeartbeat(
+                    leaseId, !!message.ready, !!message.serverRunning
+                );
+                ws.send(JSON.stringify({ type: 'heartbeat_ack', sentAt: message.sentAt, ...result }));
+                break;
+            }
             case 'data':
                 this.proxyManager.handleHostData(streamId, data);
                 break;
-            case 'udp_data': {
-                const { clientId } = message;
-                const session = this.udpSessions.get(clientId);
-                if (!session) break;
-                const udpServer = this.udpServersByPort.get(session.listenPort);
-                if (!udpServer) break;
-                try {
-                    const buf = Buffer.from(data, 'base64');
-                    udpServer.send(buf, session.remotePort, session.remoteAddress);
-                    session.lastSeen = Date.now();
-                } catch (err) {
-                    logger.error(`UDP send error for client ${clientId}:`, err);
-                }
+            case 'udp_data':
+                this.relayUdpToClient(message.clientId, Buffer.from(data, 'base64'));
                 break;
-            }
             case 'udp_close': {
                 const { clientId } = message;
-                const session = this.udpSessions.get(clientId);
-                if (!session) break;
-                const remoteKey = `${session.listenPort}:${session.remoteAddress}:${session.remotePort}`;
-                this.udpSessions.delete(clientId);
-                this.udpRemoteKeyToClientId.delete(remoteKey);
+                this.removeUdpSession(clientId);
                 break;
             }
             case 'close':
@@ -205,6 +284,43 @@ class Pato2Server {
         }
     }
 
+    handleHostFrame(leaseId, frame) {
+        let records;
+        try {
+            const decoded = decodeFrame(frame);
+            records = decoded.opcode === OP_BATCH ? decodeBatch(decoded.payload) : [decoded];
+        } catch (error) {
+            logger.error(`Invalid binary frame from host ${leaseId}:`, error);
+            return;
+        }
+
+        for (const record of records) {
+            switch (record.opcode) {
+                case OP_DATA:
+                    this.proxyManager.handleHostData(record.channelId, record.payload);
+                    break;
+                case OP_UDP_DATA:
+                    this.relayUdpToClient(record.channelId, record.payload);
+                    break;
+                default:
+                    logger.warn(`Unknown binary frame opcode from host ${leaseId}: ${record.opcode}`);
+            }
+        }
+    }
+
+    relayUdpToClient(clientId, buf) {
+        const session = this.udpSessions.get(clientId);
+        if (!session) return;
+        const udpServer = this.udpServersByPort.get(session.listenPort);
+        if (!udpServer) return;
+        try {
+            udpServer.send(buf, session.remotePort, session.remoteAddress);
+            session.lastSeen = Date.now();
+        } catch (err) {
+            logger.error(`UDP send error for client ${clientId}:`, err);
+        }
+    }
+
     setupTCPProxy() {
         const portsEnv = process.env.PROXY_TCP_PORTS || process.env.PROXY_TCP_PORT || '25565';
         const proxyPorts = portsEnv
@@ -257,22 +373,18 @@ class Pato2Server {
                         remotePort: rinfo.port,
                         lastSeen: Date.now(),
                     });
+                    this.hostManager.pinChannel(clientId);
                     this.hostManager.sendToActiveHost({
                         type: 'udp_open',
                         clientId,
                         targetPort: proxyPort,
-                    });
+                    }, clientId);
                 }
 
                 const session = this.udpSessions.get(clientId);
                 if (session) session.lastSeen = Date.now();
 
-                const dataB64 = msg.toString('base64');
-                this.hostManager.sendToActiveHost({
-                    type: 'udp_data',
-                    clientId,
-                    data: dataB64,
-                });
+                this.hostManager.sendUdpData(clientId, msg);
             });
 
             udpServer.on('listening', () => {
@@ -291,16 +403,23 @@ class Pato2Server {
                 const now = Date.now();
                 for (const [clientId, session] of this.udpSessions.entries()) {
                     if (now - session.lastSeen > ttlMs) {
-                        this.hostManager.sendToActiveHost({ type: 'udp_close', clientId });
-                        const remoteKey = `${session.listenPort}:${session.remoteAddress}:${session.remotePort}`;
-                        this.udpSessions.delete(clientId);
-                        this.udpRemoteKeyToClientId.delete(remoteKey);
+                        this.hostManager.sendToActiveHost({ type: 'udp_close', clientId }, clientId);
+                        this.removeUdpSession(clientId);
                     }
                 }
             }, Math.max(5000, Math.floor(ttlMs / 2)));
         }
     }
 
+    removeUdpSession(clientId) {
+        const session = this.udpSessions.get(clientId);
+        if (!session) return;
+        const remoteKey = `${session.listenPort}:${session.remoteAddress}:${session.remotePort}`;
+        this.udpSessions.delete(clientId);
+        this.udpRemoteKeyToClientId.delete(remoteKey);
+        this.hostManager.unpinChannel(clientId);
+    }
+
     setupGracefulShutdown() {
         const shutdown = (signal) => {
             logger.info(`Received ${signal}, shutting down gracefully...`);
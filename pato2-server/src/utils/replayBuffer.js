@@ -0,0 +1,67 @@
+/**
+ * Bounded record of the bytes sent on a stream, replayed after a tunnel reconnect.
+ * Offsets count every byte ever sent; the buffer holds [start, end).
+ */
+class ReplayBuffer {
+    /**
+     * @param {number} maxBytes - Bytes kept before the oldest are dropped
+     */
+    constructor(maxBytes) {
+        this.maxBytes = maxBytes;
+        this.chunks = [];
+        this.start = 0;
+        this.length = 0;
+    }
+
+    get end() {
+        return this.start + this.length;
+    }
+
+    /**
+     * Record bytes sent to the peer, dropping the oldest ones over maxBytes
+     * @param {Buffer} data - Bytes sent
+     */
+    append(data) {
+        this.chunks.push(Buffer.from(data));
+        this.length += data.length;
+        if (this.length > this.maxBytes) {
+            this.trim(this.end - this.maxBytes);
+        }
+    }
+
+    /**
+     * Forget bytes before offset (the peer has them)
+     * @param {number} offset - Stream offset
+     */
+    trim(offset) {
+        let drop = Math.min(offset - this.start, this.length);
+        while (drop > 0 && this.chunks.length > 0) {
+            const head = this.chunks[0];
+            if (head.length <= drop) {
+                this.chunks.shift();
+                this.start += head.length;
+                this.length -= head.length;
+                drop -= head.length;
+            } else {
+                this.chunks[0] = head.subarray(drop);
+                this.start += drop;
+                this.length -= drop;
+                drop = 0;
+            }
+        }
+    }
+
+    /**
+     * Bytes from offset to the end
+     * @param {number} offset - Stream offset the peer received up to
+     * @returns {Buffer|null} Bytes to replay, null if offset is no longer (or not yet) covered
+     */
+    since(offset) {
+        if (offset < this.start || offset > this.end) {
+            return null;
+        }
+        return Buffer.concat(this.chunks).subarray(offset - this.start);
+    }
+}
+
+module.exports = ReplayBuffer;
@@ -0,0 +1,127 @@
+/**
+ * Binary frame format shared with the host agent for tunnel payloads.
+ * Layout: [opcode:u8][id_len:u8][id:ascii][payload...]
+ */
+
+const PROTOCOL_VERSION = 1;
+
+const CAP_BINARY_FRAMES = 'binary_frames';
+const CAP_FLOW_CONTROL = 'flow_control';
+const CAP_BATCH_FRAMES = 'batch_frames';
+const CAP_STRIPED_LANES = 'striped_lanes';
+// Lease heartbeats sent as 'heartbeat' control messages instead of HTTP polls
+const CAP_WS_HEARTBEAT = 'ws_heartbeat';
+// Streams survive a host reconnect: both sides replay what the other did not receive
+const CAP_STREAM_RESUME = 'stream_resume';
+
+const OP_DATA = 0x01;
+const OP_UDP_DATA = 0x02;
+// Several [opcode][id_len][id][len:u32be][payload] records packed into one frame
+const OP_BATCH = 0x03;
+
+// Capabilities this server is able to speak
+const SUPPORTED_CAPABILITIES = [
+    CAP_BINARY_FRAMES, CAP_FLOW_CONTROL, CAP_BATCH_FRAMES, CAP_STRIPED_LANES, CAP_WS_HEARTBEAT,
+    CAP_STREAM_RESUME
+];
+
+/**
+ * Data lane carrying a stream/UDP client (FNV-1a, must match the host agent)
+ * @param {string} channelId - Stream or UDP client identifier
+ * @param {number} laneCount - Number of lanes
+ * @returns {number} Lane index
+ */
+function laneIndex(channelId, laneCount) {
+    let hash = 0x811c9dc5;
+    for (const byte of Buffer.from(channelId, 'ascii')) {
+        hash ^= byte;
+        hash = Math.imul(hash, 0x01000193) >>> 0;
+    }
+    return hash % laneCount;
+}
+
+/**
+ * Encode a binary tunnel frame
+ * @param {number} opcode - Frame opcode
+ * @param {string} channelId - Stream or UDP client identifier
+ * @param {Buffer} payload - Raw payload
+ * @returns {Buffer} Encoded frame
+ */
+function encodeFrame(opcode, channelId, payload) {
+    const id = Buffer.from(channelId, 'ascii');
+    if (id.length > 255) {
+        throw new Error(`Channel id too long: ${id.length} bytes`);
+    }
+    const header = Buffer.from([opcode, id.length]);
+    return Buffer.concat([header, id, payload]);
+}
+
+/**
+ * Decode a binary tunnel frame
+ * @param {Buffer} frame - Encoded frame
+ * @returns {{opcode: number, channelId: string, payload: Buffer}} Decoded frame
+ */
+function decodeFrame(frame) {
+    if (frame.length < 2) {
+        throw new Error('Frame too short');
+    }
+    const idEnd = 2 + frame[1];
+    if (frame.length < idEnd) {
+        throw new Error('Truncated channel id');
+    }
+    return {
+        opcode: frame[0],
+        channelId: frame.toString('ascii', 2, idEnd),
+        payload: frame.subarray(idEnd)
+    };
+}
+
+/**
+ * Decode the records of an OP_BATCH frame body
+ * @param {Buffer} body - Batch frame payload
+ * @returns {Array<{opcode: number, channelId: string, payload: Buffer}>} Records
+ */
+function decodeBatch(body) {
+    const records = [];
+    let offset = 0;
+    while (offset < body.length) {
+        if (body.length - offset < 2) {
+            throw new Error('Truncated batch record');
+        }
+        const opcode = body[offset];
+        const idEnd = offset + 2 + body[offset + 1];
+        if (body.length < idEnd + 4) {
+            throw new Error('Truncated batch record header');
+        }
+        const length = body.readUInt32BE(idEnd);
+        const start = idEnd + 4;
+        if (body.length < start + length) {
+            throw new Error('Truncated batch record payload');
+        }
+        records.push({
+            opcode,
+            channelId: body.toString('ascii', offset + 2, idEnd),
+            payload: body.subarray(start, start + length)
+        });
+        offset = start + length;
+    }
+    return records;
+}
+
+module.exports = {
+    PROTOCOL_VERSION,
+    CAP_BINARY_FRAMES,
+    CAP_FLOW_CONTROL,
+    CAP_BATCH_FRAMES,
+    CAP_STRIPED_LANES,
+    CAP_WS_HEARTBEAT,
+    CAP_STREAM_RESUME,
+    OP_DATA,
+    OP_UDP_DATA,
+    OP_BATCH,
+    SUPPORTED_CAPABILITIES,
+    laneIndex,
+    encodeFrame,
+    decodeFrame,
+    decodeBatch
+};